@@ -10,20 +10,32 @@
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from datetime import timedelta
 from collections import defaultdict
 import re
 import matplotlib
 from scipy.stats import beta
 import matplotlib.pyplot as plt
-from dateutil.relativedelta import relativedelta
 import math
 import glob
+import os
 import pickle
 import time
 from mpl_toolkits.mplot3d import Axes3D
 from PIL import Image
 from matplotlib import gridspec
+from Tennis_Point_Store import read_point_store, point_store_path
+from Tennis_Score_States import weekly_state_cube, state_cube_before, cube_counts, win_pct_data
+from Tennis_Score_States import mirror_matchups, game_state_labels
+from Tennis_Player_Names import read_aliases, resolve_names, alias_player_ids, match_player_names
+from Tennis_Player_Names import read_name_matches, write_name_matches, alias_path, name_match_path
+from Tennis_Player_Names import players_path
+from Tennis_ATP_Matches import read_atp_matches, match_catalog, atp_path
+from Tennis_Rankings import open_ranking_store, rank_at, ranking_table, ranking_files
+from Tennis_Calendar import yyyymmdd_days, days_yyyymmdd, monday_of_week, month_window, tourney_year
+from Tennis_Calendar import today, date_string
+from Tennis_Stage_Report import run_stage, write_stage_report
+from Tennis_Compaction import compact_frame
+from Tennis_Data_Cache import cache_key, read_cache, write_cache
 
 #--------------------------------------------------------------------------------------------
 # Part 0: Mappings
@@ -52,27 +64,6 @@ game_states = {
     (40,45): '40-AD',
 }
 
-coordinate_states = {
-    'Start of Game': (0,0),
-    'Server 15-0': (1,1),
-    'Server 0-15': (1,-1),
-    'Server 15-15': (2,0),
-    'Server 30-0': (2,2),
-    'Server 0-30': (2,-2),
-    'Server 30-15': (3,1),
-    'Server 15-30': (3,-1),
-    'Server 30-30': (4,0),
-    'Server 40-0': (3,3),
-    'Server 40-15': (4,2),
-    'Server 40-30': (5,1),
-    'Server 0-40': (3,-3),
-    'Server 15-40': (4,-2),
-    'Server 30-40': (5,-1),
-    'Server 40-40': (6,0),
-    'Server AD-40': (7,1),
-    'Server 40-AD': (7,-1)
-}
-
 #--------------------------------------------------------------------------------------------
 # Base Probability Model Data that dictates chance of winning given chance of winning
 # point while serving/returning
@@ -80,6 +71,20 @@ coordinate_states = {
 
 game_data, set_data, tiebreak_data, match_data = dict(), dict(), dict(), dict()
 
+#--------------------------------------------------------------------------------------------
+# Rankings are not published every Monday, so each player is given the latest ranking
+# published at most ranking_tolerance days before the tourney week (0 for the same week only)
+#--------------------------------------------------------------------------------------------
+
+ranking_tolerance = 28
+
+#--------------------------------------------------------------------------------------------
+# Years of tour level matches (see Tennis_ATP_Matches) used for the tourneys and the
+# head-to-head records
+#--------------------------------------------------------------------------------------------
+
+match_years = (2010, 2015)
+
 
 #--------------------------------------------------------------------------------------------
 # Part 1: Data Retrieval
@@ -93,13 +98,10 @@ game_data, set_data, tiebreak_data, match_data = dict(), dict(), dict(), dict()
 #--------------------------------------------------------------------------------------------
 
 def get_rankings_players_point_data():
-    rankings = pd.read_csv('tennis_atp-master/atp_rankings_10s.csv',header=None)
-    rankings.columns = ['Week','Ranking','Player ID','Points']
-    rankings.index = rankings['Week']
+    rankings = open_ranking_store()
     players = pd.read_csv('tennis_atp-master/atp_players.csv',header=None)
     players.columns = ['Player ID','First','Last','L/R','DOB','Country']
-    all_point_data = pd.read_csv('All Point Data.csv',index_col=0)
-    point_data = all_point_data[['Challenger' not in x for x in all_point_data['Tourney']]]
+    point_data = read_point_store(levels=['atp_main'])
     
     return rankings, players, point_data
 
@@ -107,44 +109,27 @@ def get_rankings_players_point_data():
 # Get Relevant Match Data
 #--------------------------------------------------------------------------------------------
 
-def get_match_data():
-    match_10 = pd.read_csv('tennis_atp-master/atp_matches_2010.csv')
-    match_11 = pd.read_csv('tennis_atp-master/atp_matches_2011.csv')
-    match_12 = pd.read_csv('tennis_atp-master/atp_matches_2012.csv')
-    match_13 = pd.read_csv('tennis_atp-master/atp_matches_2013.csv')
-    match_14 = pd.read_csv('tennis_atp-master/atp_matches_2014.csv')
-    match_15 = pd.read_csv('tennis_atp-master/atp_matches_2015.csv')
-
-    all_matches = pd.concat([match_10, match_11, match_12, match_13, match_14, match_15], axis = 0)   
+def get_match_data(years=match_years):
+    all_matches = read_atp_matches(levels=['main'], years=years)
     return all_matches
 
-#--------------------------------------------------------------------------------------------
-# To Tie Matches with Point Data, we had to map the match 
-# dates to the Monday of that particular week
-#--------------------------------------------------------------------------------------------
-
-def getMondayOfDate(d):
-    date = datetime.strptime(str(d),'%Y%m%d')
-    wd = date.weekday()
-    if wd >= 5:
-        date = date + timedelta(days = 7 - wd)
-    elif wd == 0:
-        date = date + timedelta(days = 0 - wd)
-    else:
-        date = date + timedelta(days = 0 - wd)
-    return int(date.strftime('%Y%m%d'))
-
-
 #--------------------------------------------------------------------------------------------
 # Get Relevant Tournament Data, which includes:
 # Tournament Year, Name, Date and Surface
+# To Tie Matches with Point Data, the match dates are mapped to the Monday of that particular
+# week, and tourneys that began before the end of the previous year get the year they are
+# played in (see Tennis_Calendar)
 #--------------------------------------------------------------------------------------------
 
 def tourney_info(all_matches):
     tourney_results = all_matches.groupby(['tourney_name','tourney_date','surface']).count().index
-    unique_tourney = []
+    days = yyyymmdd_days(tourney_results.get_level_values('tourney_date'))
+    weeks = days_yyyymmdd(monday_of_week(days))
+    years = tourney_year(days) % 100
     
-    for t,d,s in tourney_results.values:
+    tourney_dict = defaultdict(dict)
+    for t, y, w, s in zip(tourney_results.get_level_values('tourney_name'), years, weeks,
+                          tourney_results.get_level_values('surface')):
         if t[-3:] == ' CH':
             t = t[:-3]
         elif t[-2:] == ' Q':
@@ -153,18 +138,7 @@ def tourney_info(all_matches):
             t = t[:-7]
         t = t.replace(" ", "")
         t = t.replace(".","")
-        
-        # Certain Tournament Began Before the End of the Previous Year - Adjusted accordingly
-        if d == 20131229 or d == 20131230:
-            unique_tourney.append(('14',t,getMondayOfDate(d),s))
-        elif d == 20121230 or d == 20121231:
-            unique_tourney.append(('13',t,getMondayOfDate(d),s))
-        else:
-            unique_tourney.append((str(d)[2:4],t,getMondayOfDate(d),s))
-            
-    tourney_dict = defaultdict(dict)
-    for a, b, c, d in unique_tourney: 
-        tourney_dict[a][b] = (c,d)
+        tourney_dict['%02d' % y][t] = (int(w), s)
         
     return tourney_dict
 
@@ -228,127 +202,88 @@ def changeCityName(year, city):
         return city
 
 #--------------------------------------------------------------------------------------------
-# Add Tournament Date and Surface to Point Data using Cleaning Code
-# From Above
+# Resolve (Year, Tourney) pairs to the Monday of the tourney week and the surface, using the
+# Cleaning Code From Above. Every pair is resolved once and the result is saved in
+# 'Tourney Weeks.csv'. A saved week and surface is used as it is, so a tourney that could
+# not be resolved can be fixed by filling in its row. Tourneys whose city is cleaned to ''
+# are left out on purpose; other tourneys that are not in tourney_dict are reported.
+# With save=False the saved rows are only read: nothing is written or reported (the file is
+# an input of the clean data cache, and should only change with the point data).
 #--------------------------------------------------------------------------------------------
 
-def add_tourney_surface_to_point_data(point_data, tourney_dict):
-    city_map = [getCityFromTourney(x) for x in point_data['Tourney'].values]
-    tourney_data = [tourney_dict[str(x)][changeCityName(x,y)][0] if changeCityName(x,y) != '' else ''
-                    for x,y in zip(point_data['Year'].values, city_map)] 
-    surface_data = [tourney_dict[str(x)][changeCityName(x,y)][1] if changeCityName(x,y) != '' else ''
-                    for x,y in zip(point_data['Year'].values, city_map)] 
-    
-    point_data['Tourney Week'] = tourney_data
-    point_data['Surface'] = surface_data
-    return point_data
+tourney_weeks_path = 'Tourney Weeks.csv'
+tourney_week_columns = ['Year','Tourney','City','Tourney Week','Surface']
+
+def read_tourney_weeks(path=tourney_weeks_path):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=tourney_week_columns)
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def resolve_tourneys(tourneys, tourney_dict, path=tourney_weeks_path, save=True):
+    saved = read_tourney_weeks(path)
+    saved = dict(((y, t), (c, w, s)) for y, t, c, w, s in saved[tourney_week_columns].values if w != '')
+    
+    resolved, unresolved = [], []
+    for year, tourney in tourneys[['Year','Tourney']].drop_duplicates().values:
+        year = str(year)
+        if (year, tourney) in saved:
+            city, week, surface = saved[(year, tourney)]
+            week = int(week)
+        else:
+            city = changeCityName(year, getCityFromTourney(tourney))
+            week, surface = tourney_dict[year].get(city, ('','')) if city != '' else ('','')
+            if city != '' and week == '':
+                unresolved.append((year, tourney, city))
+        resolved.append((year, tourney, city, week, surface))
+    
+    resolved = pd.DataFrame(resolved, columns=tourney_week_columns)
+    if not save:
+        return resolved
+    kept = read_tourney_weeks(path)
+    kept = kept[~(kept['Year'] + '|' + kept['Tourney']).isin(resolved['Year'] + '|' + resolved['Tourney'])]
+    pd.concat([kept, resolved.astype(str)]).sort_values(['Year','Tourney']).to_csv(path, index=False)
+    
+    if unresolved:
+        print str(len(unresolved)) + " Tourneys could not be Resolved:"
+        for year, tourney, city in unresolved:
+            print '    ' + year + ' ' + tourney + ' (' + city + ')'
+    
+    return resolved
+
 
 #--------------------------------------------------------------------------------------------
-# Clean Player Names in Point Data in order to join cleanly with the 
-# Player Dataset
-#--------------------------------------------------------------------------------------------
-
-def cleanPlayerNames(name):
-    if name in ['Albert Ramos Vinolas','Albert Ramos  Vinolas']:
-        return 'Albert Ramos'
-    elif name == 'Aleksandr Nedovesov':
-        return 'Aleksandr Nedovyesov'
-    elif name in ['Alex Bogomolov  Jr','Alex Jr. Bogomolov']:
-        return 'Alex Bogomolov Jr'
-    elif name == 'Aljax Bedene':
-        return 'Aljaz Bedene'
-    elif name in ['Andrei Kuznetsov', 'Andrey kumantsov']:
-        return 'Andrey Kuznetsov'
-    elif name == 'Blav Kavcic':
-        return 'Blaz Kavcic'
-    elif name == 'Cedric Marcel Stebe':
-        return 'Cedrik Marcel Stebe'
-    elif name == 'Dennis Kudla':
-        return 'Denis Kudla'
-    elif name in ['Diego Schwartzman','Diego Sebastian Schwartman']:
-        return 'Diego Sebastian Schwartzman'
-    elif name == 'Eilas Ymer':
-        return 'Elias Ymer'
-    elif name == 'Ernest Gulbis':
-        return 'Ernests Gulbis'
-    elif name == 'Federico Del Bonis':
-        return 'Federico Delbonis'
-    elif name == 'Frances Tiafoe':
-        return 'Francis Tiafoe'
-    elif name in ['Izak Van der Merwe', 'Izak van der Merwe']:
-        return 'Izak Van Der Merwe'
-    elif name == 'Jan Herynch':
-        return 'Jan Hernych'
-    elif name == 'Joao Olavo Souza':
-        return 'Joao Souza'
-    elif name == 'Juan Martin del Potro':
-        return 'Juan Martin Del Potro'
-    elif name == 'Kei Nishkori':
-        return 'Kei Nishikori'
-    elif name in ['Kenny de Schepper', 'Kenny De Scheper']:
-        return 'Kenny De Scheper'
-    elif name == 'Marco Trugelliti':
-        return 'Marco Trungelliti'
-    elif name == 'Mathew Ebden':
-        return 'Matthew Ebden'
-    elif name == 'Michael Russel':
-        return 'Michael Russell'
-    elif name in ['Mikail Kukushkin', 'Mikhael Kukushkin']:
-        return 'Mikhail Kukushkin'
-    elif name in ['Ricardas Barankis','Richard Berankis','Ricardas Bernakis']:
-        return 'Ricardas Berankis'
-    elif name in ['Rogerio Dutra DA Silva', 'Rogerio Dutra Da Silva']:
-        return 'Rogerio Dutra Silva'
-    elif name == 'Stan Wawrinka':
-        return 'Stanislas Wawrinka'
-    elif name in ['Teimuraz Gabashvili','Teymuraz Gabashvilli']:
-        return 'Teymuraz Gabashvili'
-    elif name == 'Thiemo de Bakker':
-        return 'Thiemo De Bakker'
-    elif name =='Thomasz Bellucci':
-        return 'Thomaz Bellucci'
-    elif name == 'Victor Estrella Burgos':
-        return 'Victor Estrella'
-    elif name in ['Victor Troicki','Vikor Troicki']:
-        return 'Viktor Troicki'
-    elif name == 'Dmitry Tursonov':
-        return 'Dmitry Tursunov'
-    elif name == 'Julian Benneteau':
-        return 'Julien Benneteau'
-    elif name == 'Mikhail Youhzny':
-        return 'Mikhail Youzhny'
-    elif name == 'Nick Krygios':
-        return 'Nick Kyrgios'
-    elif name == 'Philipp Kohlschrieber':
-        return 'Philipp Kohlschreiber'
-    elif name == 'Ranier Schuettler':
-        return 'Rainer Schuettler'
-    elif name in ['Roberta Bautista Agut', 'Roberto Batista Agut']:
-        return 'Roberto Bautista Agut'
-    elif name == 'Sam Groth':
-        return 'Samuel Groth'
-    elif name == 'Sergei Stakhovsky':
-        return 'Sergiy Stakhovsky'
-    elif name == 'Tatsumo Ito':
-        return 'Tatsuma Ito'
-    elif name == 'Tim Smyzek':
-        return 'Tim Smyczek'
-    elif name == 'Yen Hsun LU':
-        return 'Yen Hsun Lu'
-    elif name in ['Jarkko Niemenen', 'Jarko Nieminen']:
-        return 'Jarkko Nieminen'
-    else:
-        return name.replace('-',' ')
+# Add Tournament Date and Surface to Point Data. The unique (Year, Tourney) pairs are
+# resolved above and attached to the points through their codes.
+#--------------------------------------------------------------------------------------------
 
+def add_tourney_surface_to_point_data(point_data, tourney_dict):
+    codes = point_data.groupby(['Year','Tourney'], sort=False).ngroup().values
+    first = ~pd.Series(codes).duplicated().values & (codes >= 0)
+    resolved = resolve_tourneys(point_data[first], tourney_dict)
+    
+    point_data['Tourney Week'] = np.array(list(resolved['Tourney Week']) + [''], dtype=object)[codes]
+    point_data['Surface'] = np.array(list(resolved['Surface']) + [''], dtype=object)[codes]
+    return point_data
 
 #--------------------------------------------------------------------------------------------
-# Clean Point Data Player Namesusing Function Above
+# Clean Point Data Player Names in order to join cleanly with the Player Dataset. Known
+# misspellings are listed in 'Player Aliases.csv' (see Tennis_Player_Names), and each
+# unique name is resolved once. A Player ID given in the alias table is kept in 'Player 1 ID'
+# and 'Player 2 ID', so that the player is not looked up by name again (names are not unique
+# in the Player Dataset).
 #--------------------------------------------------------------------------------------------
   
-def clean_player_info(point_data):
-    point_data_tourney = pd.DataFrame(point_data[point_data['Tourney Week'] != ''])
-    point_data_tourney['Player 1'] = [cleanPlayerNames(x) for x in point_data_tourney['Player 1']]
-    point_data_tourney['Player 2'] = [cleanPlayerNames(x) for x in point_data_tourney['Player 2']]
+def clean_player_info(point_data, drops=None):
+    placed = (point_data['Tourney Week'] != '').values
+    if drops is not None:
+        drops['Tourney Week not found'] = (~placed).sum()
+    point_data_tourney = pd.DataFrame(point_data[placed])
+    aliases = read_aliases()
+    point_data_tourney['Player 1 ID'] = alias_player_ids(point_data_tourney['Player 1'], aliases)
+    point_data_tourney['Player 2 ID'] = alias_player_ids(point_data_tourney['Player 2'], aliases)
+    point_data_tourney['Player 1'] = np.asarray(resolve_names(point_data_tourney['Player 1'], aliases))
+    point_data_tourney['Player 2'] = np.asarray(resolve_names(point_data_tourney['Player 2'], aliases))
     
     return point_data_tourney
 
@@ -363,23 +298,120 @@ def combine_first_last(players):
 
 
 #--------------------------------------------------------------------------------------------
-# Merge Point Data with Players and Rankings to get Player ID and Ranking at
-# point in time
+# Player names that are still not in the Player Dataset are matched to it with the trigram
+# matcher in Tennis_Player_Names instead of losing their points. Accepted matches are saved
+# in 'Player Name Matches.csv', and the names that could not be matched are reported with
+# their best candidate so they can be added to 'Player Aliases.csv'. The Player ID of each
+# match is kept in 'Player 1 ID' and 'Player 2 ID' (see clean_player_info).
+#--------------------------------------------------------------------------------------------
+
+def recover_player_names(point_data_tourney, players):
+    known = set(players['Name'])
+    names = pd.concat([point_data_tourney['Player 1'], point_data_tourney['Player 2']])
+    point_counts = names[~names.isin(known) & names.notnull()].value_counts()
+    if len(point_counts) == 0:
+        return point_data_tourney
+    
+    matched, unmatched, matches = match_player_names(point_counts.index, players, read_name_matches())
+    write_name_matches(matches)
+    renames = dict((x, (y.name, y.player_id)) for x, y in matched.items())
+    for player in ['Player 1','Player 2']:
+        ids = alias_player_ids(point_data_tourney[player], renames)
+        point_data_tourney[player + ' ID'] = np.where(np.isnan(ids), point_data_tourney[player + ' ID'].values,
+                                                      ids)
+        point_data_tourney[player] = np.asarray(resolve_names(point_data_tourney[player], renames))
+    
+    print str(len(matched)) + " Player Names were Matched to the Player Dataset (" + \
+          str(point_counts[list(matched)].sum()) + " Points)."
+    print str(len(unmatched)) + " Player Names could not be Matched (" + \
+          str(point_counts[list(unmatched)].sum()) + " Points):"
+    for name in point_counts[list(unmatched)].sort_values(ascending=False).index:
+        candidates = unmatched[name]
+        best = candidates[0].name + ' (' + str(round(candidates[0].score, 2)) + ')' if candidates else 'None'
+        print '    ' + name + ': ' + str(point_counts[name]) + ' Points, Best Candidate ' + best
+    
+    return point_data_tourney
+
+
+#--------------------------------------------------------------------------------------------
+# Ranking of each player in the given ID column as of the date column: the latest ranking
+# week on or before it and at most tolerance days older (see Tennis_Rankings). The ranking
+# columns get the suffix.
+#--------------------------------------------------------------------------------------------
+
+def ranking_as_of(matches, rankings, id_column, date_column, suffix, tolerance=ranking_tolerance):
+    matches = matches.reset_index(drop=True)
+    found = ranking_table(rankings, matches[id_column].values,
+                          pd.to_numeric(matches[date_column]).values, tolerance)
+    found.columns = [x + suffix for x in found.columns]
+    
+    return pd.concat([matches, found], axis=1)
+
+
+#--------------------------------------------------------------------------------------------
+# Split the point data into a match table and a point table. Every match (a 'Source' file and
+# its 'MatchNum') gets a 'Match Key'. The match table has one row per match with the columns
+# that are the same for all its points, and the point table only keeps the Match Key and the
+# score and state codes of every point.
+#--------------------------------------------------------------------------------------------
+
+match_columns = ['Player 1','Player 2','Player 1 ID','Player 2 ID','Tourney','Year','Tourney Week','Surface',
+                 'Source','MatchNum','Level','Tour','Result','Score']
+point_columns = ['Match Key','Winner','p1Set','p2Set','p1Game','p2Game','p1Score','p2Score','Server',
+                 'Server Winner','State','Game State Code']
+
+def split_point_data(point_data_tourney, drops=None):
+    match_key = point_data_tourney.groupby(['Source','MatchNum'], sort=False).ngroup().values.astype(np.int32)
+    if drops is not None:
+        drops['Source or MatchNum missing'] = (match_key < 0).sum()
+    first = ~pd.Series(match_key).duplicated().values & (match_key >= 0)
+    
+    match_data = point_data_tourney[[x for x in match_columns if x in point_data_tourney.columns]][first]
+    match_data = match_data.reset_index(drop=True)
+    match_data['Match Key'] = match_key[first]
+    
+    point_data = pd.DataFrame(dict((x, point_data_tourney[x].values) for x in point_columns[1:]),
+                              columns=point_columns[1:])
+    point_data.insert(0, 'Match Key', match_key)
+    point_data = point_data[match_key >= 0].reset_index(drop=True)
+    
+    return match_data, point_data
+
+
+#--------------------------------------------------------------------------------------------
+# Player ID of the given player ('Player 1' or 'Player 2') of every match, in the column
+# 'Player ID' + suffix. An ID that is already known ('Player 1 ID') is used as it is, and the
+# other players are joined by name; a name shared by several players gives one row per
+# player. The rows stay in the order of the matches.
 #--------------------------------------------------------------------------------------------
 
-def merge_point_ranking_players(point_data_tourney, players, rankings):
-    all_data_plus_1 = pd.merge(left=point_data_tourney,right=players, how='left', 
-                               left_on='Player 1', right_on='Name', suffixes = ('_pt','_1'))
-    all_data_plus_2 = pd.merge(left=all_data_plus_1,right=players, how='left', 
-                               left_on='Player 2', right_on='Name', suffixes = ('_1','_2'))
-    all_data_plus_3 = pd.merge(left=all_data_plus_2, right=rankings,how='left',
-                               left_on=['Player ID_1','Tourney Week'],
-                               right_on=['Player ID','Week'], suffixes = ('_1','_1R'))
-    all_data_plus_4 = pd.merge(left=all_data_plus_3, right=rankings,how='left',
-                               left_on=['Player ID_2','Tourney Week'],
-                               right_on=['Player ID','Week'], suffixes = ('_1R','_2R'))
+def merge_player_id(match_data, players, player, suffix):
+    match_data = match_data.reset_index(drop=True)
+    known = match_data[player + ' ID'].notnull().values
+    by_id = match_data[known].reset_index()
+    by_id['Player ID'] = by_id[player + ' ID']
+    by_name = pd.merge(left=match_data[~known].reset_index(), right=players[['Name','Player ID']],
+                       how='left', left_on=player, right_on='Name').drop('Name', axis=1)
+    merged = pd.concat([by_id, by_name], ignore_index=True).sort_values('index', kind='mergesort')
+    merged = merged.drop(['index', player + ' ID'], axis=1)
+    merged = merged.rename(columns={'Player ID': 'Player ID' + suffix})
     
-    return all_data_plus_4
+    return merged.reset_index(drop=True)
+
+
+#--------------------------------------------------------------------------------------------
+# Merge the Match Data with Players and Rankings to get the Player IDs and the Rankings of
+# both players at the time of the match. Other player details can be joined from the Player
+# Dataset by Player ID when needed.
+#--------------------------------------------------------------------------------------------
+
+def merge_match_ranking_players(match_data, players, rankings, tolerance=ranking_tolerance):
+    match_data_1 = merge_player_id(match_data, players, 'Player 1', '_1')
+    match_data_2 = merge_player_id(match_data_1, players, 'Player 2', '_2')
+    match_data_3 = ranking_as_of(match_data_2, rankings, 'Player ID_1', 'Tourney Week', '_1R', tolerance)
+    match_data_4 = ranking_as_of(match_data_3, rankings, 'Player ID_2', 'Tourney Week', '_2R', tolerance)
+    
+    return match_data_4
 
 
 #--------------------------------------------------------------------------------------------
@@ -409,41 +441,156 @@ def rankingGroup(rank1, rank2, server):
 
 
 #--------------------------------------------------------------------------------------------
-# Adds Ranking Matchup and Removes Missing Data
+# Adds Ranking Matchup and Removes Missing Data. The matchup depends on who serves, so the
+# match table has the matchup for points served by Player 1 ('Ranking Matchup 1') and by
+# Player 2 ('Ranking Matchup 2'). A name shared by several players gives one row per player;
+# only rows with both rankings are kept, and of those the first. The result is the cleaned
+# data as the pair (match_data, point_data), see join_match_columns.
 #--------------------------------------------------------------------------------------------
 
-def final_clean_up(all_data_plus_4):
-    all_data_plus_4['Ranking Matchup'] = [rankingGroup(x,y,z) for x,y,z in 
-                                          zip(all_data_plus_4['Ranking_1R'],
-                                              all_data_plus_4['Ranking_2R'],
-                                              all_data_plus_4['Server'])]
+def final_clean_up(match_data, point_data, drops=None):
+    reasons = np.select([np.isnan(match_data['Player ID_1']), np.isnan(match_data['Player ID_2']),
+                         np.isnan(match_data['Ranking_1R']), np.isnan(match_data['Ranking_2R'])],
+                        ['Player 1 not found', 'Player 2 not found', 'Player 1 not ranked',
+                         'Player 2 not ranked'], '')
+    match_reasons = pd.Series(reasons, index=match_data['Match Key'].values)
+    match_data = match_data[reasons == ''].drop_duplicates('Match Key').set_index('Match Key')
+    match_data['Ranking Matchup 1'] = [rankingGroup(x,y,1) for x,y in 
+                                       zip(match_data['Ranking_1R'], match_data['Ranking_2R'])]
+    match_data['Ranking Matchup 2'] = [rankingGroup(x,y,2) for x,y in 
+                                       zip(match_data['Ranking_1R'], match_data['Ranking_2R'])]
+    
+    kept = point_data['Match Key'].isin(match_data.index).values
+    print str(kept.sum()) + " Point Observations were Valid."
+    print str((~kept).sum()) + " Point Observations were Removed."
+    if drops is not None:
+        match_reasons = match_reasons[~match_reasons.index.duplicated()]
+        drops.update(match_reasons.reindex(point_data['Match Key'].values[~kept]).value_counts())
+    
+    return match_data, point_data[kept].reset_index(drop=True)
 
-    full_data = all_data_plus_4[~(np.isnan(all_data_plus_4['Ranking_2R']) | np.isnan(all_data_plus_4['Ranking_1R']) |
-        np.isnan(all_data_plus_4['Player ID_1']) | np.isnan(all_data_plus_4['Player ID_2']))]
 
+#--------------------------------------------------------------------------------------------
+# The cleaned data is kept for the whole session, so it is compacted (see Tennis_Compaction):
+# IDs, rankings and weeks become small integers, repeated strings become categoricals, and
+# the columns that the model does not use are dropped. The bytes saved by every column are
+# added to details.
+#--------------------------------------------------------------------------------------------
 
-    missing_data = all_data_plus_4[(np.isnan(all_data_plus_4['Ranking_2R']) | np.isnan(all_data_plus_4['Ranking_1R']) |
-        np.isnan(all_data_plus_4['Player ID_1']) | np.isnan(all_data_plus_4['Player ID_2']))]
+unused_match_columns = ['Player ID_1R','Player ID_2R','Result','Score']
+
+def compact_full_data(match_data, point_data, details=None):
+    match_data, match_sizes = compact_frame(match_data, drop=unused_match_columns)
+    point_data, point_sizes = compact_frame(point_data)
+    
+    old_bytes = match_sizes['Old Bytes'].sum() + point_sizes['Old Bytes'].sum()
+    new_bytes = match_sizes['New Bytes'].sum() + point_sizes['New Bytes'].sum()
+    print "Full Data Compacted from " + str(round(old_bytes / 1e6, 1)) + " MB to " + \
+          str(round(new_bytes / 1e6, 1)) + " MB."
+    if details is not None:
+        for table, sizes in [('match_data', match_sizes), ('point_data', point_sizes)]:
+            details[table] = dict((str(x), {'old_type': o, 'new_type': n, 'old_bytes': int(ob),
+                                            'new_bytes': int(nb), 'saved_bytes': int(sv)})
+                                  for x, o, n, ob, nb, sv in sizes.values)
     
-    print str(len(full_data)) + " Point Observations were Valid."
-    print str(len(missing_data)) + " Point Observations were Removed."
+    return match_data, point_data
+
+
+#--------------------------------------------------------------------------------------------
+# Adds the given Match Data columns to the Point Data, looked up by Match Key. 'Ranking
+# Matchup' is the matchup from the view of the server of each point. Categorical columns of
+# the compacted Match Data are added as plain values, so that grouping by them works as
+# before.
+#--------------------------------------------------------------------------------------------
+
+def join_match_columns(point_data, match_data, columns):
+    rows = match_data.index.get_indexer(point_data['Match Key'].values)
+    joined = pd.DataFrame(point_data, copy=True)
+    for name in columns:
+        if name == 'Ranking Matchup':
+            joined[name] = np.where(point_data['Server'].values == 1,
+                                    np.asarray(match_data['Ranking Matchup 1'])[rows],
+                                    np.asarray(match_data['Ranking Matchup 2'])[rows])
+        else:
+            joined[name] = np.asarray(match_data[name])[rows]
+    return joined
+
+
+#--------------------------------------------------------------------------------------------
+# Point Data of the matches for which both players' ranking weeks pass the filter on the
+# Match Data
+#--------------------------------------------------------------------------------------------
+
+def select_matches(full_data, keep):
+    match_data, point_data = full_data
+    match_data = match_data[keep(match_data['Week_1R']) & keep(match_data['Week_2R'])]
+    return match_data, point_data[point_data['Match Key'].isin(match_data.index).values]
+
+#--------------------------------------------------------------------------------------------
+# Main Function that Cleans All Data. Every step runs as a stage of Tennis_Stage_Report, and
+# the time, peak memory, rows and drop reasons of every stage are written to report_path.
+#--------------------------------------------------------------------------------------------
+
+clean_data_report_path = 'Clean Data Report.json'
+
+def create_clean_data(report_path=clean_data_report_path):
+    report = []
+    rankings, players, point_data = run_stage(report, 'get_rankings_players_point_data',
+                                              get_rankings_players_point_data, [],
+                                              ['rankings','players','point_data'])
+    all_matches = run_stage(report, 'get_match_data', get_match_data, [], 'all_matches')
+    tourney_dict = run_stage(report, 'tourney_info', tourney_info,
+                             [('all_matches', all_matches)], 'tourney_dict')
+    point_data = run_stage(report, 'add_tourney_surface_to_point_data', add_tourney_surface_to_point_data,
+                           [('point_data', point_data), ('tourney_dict', tourney_dict)], 'point_data')
+    point_data_tourney = run_stage(report, 'clean_player_info', clean_player_info,
+                                   [('point_data', point_data)], 'point_data', drops=True)
+    players = run_stage(report, 'combine_first_last', combine_first_last, [('players', players)], 'players')
+    point_data_tourney = run_stage(report, 'recover_player_names', recover_player_names,
+                                   [('point_data', point_data_tourney), ('players', players)], 'point_data')
+    match_data, point_data = run_stage(report, 'split_point_data', split_point_data,
+                                       [('point_data', point_data_tourney)], ['match_data','point_data'],
+                                       drops=True)
+    match_data = run_stage(report, 'merge_match_ranking_players', merge_match_ranking_players,
+                           [('match_data', match_data), ('players', players), ('rankings', rankings)],
+                           'match_data')
+    full_data = run_stage(report, 'final_clean_up', final_clean_up,
+                          [('match_data', match_data), ('point_data', point_data)],
+                          ['match_data','point_data'], drops=True)
+    full_data = run_stage(report, 'compact_full_data', compact_full_data,
+                          [('match_data', full_data[0]), ('point_data', full_data[1])],
+                          ['match_data','point_data'], details=True)
+    write_stage_report(report, report_path)
     
-    return full_data
+    return full_data, all_matches, rankings
 
 #--------------------------------------------------------------------------------------------
-# Main Function that Cleans All Data
+# The cleaned data is cached in 'Clean Data Cache.pkl' (see Tennis_Data_Cache), keyed by the
+# input files below and clean_data_version, so a restart can make live predictions without
+# cleaning all data again. Increase clean_data_version whenever the cleaning code of Part 1
+# changes. The rankings are not cached, since the Ranking Store is opened in no time and is
+# rebuilt by itself when a rankings file changes. The key is taken after cleaning, since
+# cleaning saves 'Tourney Weeks.csv' and 'Player Name Matches.csv'.
 #--------------------------------------------------------------------------------------------
 
-def create_clean_data():
-    rankings, players, point_data = get_rankings_players_point_data()
-    all_matches = get_match_data()
-    tourney_dict = tourney_info(all_matches)
-    point_data = add_tourney_surface_to_point_data(point_data, tourney_dict)
-    point_data_tourney = clean_player_info(point_data)
-    players = combine_first_last(players)
-    all_data_plus_4 = merge_point_ranking_players(point_data_tourney, players, rankings)
-    full_data = final_clean_up(all_data_plus_4)
+clean_data_cache_path = 'Clean Data Cache.pkl'
+clean_data_version = 3
+
+def clean_data_inputs():
+    return ([point_store_path, players_path, tourney_weeks_path, alias_path, name_match_path] +
+            [os.path.join(atp_path, x[0]) for x in ranking_files()] +
+            [os.path.join(atp_path, x) for x in match_catalog(['main'], match_years)['File']])
+
+
+def load_clean_data(cache_path=clean_data_cache_path, report_path=clean_data_report_path):
+    cached = read_cache(cache_path, cache_key(clean_data_inputs(), clean_data_version))
+    if cached is not None:
+        full_data, all_matches = cached
+        print 'Clean Data Loaded from Cache'
+        return full_data, all_matches, open_ranking_store()
     
+    full_data, all_matches, rankings = create_clean_data(report_path)
+    write_cache(cache_path, cache_key(clean_data_inputs(), clean_data_version), (full_data, all_matches))
     return full_data, all_matches, rankings
 
 #--------------------------------------------------------------------------------------------
@@ -490,162 +637,38 @@ def tiebreak_state(state):
     else:
         return str(p1)+'-'+str(p2) + suffix
 
-    
-def tiebreak_coordinates(game_state):
-    if game_state not in coordinate_states.keys():
-        #print game_state#[7:]
-        g1, g2 = game_state[7:].split('-')
-        #print g1, g2
-        return (int(g1)+int(g2), int(g1)-int(g2))
-    else:
-        return coordinate_states[game_state]
-
 
 #--------------------------------------------------------------------------------------------
-# This function translates all the different game states into winning percentages.
-# The score_state_all data frame splits the point data into the dimensions specified, while
-# the score_state_sum data frame splits the data further into win/loss, in order to
-# calculate the winning %.
+# Counts the instances and server wins of every game situation by ranking group and surface
+# in one pass over the point data, as running counts by the later ranking week of each match
+# (see weekly_state_cube). The training data for a datecutoff only holds matches whose
+# ranking weeks are both before it, so its counts are read off the running counts in one
+# lookup, and the Real, Matchup and Surface Datasets below are sums of that cube over the
+# other dimensions. The running counts of the last Match and Point Data are kept, so that
+# setting up the datasets for another datecutoff does not count the points again.
 #--------------------------------------------------------------------------------------------
 
-def get_win_pct_data(score_state_all, score_state_sum, matchup_exists = True):
-    all_results = []
-    for matchup, set_score, game_score, game_state in score_state_all.index.values:   
-        try:
-            x, y = tiebreak_coordinates(game_state)
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    all_results.append((matchup, set_score,game_score,'Serving',game_state[7:]+ ' (R)', 
-                                1.0*float(score_state_sum.loc[(matchup, set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                x, y))
-                else:
-                    all_results.append((matchup, set_score,game_score,'Serving',game_state[7:]+ ' (S)', 
-                                1.0*float(score_state_sum.loc[(matchup, set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                x, y))
-            elif 'Server' in game_state:
-                all_results.append((matchup, set_score,game_score,'Serving',game_state[7:], 
-                                1.0*float(score_state_sum.loc[(matchup, set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                x, y))
-            else:
-                all_results.append((matchup, set_score,game_score,'Serving',game_state, 
-                                1.0*float(score_state_sum.loc[(matchup, set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                x, y))
-
-            if 'Start of Game' not in game_state:
-                score1, score2 = game_state[7:].split('-')
-                new_score = score2+'-'+score1   
-            else:
-                new_score = game_state
-
-            if game_score == 'Up 1 from 6-6 5th Set':
-                newgscore = 'Down 1 from 6-6 5th Set'
-            elif game_score == 'Down 1 from 6-6 5th Set':
-                newgscore = 'Up 1 from 6-6 5th Set'
-            elif game_score == 'All Square from 6-6 5th Set':
-                newgscore = game_score
-            else:
-                gscore1, gscore2 = game_score.split('-')
-                newgscore = gscore2+'-'+gscore1
-
-            sscore1, sscore2 = set_score.split('-')
-            newsscore = sscore2+'-'+sscore1
-
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    new_score = new_score + ' (S)'
-                else:
-                    new_score = new_score + ' (R)'
-            
-            if matchup_exists:
-                m1, m2 = matchup.split(' vs. ')
-                newmatchup = m2 + ' vs. ' + m1
-            else:
-                newmatchup = matchup
-
-            all_results.append((newmatchup, newsscore,newgscore,'Returning',new_score, 
-                                1.0 - 1.0*float(score_state_sum.loc[(matchup, set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]),
-                                x, -1*y))
-        except KeyError:
-            #print 'Key Error at ' + str((matchup, set_score, game_score, game_state))
-            x, y = tiebreak_coordinates(game_state)
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    all_results.append((matchup, set_score, game_score, 'Serving',game_state[7:]+ ' (R)', 0.,
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]), x, y))
-                else:
-                    all_results.append((matchup, set_score, game_score, 'Serving',game_state[7:]+ ' (S)', 0.,
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]), x, y))
-            elif 'Server' in game_state:
-                all_results.append((matchup, set_score, game_score, 'Serving',game_state[7:], 0.,
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]), x, y))
-            else:
-                all_results.append((matchup, set_score, game_score, 'Serving',game_state, 0.,
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]), x, y))
-
-            #print game_state
-            if 'Start of Game' not in game_state:
-                score1, score2 = game_state[7:].split('-')
-                new_score = score2+'-'+score1   
-            else:
-                new_score = game_state
-
-            if game_score == 'Up 1 from 6-6 5th Set':
-                newgscore = 'Down 1 from 6-6 5th Set'
-            elif game_score == 'Down 1 from 6-6 5th Set':
-                newgscore = 'Up 1 from 6-6 5th Set'
-            elif game_score == 'All Square from 6-6 5th Set':
-                newgscore = game_score
-            else:
-                gscore1, gscore2 = game_score.split('-')
-                newgscore = gscore2+'-'+gscore1
-            sscore1, sscore2 = set_score.split('-')
-            newsscore = sscore2+'-'+sscore1
-
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    new_score = new_score + ' (S)'
-                else:
-                    new_score = new_score + ' (R)'
-            
-            if matchup_exists:
-                m1, m2 = matchup.split(' vs. ')
-                newmatchup = m2 + ' vs. ' + m1
-            else:
-                newmatchup = matchup
+weekly_counts_cache = dict()
 
-            all_results.append((newmatchup, newsscore, newgscore, 'Returning',new_score, 1.,
-                                int(score_state_all.loc[(matchup, set_score,game_score,game_state)]), x, -1*y))
-    return all_results
+def setup_weekly_counts(full_data):
+    match_data, point_data = full_data
+    if weekly_counts_cache.get('match_data') is not match_data or \
+       weekly_counts_cache.get('point_data') is not point_data:
+        joined = join_match_columns(point_data, match_data, ['Ranking Matchup','Surface'])
+        weeks = np.maximum(match_data['Week_1R'].values, match_data['Week_2R'].values)
+        weeks = weeks[match_data.index.get_indexer(point_data['Match Key'].values)]
+        weekly_counts_cache['counts'] = weekly_state_cube(joined, weeks, by=['Ranking Matchup','Surface'])
+        weekly_counts_cache['match_data'], weekly_counts_cache['point_data'] = match_data, point_data
+    return weekly_counts_cache['counts']
 
 
 #--------------------------------------------------------------------------------------------
 # Sets up the "Real Dataset" which splits point data by ranking group, and game situation
 #--------------------------------------------------------------------------------------------
 
-def setup_real_data(full_data):
-    score_state_all = pd.DataFrame(full_data.groupby(['Ranking Matchup',
-                                      'Set Score Server View',
-                                      'Game Score Server View', 
-                                      'Game State New']).count()['Player 1'])
-    score_state_sum = pd.DataFrame(full_data.groupby(['Ranking Matchup',
-                                     'Set Score Server View',
-                                     'Game Score Server View', 
-                                     'Game State New', 
-                                     'Server Winner']).count()['Player 1'])
-    all_results = get_win_pct_data(score_state_all, score_state_sum, matchup_exists = True)
-    sum_data = pd.DataFrame(all_results,columns=['Matchup','Set Score','Game Score',
-                                  'Serving at Start of Game?','Point Score','% Win',
-                                  'Number of Instances','Points Elapsed','Y'])
+def setup_real_data(cube):
+    counts = cube_counts(cube, by=['Ranking Matchup'])
+    sum_data = win_pct_data(counts, group_name='Matchup', mirror_group=True)
     sum_data.index = sum_data['Set Score'] + sum_data['Game Score'] + sum_data['Serving at Start of Game?'] + \
                      sum_data['Point Score'] + sum_data['Matchup']
     return sum_data
@@ -662,14 +685,21 @@ def setup_prior_data():
 
 
 #--------------------------------------------------------------------------------------------
-# Sets up the "Matchup Dataset" which splits point data by ranking group only
+# Sets up the "Matchup Dataset" which splits point data by ranking group only. It counts the
+# first point of every match (0-0 sets, 0-0 games, Start of Game), once from the view of the
+# server's ranking group and once, mirrored, from the view of the returner's.
 #--------------------------------------------------------------------------------------------
 
-def setup_matchup_data(sum_data):
-    matchup_data = pd.DataFrame(sum_data[(sum_data['Set Score'] == '0-0') & 
-                                         (sum_data['Game Score'] == '0-0') &
-                                         (sum_data['Point Score'] == 'Start of Game')])
-    matchup_data['Win Instances'] = matchup_data['% Win'] * matchup_data['Number of Instances']
+first_point_state = game_state_labels.index('Start of Game')
+
+def setup_matchup_data(cube):
+    counts = cube_counts(cube, by=['Ranking Matchup'])
+    counts = counts[counts.index.get_level_values('State') == first_point_state]
+    matchups = counts.index.get_level_values('Ranking Matchup').values
+    instances, wins = counts['Instances'].values, counts['Wins'].values
+    matchup_data = pd.DataFrame({'Matchup': np.concatenate([matchups, mirror_matchups(matchups)]),
+                                 'Win Instances': np.concatenate([wins, instances - wins]).astype(float),
+                                 'Number of Instances': np.concatenate([instances, instances])})
     matchup_sum = matchup_data.groupby('Matchup').sum()[['Win Instances','Number of Instances']]
     return matchup_sum
 
@@ -678,20 +708,9 @@ def setup_matchup_data(sum_data):
 # Sets up the "Surface Dataset" which splits point data by surface and game situations
 #--------------------------------------------------------------------------------------------
 
-def setup_surface_data(full_data):
-    surface_state_all = pd.DataFrame(full_data.groupby(['Surface',
-                                      'Set Score Server View',
-                                      'Game Score Server View', 
-                                      'Game State New']).count()['Player 1'])
-    surface_state_sum = pd.DataFrame(full_data.groupby(['Surface',
-                                     'Set Score Server View',
-                                     'Game Score Server View', 
-                                     'Game State New', 
-                                     'Server Winner']).count()['Player 1'])
-    surface_results = get_win_pct_data(surface_state_all, surface_state_sum, matchup_exists = False)
-    surface_data = pd.DataFrame(surface_results,columns=['Surface','Set Score','Game Score',
-                                      'Serving at Start of Game?','Point Score','% Win',
-                                      'Number of Instances','Points Elapsed','Y'])
+def setup_surface_data(cube):
+    counts = cube_counts(cube, by=['Surface'])
+    surface_data = win_pct_data(counts, group_name='Surface')
     surface_data.index = surface_data['Set Score'] + surface_data['Game Score'] + \
                          surface_data['Serving at Start of Game?'] + surface_data['Point Score'] + \
                          surface_data['Surface']
@@ -705,13 +724,13 @@ def setup_surface_data(full_data):
 def setup_h2h_data(all_matches):
     all_ids = np.unique(np.concatenate((np.unique(all_matches['winner_id']),
                                         np.unique(all_matches['loser_id'])),axis = 0))
-    h2h_data = pd.DataFrame(0,index=all_ids, columns = all_ids)
+    h2h_counts = np.zeros((len(all_ids), len(all_ids)), dtype=np.int64)
 
-    all_h2h = pd.DataFrame(all_matches.groupby(['winner_id','loser_id']).count()['tourney_id'])
-    for key,row in all_h2h.iterrows():
-        winner_id, loser_id = key
-        #print row['tourney_id']
-        h2h_data.ix[winner_id, loser_id] = row['tourney_id']
+    counted = all_matches['tourney_id'].notnull().values
+    winners = np.searchsorted(all_ids, all_matches['winner_id'].values[counted])
+    losers = np.searchsorted(all_ids, all_matches['loser_id'].values[counted])
+    np.add.at(h2h_counts, (winners, losers), 1)
+    h2h_data = pd.DataFrame(h2h_counts, index=all_ids, columns = all_ids)
     return h2h_data
 
 
@@ -721,14 +740,13 @@ def setup_h2h_data(all_matches):
 
 def setup_all_datasets(full_data, all_matches, datecutoff):
     
-    full_data = full_data[(full_data['Week_1R'] < datecutoff) &
-                          (full_data['Week_2R'] < datecutoff)]
+    cube = state_cube_before(setup_weekly_counts(full_data), datecutoff)
     all_matches = all_matches[all_matches['tourney_date'] < datecutoff]
     
     prior_data = setup_prior_data()
-    real_data = setup_real_data(full_data)
-    matchup_data = setup_matchup_data(real_data)
-    surface_data = setup_surface_data(full_data)
+    real_data = setup_real_data(cube)
+    matchup_data = setup_matchup_data(cube)
+    surface_data = setup_surface_data(cube)
     h2h_data = setup_h2h_data(all_matches)
     return prior_data, real_data, matchup_data, surface_data, all_matches, h2h_data
 
@@ -737,26 +755,13 @@ def setup_all_datasets(full_data, all_matches, datecutoff):
 #--------------------------------------------------------------------------------------------
 
 def recent_activity(player_id, d2, data, months, surface=None):
-    enddate = datetime.strptime(str(d2),'%Y%m%d')
-    begindate = enddate + relativedelta(months = -1*months)
-    d1 = int(begindate.strftime('%Y%m%d'))
-    #print d1, d2
-    if surface == None:
-        wins = len(data[(data['tourney_date'] >= d1) & 
-                        (data['tourney_date'] < d2) &
-                        (data['winner_id'] == player_id)])
-        losses = len(data[(data['tourney_date'] >= d1) & 
-                        (data['tourney_date'] < d2) &
-                        (data['loser_id'] == player_id)])
-    else:
-        wins = len(data[(data['tourney_date'] >= d1) & 
-                        (data['tourney_date'] < d2) &
-                        (data['winner_id'] == player_id) &
-                        (data['surface'] == surface)])
-        losses = len(data[(data['tourney_date'] >= d1) & 
-                        (data['tourney_date'] < d2) &
-                        (data['loser_id'] == player_id) &
-                        (data['surface'] == surface)])
+    d1 = int(days_yyyymmdd(month_window(yyyymmdd_days(d2), months)))
+    dates = data['tourney_date'].values
+    window = (dates >= d1) & (dates < d2)
+    if surface != None:
+        window &= data['surface'].values == surface
+    wins = np.count_nonzero(window & (data['winner_id'].values == player_id))
+    losses = np.count_nonzero(window & (data['loser_id'].values == player_id))
     return wins, losses
 
 #--------------------------------------------------------------------------------------------
@@ -1227,9 +1232,9 @@ def test_parameters(full_data, all_matches, datecutoff, testnum, params,
     else:
         prior_data, real_data, matchup_data,         surface_data, all_matches_b, h2h_data = training_data
     
-    pbp_data_test = full_data[(full_data['Week_1R'] >= datecutoff) &
-                              (full_data['Week_2R'] >= datecutoff)].sample\
-                            (testnum)
+    match_data, point_data = select_matches(full_data, lambda week: week >= datecutoff)
+    pbp_data_test = join_match_columns(point_data.sample(testnum), match_data,
+                                       ['Ranking Matchup','Surface','Player ID_1','Player ID_2'])
     
     print 'Test Data Set Up: ' + str(len(pbp_data_test)) + ' Rows'
     point_param, matchup_param, s_param, r_param, h2h_param, base_param = params
@@ -1414,26 +1419,20 @@ def plot_match(date, param, filename, full_data, all_matches,
     if len(data) > 0:
         datecutoff = int(date.replace('-',''))
 
-        all_weeks = np.unique(rankings.index)
-        rank_week = max([i for i in all_weeks if i <= datecutoff])
-        rankings = rankings.loc[rank_week]
+        rank1, rank2 = rank_at(rankings, [data['Player 1 ID'].values[0], data['Player 2 ID'].values[0]],
+                               datecutoff, ranking_tolerance)
         
-        try:
-            r1 = classifyRank(float(rankings[rankings['Player ID'] 
-                                       == data['Player 1 ID'].values[0]]
-                              ['Ranking'].values[0]))
-        except IndexError:
+        if np.isnan(rank1):
             print 'Ranking Not Found for Player 1 - assume ranking 100+'
             r1 = 'Outside Top 100'
+        else:
+            r1 = classifyRank(rank1)
         
-        try:
-            r2 = classifyRank(float(rankings[rankings['Player ID']
-                                   == data['Player 2 ID'].values[0]]
-                         ['Ranking'].values[0]))
-        except IndexError:
+        if np.isnan(rank2):
             print 'Ranking Not Found for Player 2 - assuming ranking 100+'
-            
             r2 = 'Outside Top 100'
+        else:
+            r2 = classifyRank(rank2)
         matchup = r1 + ' vs. ' + r2
 
         if surface == None:
@@ -1671,7 +1670,7 @@ def plot_matches_for_date(date, params, full_data, all_matches,
 #--------------------------------------------------------------------------------------------
 
 def concatenate_images():
-    date = str(datetime.today().strftime('%Y-%m-%d'))
+    date = date_string(today())
     png_files = glob.glob("Scraped Matches/" + date + "*.png")
     print str(len(png_files)) + ' Live Matches Found'
     
@@ -1685,12 +1684,38 @@ def concatenate_images():
     new_im.save("Scraped Matches/Live_Scoreboard.png")
     
 #--------------------------------------------------------------------------------------------
-# The function to call for tracking live scores when the live scraper is in effect.
+# Surface of a live tourney (named like the point data, e.g. 'ATPWashington2016'): its
+# resolved surface (see resolve_tourneys), or else the latest surface of the same city.
+# None if the city is not known.
 #--------------------------------------------------------------------------------------------
 
-def track_live_scores(full_data, all_matches, param, seconds, rankings, t_data = None):
-    datestr = str(datetime.today().strftime('%Y-%m-%d'))
-    dateint = int(datestr.replace('-',''))
+def live_tourney_surface(tourney, year, tourney_dict):
+    resolved = resolve_tourneys(pd.DataFrame({'Year': [year], 'Tourney': [tourney]}), tourney_dict,
+                                save=False)
+    city, surface = resolved['City'].values[0], resolved['Surface'].values[0]
+    if surface != '':
+        return surface
+    years = sorted(x for x in tourney_dict if city in tourney_dict[x])
+    if city != '' and years:
+        return tourney_dict[years[-1]][city][1]
+    return None
+
+#--------------------------------------------------------------------------------------------
+# The function to call for tracking live scores when the live scraper is in effect. The
+# surface is that of the given tourney, or 'Hard' if no tourney is given or it is unknown.
+#--------------------------------------------------------------------------------------------
+
+def track_live_scores(full_data, all_matches, param, seconds, rankings, t_data = None,
+                      tourney = None):
+    datestr = date_string(today())
+    dateint = int(days_yyyymmdd(today()))
+    
+    surface = 'Hard'
+    if tourney != None:
+        surface = live_tourney_surface(tourney, datestr[2:4], tourney_info(all_matches))
+        if surface == None:
+            print 'Surface Not Found for ' + tourney + ' - assuming Hard'
+            surface = 'Hard'
     
     if t_data == None:
         prior_data, real_data, matchup_data, surface_data, all_matches_b, h2h_data = \
@@ -1709,7 +1734,7 @@ def track_live_scores(full_data, all_matches, param, seconds, rankings, t_data =
         print 'Updating Graphs'
         tstamp = ' at ' + str(datetime.now().hour) + ':' + str(datetime.now().minute) + ':' + str(datetime.now().second)
         pickle_data = plot_matches_for_date(datestr, param, full_data, all_matches, 
-                                            rankings, surface = 'Hard',
+                                            rankings, surface = surface,
                                             training_data = training_data,
                                             pickle_dict = pickle_data,
                                             timestamp = tstamp)
@@ -1726,7 +1751,7 @@ def track_live_scores(full_data, all_matches, param, seconds, rankings, t_data =
 
 def main():
     datecutoff = 20151231
-    full_data, all_matches, rankings = create_clean_data()
+    full_data, all_matches, rankings = load_clean_data()
     print 'Data Cleaned'
     
     prior_data, real_data, matchup_data, surface_data, all_matches, h2h_data = \
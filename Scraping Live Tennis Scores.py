@@ -20,7 +20,8 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from datetime import datetime
+from Tennis_Calendar import today, date_string
+from Tennis_Player_Names import read_players, player_ids, resolve_player_id
 
 #--------------------------------------------------------------------------------------------
 # This function is a wrapper function that reads in real-time information and associates 
@@ -30,9 +31,7 @@ from datetime import datetime
 def run_scraper(seconds):
     
     # Configure Player Data
-    players = pd.read_csv('tennis_atp-master/atp_players.csv',header=None)
-    players.columns = ['Player ID','First','Last','L/R','DOB','Country']
-    players.index = players['Last'] + np.array([' ' + str(x)[0] + '.' if str(x) != 'nan' else '' for x in players['First']])
+    players = player_ids(read_players(), key='Scoreboard Name')
     
     base_link = 'http://www.scoreboard.com/tennis/'
     driver = webdriver.Firefox()
@@ -59,6 +58,7 @@ def run_scraper(seconds):
         database = database + parse_html(html,count)
         
         new_data = parse_database(database, players)
+        match_path = 'Scraped Matches/' + date_string(today()) + '_'
         
         for p1, p2 in new_data:
             frame = new_data[(p1,p2)]
@@ -67,8 +67,7 @@ def run_scraper(seconds):
                                                    'Set Score', 'Game Score', 
                                                     'Point Score', 'Serving?'])
             if (p1,p2) not in data_store.keys():
-                frame.to_csv('Scraped Matches/' + str(datetime.today().strftime('%Y-%m-%d')) + 
-                             '_' + str(p1) + '_' + str(p2) + '_live.csv')
+                frame.to_csv(match_path + str(p1) + '_' + str(p2) + '_live.csv')
                 data_store[(p1,p2)] = frame
             else:
                 new_frame = frame[len(data_store[(p1,p2)]):]
@@ -76,25 +75,18 @@ def run_scraper(seconds):
                                                                'Player 2', 'Player 2 ID',
                                                                'Set Score', 'Game Score', 
                                                                'Point Score', 'Serving?'])
-                new_frame.to_csv('Scraped Matches/' + 
-                                 str(datetime.today().strftime('%Y-%m-%d')) + 
-                                 '_' + str(p1) + '_' + str(p2) + '_live.csv')
+                new_frame.to_csv(match_path + str(p1) + '_' + str(p2) + '_live.csv')
                 data_store[(p1,p2)] = frame
             
             check = pd.DataFrame([[0]])
-            check.to_csv('Scraped Matches/' + str(datetime.today().strftime('%Y-%m-%d')) + 
-                         '_' + str(p1) + '_' + str(p2) + '_updated.csv')
+            check.to_csv(match_path + str(p1) + '_' + str(p2) + '_updated.csv')
                 
         for p1, p2 in data_store:
             frame = data_store[(p1,p2)]
-            frame.to_csv('Scraped Matches/' + 
-                          str(datetime.today().strftime('%Y-%m-%d')) + 
-                          '_' + str(p1) + '_' + str(p2) + '_archive.csv')
+            frame.to_csv(match_path + str(p1) + '_' + str(p2) + '_archive.csv')
             
         time.sleep(15)
-        while sum([1 - pd.read_csv('Scraped Matches/' + 
-                                str(datetime.today().strftime('%Y-%m-%d')) + 
-                                '_' + str(p1) + '_' + str(p2) + '_updated.csv', 
+        while sum([1 - pd.read_csv(match_path + str(p1) + '_' + str(p2) + '_updated.csv', 
                                 index_col = 0).values[0][0] for p1, p2 in new_data]):
             print 'Waiting to Update'
             time.sleep(5)
@@ -166,13 +158,8 @@ def parse_database(database, players):
         player_matchup[player1] = player2
         player_matchup[player2] = player1
             
-        p1 = players.loc[player1]['Player ID']
-        p2 = players.loc[player2]['Player ID']
-        
-        if type(p1) != np.int64:
-            p1 = p1.values[-1]
-        if type(p2) != np.int64:
-            p2 = p2.values[-1]
+        p1 = resolve_player_id(player1, players)
+        p2 = resolve_player_id(player2, players)
         
         print p1, p2
         
@@ -0,0 +1,184 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_ATP_Matches.py
+#
+# Description: This module reads Jeff Sackmann's ATP match files (tennis_atp-master), which
+# hold one row per match with the tourney, both players, their rankings, the score and the
+# match statistics. The files are found through a catalog of tour level and year, read with
+# only the needed columns and explicit types, and can be parsed on several worker processes.
+# Every parsed file is kept as a binary snapshot, so a file is only parsed again once its
+# size or modification time changes.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+import os
+import re
+from Tennis_PBP_Engine import run_tasks
+
+atp_path = 'tennis_atp-master/'
+match_snapshot_path = 'Match Snapshot'
+
+#--------------------------------------------------------------------------------------------
+# Catalog of the match files. The files are named atp_matches_<year>.csv for the tour level
+# (main), atp_matches_futures_<year>.csv for the Futures and atp_matches_qual_chall_<year>.csv
+# for the qualifying and Challenger matches.
+#--------------------------------------------------------------------------------------------
+
+match_levels = ['main', 'futures', 'qual_chall']
+match_file_pattern = re.compile(r'^atp_matches_(?:(futures|qual_chall)_)?(\d{4})\.csv$')
+
+#--------------------------------------------------------------------------------------------
+# Columns of the match files, with the types they are read with. Columns that are blank on
+# some rows (seeds, heights, ages, rankings and the match statistics) are read as floats.
+# The 2016 files end every row with extra empty fields, so the columns are always read by
+# name to keep the rows from shifting.
+#--------------------------------------------------------------------------------------------
+
+match_stats = ['ace', 'df', 'svpt', '1stIn', '1stWon', '2ndWon', 'SvGms', 'bpSaved', 'bpFaced']
+
+match_player_dtypes = [('id', np.int32),
+                       ('seed', np.float32),
+                       ('entry', str),
+                       ('name', str),
+                       ('hand', str),
+                       ('ht', np.float32),
+                       ('ioc', str),
+                       ('age', np.float64),
+                       ('rank', np.float32),
+                       ('rank_points', np.float32)]
+
+match_dtypes = [('tourney_id', str),
+                ('tourney_name', str),
+                ('surface', str),
+                ('draw_size', np.float32),
+                ('tourney_level', str),
+                ('tourney_date', np.int32),
+                ('match_num', np.int32)] + \
+               [('winner_' + x, t) for x, t in match_player_dtypes] + \
+               [('loser_' + x, t) for x, t in match_player_dtypes] + \
+               [('score', str),
+                ('best_of', np.int8),
+                ('round', str),
+                ('minutes', np.float32)] + \
+               [(p + x, np.float32) for p in ['w_', 'l_'] for x in match_stats]
+
+match_columns = [x for x, t in match_dtypes]
+
+#--------------------------------------------------------------------------------------------
+# Lists the match files of the given levels and years, ordered by level and then year.
+# years is a (first, last) pair of years, both included, where either end can be None.
+# Returns a frame with the 'Level', 'Year' and 'File' of every file.
+#--------------------------------------------------------------------------------------------
+
+def match_catalog(levels=['main'], years=(None, None), path=atp_path):
+    first, last = years
+    catalog = []
+    for filename in os.listdir(path):
+        found = match_file_pattern.match(filename)
+        if found is None:
+            continue
+        level, year = found.group(1) or 'main', int(found.group(2))
+        if level in levels and (first is None or year >= first) and (last is None or year <= last):
+            catalog.append((match_levels.index(level), level, year, filename))
+    catalog.sort()
+    return pd.DataFrame([x[1:] for x in catalog], columns=['Level', 'Year', 'File'])
+
+
+#--------------------------------------------------------------------------------------------
+# Reads one match file with the given columns.
+#--------------------------------------------------------------------------------------------
+
+def parse_match_file(filename, columns=match_columns):
+    dtypes = dict(match_dtypes)
+    return pd.read_csv(filename, usecols=columns, index_col=False,
+                       dtype=dict((x, dtypes[x]) for x in columns))[columns]
+
+#--------------------------------------------------------------------------------------------
+# Snapshots. The snapshot of a match file is a pickle of all its columns as arrays, with the
+# string columns stored as codes into the file's unique values. It is kept with the size and
+# modification time of the file and the column types it was read with, and is used as long
+# as all three still match. Otherwise the file is parsed and the snapshot is written again.
+# Deleting the snapshot folder only means that the next load parses all files again.
+#--------------------------------------------------------------------------------------------
+
+def file_fingerprint(filename):
+    stat = os.stat(filename)
+    return stat.st_size, int(stat.st_mtime)
+
+
+def snapshot_key(filename):
+    return file_fingerprint(filename) + (tuple((x, np.dtype(t).str) for x, t in match_dtypes),)
+
+
+def encode_match_file(data):
+    encoded = dict()
+    for name in data.columns:
+        if data[name].dtype == object:
+            codes, uniques = pd.factorize(data[name].values)
+            encoded[name] = (codes.astype(np.int32), np.asarray(uniques, dtype=object))
+        else:
+            encoded[name] = data[name].values
+    return encoded
+
+
+def read_snapshot(filename, snapshot):
+    snapshot_file = os.path.join(snapshot, os.path.basename(filename)[:-4] + '.pkl')
+    if os.path.exists(snapshot_file):
+        try:
+            key, encoded = pd.read_pickle(snapshot_file)
+        except (ValueError, EOFError):
+            key, encoded = None, None
+        if key == snapshot_key(filename):
+            return encoded
+    encoded = encode_match_file(parse_match_file(filename))
+    if not os.path.exists(snapshot):
+        os.makedirs(snapshot)
+    pd.to_pickle((snapshot_key(filename), encoded), snapshot_file + '.tmp')
+    os.rename(snapshot_file + '.tmp', snapshot_file)
+    return encoded
+
+
+def load_match_file(task):
+    filename, columns, snapshot = task
+    if snapshot is None:
+        data = parse_match_file(filename, columns)
+        return dict((name, data[name].values) for name in columns)
+    encoded = read_snapshot(filename, snapshot)
+    return dict((name, encoded[name]) for name in columns)
+
+#--------------------------------------------------------------------------------------------
+# Joins the columns of several files. Coded string columns are joined by shifting the codes
+# of every file past the unique values of the files before it, so the strings are only
+# looked up once per column. Missing strings (code -1) become NaN.
+#--------------------------------------------------------------------------------------------
+
+def join_column(parts):
+    if not isinstance(parts[0], tuple):
+        return np.concatenate(parts)
+    codes, uniques, offset = [], [], 0
+    for part_codes, part_uniques in parts:
+        codes.append(np.where(part_codes < 0, len(part_uniques), part_codes) + offset)
+        uniques.append(np.append(part_uniques, np.array([np.nan], dtype=object)))
+        offset += len(part_uniques) + 1
+    return np.concatenate(uniques)[np.concatenate(codes)]
+
+#--------------------------------------------------------------------------------------------
+# Reads the matches of the given levels and years (see match_catalog) into one frame, with
+# the given columns in the order they are given. Each file keeps its own row numbers as the
+# index. Files are read on worker processes if workers is more than 1, and through their
+# snapshots unless snapshot is None.
+#--------------------------------------------------------------------------------------------
+
+def read_atp_matches(levels=['main'], years=(None, None), columns=match_columns, workers=1,
+                     snapshot=match_snapshot_path, path=atp_path):
+    catalog = match_catalog(levels, years, path)
+    tasks = [(os.path.join(path, x), list(columns), snapshot) for x in catalog['File']]
+    if len(tasks) == 0 or len(columns) == 0:
+        return pd.DataFrame(columns=columns)
+    parts = run_tasks(load_match_file, tasks, workers)
+    sizes = [len(x[0]) if isinstance(x, tuple) else len(x) for x in [part[columns[0]] for part in parts]]
+    index = np.concatenate([np.arange(n) for n in sizes])
+    return pd.DataFrame(dict((name, join_column([part[name] for part in parts])) for name in columns),
+                        index=index, columns=columns)
@@ -0,0 +1,95 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Calendar.py
+#
+# Description: This module holds the date arithmetic used across the project. The data sets
+# give dates as YYYYMMDD integers (tourney dates, ranking weeks, tourney weeks), which are
+# turned into NumPy datetime64[D] days with integer arithmetic instead of being parsed as
+# strings. Every function takes and returns whole arrays, so a column of dates is handled
+# in one call; scalars work as well.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+
+#--------------------------------------------------------------------------------------------
+# Conversions between YYYYMMDD integers and datetime64[D] days
+#--------------------------------------------------------------------------------------------
+
+def yyyymmdd_days(dates):
+    dates = np.asarray(dates).astype(np.int64)
+    months = (dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + (dates % 100 - 1)
+
+
+def days_yyyymmdd(days):
+    days = np.asarray(days, dtype='datetime64[D]')
+    months = days.astype('datetime64[M]')
+    month_numbers = months.astype(np.int64)
+    return ((month_numbers // 12 + 1970) * 10000 + (month_numbers % 12 + 1) * 100 +
+            (days - months.astype('datetime64[D]')).astype(np.int64) + 1)
+
+
+#--------------------------------------------------------------------------------------------
+# Day of the week, with Monday as 0 (1970-01-01 was a Thursday)
+#--------------------------------------------------------------------------------------------
+
+def weekday(days):
+    return (np.asarray(days, dtype='datetime64[D]').astype(np.int64) + 3) % 7
+
+
+#--------------------------------------------------------------------------------------------
+# Monday of the tourney week of each day. Tourneys are played from Monday, so a Saturday or
+# Sunday belongs to the week that starts on the following Monday.
+#--------------------------------------------------------------------------------------------
+
+def monday_of_week(days):
+    days = np.asarray(days, dtype='datetime64[D]')
+    wd = weekday(days)
+    return days + np.where(wd >= 5, 7 - wd, -wd)
+
+
+#--------------------------------------------------------------------------------------------
+# Adds (or with a negative number, subtracts) whole months. A day past the end of the new
+# month is moved to its last day, e.g. 31 March minus one month is 28 (or 29) February.
+#--------------------------------------------------------------------------------------------
+
+def add_months(days, months):
+    days = np.asarray(days, dtype='datetime64[D]')
+    start = days.astype('datetime64[M]')
+    offset = days - start.astype('datetime64[D]')
+    new_start = start + np.asarray(months, dtype=np.int64)
+    month_length = (new_start + 1).astype('datetime64[D]') - new_start.astype('datetime64[D]')
+    return new_start.astype('datetime64[D]') + np.minimum(offset, month_length - 1)
+
+
+#--------------------------------------------------------------------------------------------
+# Window of the given number of months that ends on each day: returns the first day of the
+# window, so a date d is in it if first <= d < day
+#--------------------------------------------------------------------------------------------
+
+def month_window(days, months):
+    return add_months(days, -np.asarray(months, dtype=np.int64))
+
+
+#--------------------------------------------------------------------------------------------
+# Season of each tourney. A tourney whose week starts in the last days of December and runs
+# into January (its Thursday is in the new year) belongs to the new season.
+#--------------------------------------------------------------------------------------------
+
+def tourney_year(days):
+    thursday = monday_of_week(days) + 3
+    return thursday.astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+#--------------------------------------------------------------------------------------------
+# Today, and days written as 'YYYY-MM-DD' as in the names of the scraped match files
+#--------------------------------------------------------------------------------------------
+
+def today():
+    return np.datetime64('today', 'D')
+
+
+def date_string(days):
+    strings = np.datetime_as_string(np.asarray(days, dtype='datetime64[D]'))
+    return strings if strings.ndim > 0 else str(strings)
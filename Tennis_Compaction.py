@@ -0,0 +1,80 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Compaction.py
+#
+# Description: This module shrinks data frames that are kept in memory for a long time. Whole
+# number columns are stored in the smallest integer type that holds them (a nullable
+# integer type if they have missing values), strings with few distinct values become
+# categoricals, and columns that are not used are dropped. The bytes every column takes
+# before and after are reported.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+
+# A string column becomes a categorical if it has at most this share of distinct values
+category_share = 0.5
+
+integer_types = [np.int8, np.int16, np.int32, np.int64]
+
+#--------------------------------------------------------------------------------------------
+# Smallest integer type that holds all the values, or None if a value is not a whole number
+#--------------------------------------------------------------------------------------------
+
+def integer_type(values):
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if len(values) == 0:
+        return np.int8
+    if values.dtype.kind == 'f' and not (np.isfinite(values).all() and (values == np.round(values)).all()):
+        return None
+    low, high = values.min(), values.max()
+    for dtype in integer_types:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return None
+
+#--------------------------------------------------------------------------------------------
+# Compact type of one column: an integer type for whole numbers ('Int8' etc. if some are
+# missing, where this version of pandas has them), 'category' for strings with few distinct
+# values, and otherwise its own type.
+#--------------------------------------------------------------------------------------------
+
+def compact_type(column, share=category_share):
+    kind = column.dtype.kind
+    if kind in 'iuf':
+        dtype = integer_type(column.values)
+        if dtype is None:
+            return column.dtype
+        if kind == 'f' and column.isnull().any():
+            name = 'Int' + str(np.dtype(dtype).itemsize * 8)
+            return name if hasattr(pd, name + 'Dtype') else column.dtype
+        return np.dtype(dtype)
+    if kind == 'O' and column.nunique() <= share * len(column):
+        return 'category'
+    return column.dtype
+
+#--------------------------------------------------------------------------------------------
+# Returns the compacted frame, without the columns in drop, and a frame with the type and
+# bytes of every column before and after ('Saved' is 0 for columns that are kept as they are
+# and the full size for dropped ones).
+#--------------------------------------------------------------------------------------------
+
+def compact_frame(data, drop=[], share=category_share):
+    before = data.memory_usage(deep=True)
+    compacted = data.drop([x for x in drop if x in data.columns], axis=1)
+    for name in compacted.columns:
+        dtype = compact_type(compacted[name], share)
+        if str(dtype) != str(compacted[name].dtype):
+            compacted[name] = compacted[name].astype(dtype)
+    after = compacted.memory_usage(deep=True)
+
+    sizes = pd.DataFrame({'Column': before.index,
+                          'Old Type': [str(data[x].dtype) if x in data.columns else 'index' for x in before.index],
+                          'New Type': [str(compacted[x].dtype) if x in compacted.columns else
+                                       'index' if x == 'Index' else 'dropped' for x in before.index],
+                          'Old Bytes': before.values,
+                          'New Bytes': after.reindex(before.index).fillna(0).astype(np.int64).values},
+                         columns=['Column', 'Old Type', 'New Type', 'Old Bytes', 'New Bytes'])
+    sizes['Saved'] = sizes['Old Bytes'] - sizes['New Bytes']
+    return compacted, sizes
@@ -0,0 +1,75 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Data_Cache.py
+#
+# Description: This module keeps the results of a slow data preparation on disk, so that a
+# later run can load them instead of preparing them again. A cached result is kept with a
+# key made of a version tag of the code that prepared it and the fingerprints of all the
+# input files it was prepared from, and is only used while the key still matches.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import pandas as pd
+import hashlib
+import os
+from Tennis_ATP_Matches import file_fingerprint
+
+#--------------------------------------------------------------------------------------------
+# Fingerprints of the input files. A file is fingerprinted by a hash of its content, so a
+# file that is written again with the same content keeps its fingerprint. A folder (a store
+# of large binary files that are only ever written whole) is fingerprinted by the size and
+# modification time of every file in it, which does not need to read them. A missing input
+# has the fingerprint None.
+#--------------------------------------------------------------------------------------------
+
+def content_fingerprint(filename, block_size=2**20):
+    digest = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def folder_fingerprint(path):
+    files = []
+    for folder, subfolders, names in os.walk(path):
+        subfolders.sort()
+        for name in sorted(names):
+            filename = os.path.join(folder, name)
+            files.append([os.path.relpath(filename, path)] + list(file_fingerprint(filename)))
+    return files
+
+
+def input_fingerprint(path):
+    if os.path.isdir(path):
+        return folder_fingerprint(path)
+    if os.path.exists(path):
+        return content_fingerprint(path)
+    return None
+
+
+def cache_key(inputs, version):
+    return {'version': version, 'inputs': [[x, input_fingerprint(x)] for x in inputs]}
+
+#--------------------------------------------------------------------------------------------
+# Reads the cached value, or returns None if there is no cache or it was written with a
+# different key. The value is written with its key as a pickle, to a temporary file that is
+# then renamed, so an interrupted write never leaves a broken cache behind.
+#--------------------------------------------------------------------------------------------
+
+def read_cache(path, key):
+    if not os.path.exists(path):
+        return None
+    try:
+        cached_key, value = pd.read_pickle(path)
+    except (ValueError, EOFError, TypeError):
+        return None
+    return value if cached_key == key else None
+
+
+def write_cache(path, key, value):
+    folder = os.path.dirname(path)
+    if folder != '' and not os.path.exists(folder):
+        os.makedirs(folder)
+    pd.to_pickle((key, value), path + '.tmp')
+    os.rename(path + '.tmp', path)
@@ -0,0 +1,352 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_PBP_Benchmark.py
+#
+# Description: This script benchmarks the point-by-point parser. It generates synthetic pbp
+# strings for every match format in the format registry, measures the throughput (points and
+# matches per second) and peak memory of the parser on the synthetic and the real data,
+# checks the parser output of the real tennis_pointbypoint-master files against stored
+# digests, and compares everything with a stored baseline ('Benchmark Baseline.json').
+#
+# python Tennis_PBP_Benchmark.py                     runs the suite and fails on a regression
+# python Tennis_PBP_Benchmark.py --update-baseline   runs the suite and stores a new baseline
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+import multiprocessing
+import resource
+import hashlib
+import json
+import time
+import sys
+import os
+from Tennis_PBP_Engine import match_formats, FINAL_ADVANTAGE, FINAL_MATCH_TIEBREAK, \
+                              parse_sources, resolve_formats, match_tiebreak_points, pts
+from Tennis_Score_States import score_states, state_labels
+from Tennis_PBP_Project import getNewRow, pbp_catalog, read_pbp_sources
+
+baseline_path = 'Benchmark Baseline.json'
+
+# A run fails if throughput drops or peak memory grows by more than these fractions
+throughput_tolerance = 0.25
+memory_tolerance = 0.25
+
+synthetic_matches = 20000
+# All 2,466 matches of the first file of the catalog
+legacy_matches = 2466
+
+#--------------------------------------------------------------------------------------------
+# Every format of the registry gets a synthetic tournament name, so that the synthetic
+# matches resolve to their format like real ones do. The names are only known to the
+# benchmark: synthetic_format_names is passed to the engine in place of tourney_formats.
+#--------------------------------------------------------------------------------------------
+
+synthetic_tourneys = dict(('Synthetic' + ''.join(x for x in f.name if x.isalnum()), f)
+                          for f in match_formats)
+synthetic_format_names = dict((name, f.name) for name, f in synthetic_tourneys.items())
+
+#--------------------------------------------------------------------------------------------
+# Synthetic generator. Points are won by the server with probability p_serve, and a small
+# share of them are coded as aces ('A') and double faults ('D'). Games, tiebreaks (with a '/'
+# at every change of server) and sets are played by the rules of the match format, and the
+# pbp string uses the same delimiters as Jeff Sackmann's files. Each function returns the
+# string and the winner of the game, tiebreak, set or match (1 or 2).
+#--------------------------------------------------------------------------------------------
+
+def point_symbol(rng, server_won):
+    if server_won:
+        return 'A' if rng.random_sample() < 0.1 else 'S'
+    return 'D' if rng.random_sample() < 0.05 else 'R'
+
+
+def synthetic_game(rng, server, p_serve, no_ad):
+    chars, won = [], [0, 0]
+    while max(won) < 4 or (abs(won[0] - won[1]) < 2 and not no_ad):
+        server_won = rng.random_sample() < p_serve
+        chars.append(point_symbol(rng, server_won))
+        won[(server - 1) if server_won else (2 - server)] += 1
+    return ''.join(chars), 1 if won[0] > won[1] else 2
+
+
+def synthetic_tiebreak(rng, first_server, p_serve, target):
+    chars, won, k = [], [0, 0], 0
+    while max(won) < target or abs(won[0] - won[1]) < 2:
+        server = first_server if ((k + 1) // 2) % 2 == 0 else 3 - first_server
+        if k > 0 and k % 2 == 1:
+            chars.append('/')
+        server_won = rng.random_sample() < p_serve
+        chars.append(point_symbol(rng, server_won))
+        won[(server - 1) if server_won else (2 - server)] += 1
+        k = k + 1
+    return ''.join(chars), 1 if won[0] > won[1] else 2, won
+
+
+def synthetic_match(rng, match_format, p_serve=0.63):
+    sets, server = [], 1
+    sets_won, set_scores = [0, 0], []
+    while max(sets_won) <= match_format.best_of // 2:
+        final_set = sets_won[0] == sets_won[1] == match_format.best_of // 2
+        games, parts = [0, 0], []
+        if final_set and match_format.final_set == FINAL_MATCH_TIEBREAK:
+            text, winner, points = synthetic_tiebreak(rng, server, p_serve, 10)
+            parts.append(text)
+            games, tiebreak_points = points, 'match'
+            server = 3 - server
+        else:
+            tiebreak_points = None
+            while True:
+                if games == [6, 6] and not (final_set and match_format.final_set == FINAL_ADVANTAGE):
+                    text, winner, points = synthetic_tiebreak(rng, server, p_serve, 7)
+                    parts.append(text)
+                    games[winner - 1] += 1
+                    tiebreak_points = min(points)
+                    server = 3 - server
+                    break
+                text, winner = synthetic_game(rng, server, p_serve, match_format.no_ad)
+                parts.append(text)
+                games[winner - 1] += 1
+                server = 3 - server
+                if max(games) >= 6 and abs(games[0] - games[1]) >= 2:
+                    break
+        set_winner = 1 if games[0] > games[1] else 2
+        sets_won[set_winner - 1] += 1
+        sets.append(';'.join(parts))
+        set_scores.append((games, tiebreak_points))
+    winner = 1 if sets_won[0] > sets_won[1] else 2
+
+    score = []
+    for games, tiebreak_points in set_scores:
+        won, lost = (games[0], games[1]) if winner == 1 else (games[1], games[0])
+        if tiebreak_points == 'match':
+            score.append('[' + str(won) + '-' + str(lost) + ']')
+        elif tiebreak_points is not None:
+            score.append(str(won) + '-' + str(lost) + '(' + str(tiebreak_points) + ')')
+        else:
+            score.append(str(won) + '-' + str(lost))
+    return '.'.join(sets), winner, ' '.join(score)
+
+#--------------------------------------------------------------------------------------------
+# Generates a raw data frame of n synthetic matches in the layout of the pbp files, spread
+# evenly over the formats of the registry (or over the given tournament names).
+#--------------------------------------------------------------------------------------------
+
+def synthetic_pbp(n, seed=0, tourneys=None):
+    rng = np.random.RandomState(seed)
+    tourneys = sorted(synthetic_tourneys) if tourneys is None else tourneys
+    rows = []
+    for i in range(n):
+        tourney = tourneys[i % len(tourneys)]
+        pbp, winner, score = synthetic_match(rng, synthetic_tourneys[tourney])
+        rows.append(('01 Jan 15', tourney, 'SYN', 'Main', 'Player A' + str(i), 'Player B' + str(i),
+                     winner, pbp, score, 1))
+    return pd.DataFrame(rows, columns=['date', 'tny_name', 'tour', 'draw', 'server1', 'server2',
+                                       'winner', 'pbp', 'score', 'adf_flag'])
+
+#--------------------------------------------------------------------------------------------
+# Checks that the points of the synthetic match tiebreaks get their own state IDs: their
+# labels (see state_labels) must give back the set score, 0-0 in games and the match
+# tiebreak score from the server's view (folded at 9-9). Returns a list of errors.
+#--------------------------------------------------------------------------------------------
+
+def check_match_tiebreak_states(point_data):
+    p1Set, p2Set = point_data['p1Set'].values, point_data['p2Set'].values
+    formats = resolve_formats(point_data['Tourney'].values, synthetic_format_names)
+    match_tiebreak = match_tiebreak_points(formats, p1Set, p2Set)
+    if not match_tiebreak.any():
+        return ['no synthetic match tiebreak points']
+    states, game_states = score_states(p1Set, p2Set, point_data['p1Game'].values, point_data['p2Game'].values,
+                                       point_data['p1Score'].values, point_data['p2Score'].values,
+                                       point_data['Server'].values, match_tiebreak)
+    points = point_data[match_tiebreak]
+    labels = state_labels(states[match_tiebreak])
+
+    p1_serving = points['Server'].values == 1
+    def server_view(p1, p2):
+        return np.where(p1_serving, p1, p2), np.where(p1_serving, p2, p1)
+    set_s, set_r = server_view(points['p1Set'].values, points['p2Set'].values)
+    game_s, game_r = server_view(points['p1Game'].values, points['p2Game'].values)
+    point_s, point_r = server_view(points['p1Score'].values, points['p2Score'].values)
+    deuce = (point_s >= 9) & (point_r >= 9)
+    point_s, point_r = np.where(deuce, 9 + (point_s > point_r), point_s), \
+                       np.where(deuce, 9 + (point_s < point_r), point_r)
+
+    expected = {'Set Score Server View': [str(x) + '-' + str(y) for x, y in zip(set_s, set_r)],
+                'Game Score Server View': [str(x) + '-' + str(y) for x, y in zip(game_s, game_r)],
+                'Game State New': ['Server ' + str(x) + '-' + str(y) for x, y in zip(point_s, point_r)]}
+    errors = []
+    for name in ['Set Score Server View', 'Game Score Server View', 'Game State New']:
+        wrong = labels[name] != np.array(expected[name], dtype=object)
+        if wrong.any():
+            errors.append(str(wrong.sum()) + ' match tiebreak points with the wrong ' + name + ', e.g. ' +
+                          str(labels[name][wrong][0]) + ' for ' + expected[name][np.flatnonzero(wrong)[0]])
+    return errors
+
+#--------------------------------------------------------------------------------------------
+# Digest of a parser output frame, used for the golden-output checks
+#--------------------------------------------------------------------------------------------
+
+def frame_digest(frame):
+    frame = frame.drop([x for x in ['Points'] if x in frame.columns], axis=1)
+    hashes = pd.util.hash_pandas_object(frame, index=True).values
+    return hashlib.md5(hashes.tobytes()).hexdigest()
+
+#--------------------------------------------------------------------------------------------
+# Benchmarks. Each one returns a dictionary with the number of matches and points parsed,
+# the time taken, and any golden-output fields.
+#
+# (1) synthetic: parses the synthetic matches of every format. Every synthetic match must
+#     parse without a validation flag and end in the set score it was generated with, and
+#     the points of its match tiebreaks must get state IDs that decode to their scores.
+# (2) real: parses the pbp files of the catalog, with a digest of the point data and the
+#     number of rejected matches of every file.
+# (3) legacy: runs getNewRow over every character of a sample of real matches, which is
+#     what tourDataSet used to do.
+#--------------------------------------------------------------------------------------------
+
+def benchmark_synthetic(workers=1):
+    raw_data = synthetic_pbp(synthetic_matches)
+    start = time.time()
+    point_data, rejected = parse_sources([('synthetic', raw_data)], three_set=True, five_set=True,
+                                         drop_invalid=False, workers=workers,
+                                         format_names=synthetic_format_names)[0]
+    seconds = time.time() - start
+
+    errors = []
+    if len(rejected) > 0:
+        errors.append(str(len(rejected)) + ' synthetic matches flagged, e.g. ' +
+                      str(rejected['Reason'].iloc[0]) + ' in ' + str(rejected['Tourney'].iloc[0]))
+    last = point_data.groupby('MatchNum').last()
+    sets_won = np.where(last['Winner'].values == 1, last['p1Set'].values, last['p2Set'].values)
+    needed = np.array([synthetic_tourneys[x].best_of // 2 for x in last['Tourney'].values])
+    if not (sets_won == needed).all():
+        errors.append(str((sets_won != needed).sum()) + ' synthetic matches end in the wrong set score')
+    errors.extend(check_match_tiebreak_states(point_data))
+    return {'matches': len(raw_data), 'points': len(point_data), 'seconds': seconds,
+            'digest': frame_digest(point_data), 'errors': errors}
+
+
+def benchmark_real(workers=1):
+    sources = read_pbp_sources(pbp_catalog())
+    start = time.time()
+    parsed = parse_sources(sources, three_set=True, five_set=True, drop_invalid=True, workers=workers)
+    seconds = time.time() - start
+    golden = dict((source, {'points': len(point_data), 'rejected': len(rejected),
+                            'digest': frame_digest(point_data)})
+                  for (source, raw_data), (point_data, rejected) in zip(sources, parsed))
+    return {'matches': sum(len(raw_data) for source, raw_data in sources),
+            'points': sum(len(point_data) for point_data, rejected in parsed),
+            'seconds': seconds, 'golden': golden, 'errors': []}
+
+
+def benchmark_legacy(workers=1):
+    raw_data = read_pbp_sources(pbp_catalog()[:1])[0][1].iloc[:legacy_matches]
+    formats = resolve_formats(raw_data['tny_name'].values)
+    start = time.time()
+    points = 0
+    for pbp, code in zip(raw_data['pbp'].values, formats):
+        row = ['', '', 1, 0, 0, 0, 0, 0, 0, 1, pts, '', 0]
+        for char in str(pbp):
+            row = getNewRow(*(row[:11] + [char, match_formats[code]]))
+            points = points + (row[12] == 0)
+    seconds = time.time() - start
+    return {'matches': len(raw_data), 'points': points, 'seconds': seconds, 'errors': []}
+
+
+benchmarks = [('synthetic', benchmark_synthetic),
+              ('real', benchmark_real),
+              ('legacy', benchmark_legacy)]
+
+#--------------------------------------------------------------------------------------------
+# Runs a benchmark in a fresh process, so that its peak resident memory (ru_maxrss) is its
+# own and not left over from an earlier benchmark.
+#--------------------------------------------------------------------------------------------
+
+def benchmark_worker(name, queue, workers):
+    result = dict(benchmarks)[name](workers)
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    queue.put(result)
+
+
+def run_benchmark(name, workers=1):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=benchmark_worker, args=(name, queue, workers))
+    process.start()
+    result = queue.get()
+    process.join()
+    result['points_per_sec'] = result['points'] / max(result['seconds'], 1e-9)
+    result['matches_per_sec'] = result['matches'] / max(result['seconds'], 1e-9)
+    return result
+
+#--------------------------------------------------------------------------------------------
+# Compares the results with the baseline. Golden outputs have to match exactly, while
+# throughput and peak memory may move within the tolerances. Returns a list of regressions.
+#--------------------------------------------------------------------------------------------
+
+def compare_with_baseline(results, baseline):
+    regressions = []
+    for name, result in sorted(results.items()):
+        regressions.extend(name + ': ' + x for x in result['errors'])
+        if name not in baseline:
+            regressions.append(name + ': no baseline (run with --update-baseline)')
+            continue
+        base = baseline[name]
+        if result['points_per_sec'] < base['points_per_sec'] * (1 - throughput_tolerance):
+            regressions.append(name + ': throughput ' + str(int(result['points_per_sec'])) +
+                               ' points/sec against ' + str(int(base['points_per_sec'])) + ' in the baseline')
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + memory_tolerance):
+            regressions.append(name + ': peak RSS ' + str(int(result['peak_rss_mb'])) +
+                               ' MB against ' + str(int(base['peak_rss_mb'])) + ' MB in the baseline')
+        if 'digest' in base and result.get('digest') != base['digest']:
+            regressions.append(name + ': output digest differs from the baseline')
+        for source, golden in sorted(base.get('golden', {}).items()):
+            if result.get('golden', {}).get(source) != golden:
+                regressions.append(name + ': golden output of ' + source + ' differs from the baseline ' +
+                                   str(golden) + ' -> ' + str(result.get('golden', {}).get(source)))
+    return regressions
+
+
+def read_baseline(path=baseline_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_baseline(results, path=baseline_path):
+    keep = ['matches', 'points', 'seconds', 'points_per_sec', 'matches_per_sec', 'peak_rss_mb',
+            'digest', 'golden']
+    baseline = dict((name, dict((k, v) for k, v in result.items() if k in keep))
+                    for name, result in results.items())
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+
+#--------------------------------------------------------------------------------------------
+# Main Function
+#--------------------------------------------------------------------------------------------
+
+def main():
+    results = dict()
+    for name, function in benchmarks:
+        results[name] = run_benchmark(name)
+        result = results[name]
+        print(name + ': ' + str(result['matches']) + ' matches, ' + str(result['points']) + ' points in ' +
+              str(round(result['seconds'], 2)) + 's (' + str(int(result['points_per_sec'])) + ' points/sec, ' +
+              str(int(result['matches_per_sec'])) + ' matches/sec), peak RSS ' +
+              str(int(result['peak_rss_mb'])) + ' MB')
+
+    if '--update-baseline' in sys.argv:
+        write_baseline(results)
+        print('Baseline written to ' + baseline_path)
+        return
+
+    regressions = compare_with_baseline(results, read_baseline())
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if len(regressions) > 0:
+        sys.exit(1)
+    print('No regressions against ' + baseline_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,575 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_PBP_Engine.py
+#
+# Description: This module holds the score-transition engine that splits Jeff Sackmann's
+# point-by-point strings into their point components. It replaces the per-character calls
+# to getNewRow with integer-coded states and a precompiled transition table, and runs every
+# match of a file in lockstep so that the work is done with NumPy array operations.
+# Matches are parsed in chunks, which can also be streamed (iter_point_frames, iter_points)
+# so that memory stays flat whatever the size of the corpus.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+import multiprocessing
+from collections import namedtuple
+
+#--------------------------------------------------------------------------------------------
+# Tournament lists used to decide which matches are eligible (best-of-3 vs. best-of-5) and
+# which tournaments play an advantage final set instead of a tiebreak at 6-6 in the 5th set
+# (or in the 3rd set of the women's Australian Open, French Open and Wimbledon).
+#--------------------------------------------------------------------------------------------
+
+five_set_tourneys = ["Men'sAustralianOpen","Men'sAustralianOpen.",'MensAustralianOpen', 'MensAustralianOpen.html',
+                     "Men'sFrenchOpen", "Men'sFrenchOpen.",'MensFrenchOpen', 'MensFrenchOpen.html',
+                     "Gentlemen'sWimbledonSingles", "Gentlemen'sWimbledonSingles.","Gentlemen'sWimbledonSingles.html",
+                     "Men'sUSOpen", "Men'sUSOpen.","Men'sUSOpen.html"]
+
+only_both = ['DavisCup','DavisCup-Live', 'DavisCup.html', 'DavisCupLive',
+             "Men'sAustralianOpenWildcardPlayoff"]
+
+no_final_set_tiebreak = ["Men'sAustralianOpen","Men'sAustralianOpen.",
+                         'MensAustralianOpen', 'MensAustralianOpen.html',
+                         "Men'sFrenchOpen", "Men'sFrenchOpen.",'MensFrenchOpen',
+                         'MensFrenchOpen.html', "Gentlemen'sWimbledonSingles",
+                         "Gentlemen'sWimbledonSingles.","Gentlemen'sWimbledonSingles.html",
+                         'DavisCup','DavisCup-Live', 'DavisCup.html', 'DavisCupLive']
+
+womens_no_final_set_tiebreak = ["Women'sAustralianOpen", "Women'sAustralianOpen.",
+                                'WomensAustralianOpen', 'WomensAustralianOpen.html',
+                                "Women'sFrenchOpen", "Women'sFrenchOpen.", 'WomensFrenchOpen',
+                                'WomensFrenchOpen.html', "Ladies'WimbledonSingles",
+                                "Ladies'WimbledonSingles.", "Ladies'WimbledonSingles2013",
+                                "Ladies'WimbledonSingles2013.html"]
+
+#--------------------------------------------------------------------------------------------
+# Registry of match formats. A format gives the number of sets (best_of), how the final set
+# is decided (a tiebreak at 6-6, an advantage set, or a 10-point match tiebreak played in
+# place of the final set), whether games are played with no-ad scoring (a deciding point at
+# 40-40), and whether every match of the tournament has the same length (Davis Cup rubbers
+# can be best-of-3 or best-of-5, so they are left out when only one length is asked for).
+#
+# tourney_formats maps a tournament name to the name of its format, and every tournament
+# that is not listed plays the default format. resolve_formats looks the format of every
+# match up once, and the parser then only works with the integer format codes. A different
+# map of tournament names to format names can be passed as format_names (the benchmark uses
+# this for its synthetic tournaments).
+#--------------------------------------------------------------------------------------------
+
+FINAL_TIEBREAK, FINAL_ADVANTAGE, FINAL_MATCH_TIEBREAK = 0, 1, 2
+
+MatchFormat = namedtuple('MatchFormat', ['name', 'best_of', 'final_set', 'no_ad', 'fixed_length'])
+
+match_formats = [MatchFormat('Best of 3', 3, FINAL_TIEBREAK, False, True),
+                 MatchFormat('Best of 3, Advantage Final Set', 3, FINAL_ADVANTAGE, False, True),
+                 MatchFormat('Best of 5', 5, FINAL_TIEBREAK, False, True),
+                 MatchFormat('Best of 5, Advantage Final Set', 5, FINAL_ADVANTAGE, False, True),
+                 MatchFormat('Best of 3 or 5', 5, FINAL_TIEBREAK, False, False),
+                 MatchFormat('Best of 3 or 5, Advantage Final Set', 5, FINAL_ADVANTAGE, False, False),
+                 MatchFormat('Best of 3, Match Tiebreak', 3, FINAL_MATCH_TIEBREAK, False, True),
+                 MatchFormat('Best of 3, No-Ad, Match Tiebreak', 3, FINAL_MATCH_TIEBREAK, True, True)]
+
+format_codes = dict((x.name, i) for i, x in enumerate(match_formats))
+format_best_of = np.array([x.best_of for x in match_formats], dtype=np.int64)
+format_final_set = np.array([x.final_set for x in match_formats], dtype=np.int64)
+format_no_ad = np.array([x.no_ad for x in match_formats], dtype=bool)
+format_fixed_length = np.array([x.fixed_length for x in match_formats], dtype=bool)
+
+default_format = 'Best of 3'
+
+tourney_formats = {}
+for tourney in five_set_tourneys + only_both:
+    name = 'Best of 5' if tourney in five_set_tourneys else 'Best of 3 or 5'
+    if tourney in no_final_set_tiebreak:
+        name = name + ', Advantage Final Set'
+    tourney_formats[tourney] = name
+for tourney in womens_no_final_set_tiebreak:
+    tourney_formats[tourney] = 'Best of 3, Advantage Final Set'
+
+
+def resolve_formats(tourneys, format_names=None):
+    format_names = tourney_formats if format_names is None else format_names
+    tourneys = pd.Series(np.asarray(tourneys, dtype=object))
+    codes = dict((name, format_codes[format_names.get(name, default_format)])
+                 for name in tourneys.unique())
+    return tourneys.map(codes).values.astype(np.int8)
+
+
+#--------------------------------------------------------------------------------------------
+# Marks the points that are played in a match tiebreak: the points of the final set (both
+# players one set short of winning) of a match whose format decides it by a match tiebreak.
+# formats holds the format code of every point.
+#--------------------------------------------------------------------------------------------
+
+def match_tiebreak_points(formats, p1Set, p2Set):
+    formats = np.asarray(formats, dtype=np.int64)
+    final = (format_best_of // 2)[formats]
+    return (format_final_set[formats] == FINAL_MATCH_TIEBREAK) & \
+           (np.asarray(p1Set) == final) & (np.asarray(p2Set) == final)
+
+#--------------------------------------------------------------------------------------------
+# Integer coding of the point-by-point symbols. S/A are points won by the server, R/D are
+# points won by the returner, ';' ends a game, '/' swaps the server in a tiebreak and '.'
+# ends a set. Any other character still produces a row but leaves the score unchanged.
+#--------------------------------------------------------------------------------------------
+
+pts = [0,15,30,40,45]
+
+SYM_SERVER, SYM_RETURNER, SYM_OTHER, SYM_GAME, SYM_SWAP, SYM_SET = 0, 1, 2, 3, 4, 5
+
+symbol_codes = np.full(256, SYM_OTHER, dtype=np.int8)
+for c, code in [('S', SYM_SERVER), ('A', SYM_SERVER), ('R', SYM_RETURNER), ('D', SYM_RETURNER),
+                (';', SYM_GAME), ('/', SYM_SWAP), ('.', SYM_SET)]:
+    symbol_codes[ord(c)] = code
+
+pts_values = np.array(pts, dtype=np.int64)
+pts_index = np.full(max(pts) + 1, -1, dtype=np.int64)
+pts_index[pts_values] = np.arange(len(pts))
+
+result_chars = np.array([''] + [chr(i) for i in range(1, 256)], dtype=object)
+
+#--------------------------------------------------------------------------------------------
+# Builds the transition table for points played in a regular (non-tiebreak) game. A state
+# is coded as (server - 1) * 25 + p1 index * 5 + p2 index, where the index is the position
+# of the score in pts. The table is indexed by (state, symbol) for the three point symbols
+# and follows exactly the same rules as getNewRow, including the wrap-around after a game
+# point is won from advantage.
+#--------------------------------------------------------------------------------------------
+
+def build_point_table():
+    n = len(pts)
+    table = np.zeros((2 * n * n, SYM_OTHER + 1), dtype=np.int64)
+    for server in [1, 2]:
+        for i1 in range(n):
+            for i2 in range(n):
+                state = (server - 1) * n * n + i1 * n + i2
+                for sym in [SYM_SERVER, SYM_RETURNER, SYM_OTHER]:
+                    j1, j2 = i1, i2
+                    if sym == SYM_OTHER:
+                        pass
+                    elif (server == 1) == (sym == SYM_SERVER):
+                        if i2 != n - 1:
+                            j1 = (i1 + 1) % n
+                        else:
+                            j2 = pts.index(40)
+                    else:
+                        if i1 != n - 1:
+                            j2 = (i2 + 1) % n
+                        else:
+                            j1 = pts.index(40)
+                    table[state, sym] = (server - 1) * n * n + j1 * n + j2
+    return table
+
+point_table = build_point_table()
+
+
+#--------------------------------------------------------------------------------------------
+# Runs the score-transition engine over an array of pbp strings. All matches are advanced
+# one character at a time in lockstep (longest matches first), so each step is a handful of
+# array operations over every match still in progress. Every character writes the new state
+# into an output slot: point characters open a new slot, while ';', '/' and '.' overwrite the
+# current one, which reproduces the append/replace logic of the original tourDataSet. The
+# final slot of each match (the state after the last point) is dropped at the end.
+#
+# formats holds the format code of every match (see resolve_formats). The rules of each
+# match are turned into per-match flags once, before the loop: whether its final set is an
+# advantage set, and whether its final set is a match tiebreak, in which case every point of
+# that set is counted like a tiebreak point from 0-0 in games. The match tiebreak branch is
+# skipped entirely when no match of the chunk plays one. No-ad games need no rule of their
+# own, since the ';' after the deciding point closes the game.
+#
+# Returns a dictionary of NumPy column arrays, where 'Match' is the position of the match
+# in the input array.
+#--------------------------------------------------------------------------------------------
+
+def score_transition_engine(pbp_strings, formats):
+    pbp_strings = [str(x) for x in pbp_strings]
+    formats = np.asarray(formats, dtype=np.int64)
+    n = len(pbp_strings)
+
+    lengths = np.array([len(x) for x in pbp_strings], dtype=np.int64)
+    stream = np.frombuffer(''.join(pbp_strings).encode('ascii'), dtype=np.uint8)
+    symbols = symbol_codes[stream]
+    starts = np.cumsum(lengths) - lengths
+
+    # Every match has an initial row plus one row per point character
+    point_count = np.concatenate(([0], np.cumsum(symbols <= SYM_OTHER)))
+    slots = 1 + point_count[starts + lengths] - point_count[starts]
+    base = np.cumsum(slots) - slots
+    total = int(slots.sum())
+
+    out_set1, out_set2 = np.zeros(total, dtype=np.int64), np.zeros(total, dtype=np.int64)
+    out_game1, out_game2 = np.zeros(total, dtype=np.int64), np.zeros(total, dtype=np.int64)
+    out_score1, out_score2 = np.zeros(total, dtype=np.int64), np.zeros(total, dtype=np.int64)
+    out_server = np.ones(total, dtype=np.int64)
+    out_result = np.zeros(total, dtype=np.uint8)
+
+    order = np.argsort(-lengths, kind='mergesort')
+    sorted_lengths = lengths[order]
+    lane_start, lane_base = starts[order], base[order]
+    lane_final = (format_best_of // 2)[formats[order]]
+    lane_advantage = format_final_set[formats[order]] == FINAL_ADVANTAGE
+    lane_match_tb = format_final_set[formats[order]] == FINAL_MATCH_TIEBREAK
+    any_match_tb = lane_match_tb.any()
+    s1, s2, g1, g2, a, b = [np.zeros(n, dtype=np.int64) for _ in range(6)]
+    srv = np.ones(n, dtype=np.int64)
+    slot = np.zeros(n, dtype=np.int64)
+
+    max_length = int(lengths.max()) if n > 0 else 0
+    for k in range(max_length):
+        m = int(np.searchsorted(-sorted_lengths, -k, side='left'))
+        sym = symbols[lane_start[:m] + k]
+        S1, S2, G1, G2, A, B, SRV = s1[:m], s2[:m], g1[:m], g2[:m], a[:m], b[:m], srv[:m]
+
+        # Points (regular games use the transition table, tiebreaks count up by one)
+        point = sym <= SYM_OTHER
+        final_set = (S1 == lane_final[:m]) & (S2 == lane_final[:m])
+        tiebreak = point & (G1 == 6) & (G2 == 6) & ~(lane_advantage[:m] & final_set)
+        if any_match_tb:
+            tiebreak = tiebreak | (point & lane_match_tb[:m] & final_set)
+        regular = np.flatnonzero(point & ~tiebreak)
+        if len(regular) > 0:
+            state = (SRV[regular] - 1) * 25 + pts_index[A[regular]] * 5 + pts_index[B[regular]]
+            state = point_table[state, sym[regular]] % 25
+            A[regular] = pts_values[state // 5]
+            B[regular] = pts_values[state % 5]
+        if tiebreak.any():
+            p1_won = tiebreak & (((SRV == 1) & (sym == SYM_SERVER)) | ((SRV == 2) & (sym == SYM_RETURNER)))
+            p2_won = tiebreak & (((SRV == 1) & (sym == SYM_RETURNER)) | ((SRV == 2) & (sym == SYM_SERVER)))
+            A += p1_won
+            B += p2_won
+
+        # End of Game
+        game = np.flatnonzero(sym == SYM_GAME)
+        if len(game) > 0:
+            ga, gb = A[game], B[game]
+            c1 = ga == 45
+            c2 = ~c1 & (gb == 45)
+            c3 = ~c1 & ~c2 & (ga == 0)
+            c4 = ~c1 & ~c2 & ~c3 & (gb == 0)
+            G1[game] += c1 | c3
+            G2[game] += c2 | c4
+            A[game], B[game] = 0, 0
+            SRV[game] = 3 - SRV[game]
+
+        # Change of Server in Tiebreak
+        swap = np.flatnonzero(sym == SYM_SWAP)
+        if len(swap) > 0:
+            SRV[swap] = 3 - SRV[swap]
+
+        # End of Set
+        sets = np.flatnonzero(sym == SYM_SET)
+        if len(sets) > 0:
+            sg1, sg2, sa, sb = G1[sets], G2[sets], A[sets], B[sets]
+            level = sg1 == sg2
+            S1[sets] += (sg1 > sg2) | (level & (sa > sb))
+            S2[sets] += (sg1 < sg2) | (level & (sa < sb))
+            extra_swap = level & ((sa + sb) % 4 >= 2)
+            SRV[sets] = np.where(extra_swap, SRV[sets], 3 - SRV[sets])
+            G1[sets], G2[sets], A[sets], B[sets] = 0, 0, 0, 0
+
+        slot[:m] += point
+        idx = lane_base[:m] + slot[:m]
+        out_set1[idx], out_set2[idx] = S1, S2
+        out_game1[idx], out_game2[idx] = G1, G2
+        out_score1[idx], out_score2[idx] = A, B
+        out_server[idx] = SRV
+        out_result[idx] = stream[lane_start[:m] + k]
+
+    keep = np.ones(total, dtype=bool)
+    keep[base + slots - 1] = False
+
+    return {'Match': np.repeat(np.arange(n), slots)[keep],
+            'p1Set': out_set1[keep], 'p2Set': out_set2[keep],
+            'p1Game': out_game1[keep], 'p2Game': out_game2[keep],
+            'p1Score': out_score1[keep], 'p2Score': out_score2[keep],
+            'Server': out_server[keep], 'Result': out_result[keep]}
+
+
+#--------------------------------------------------------------------------------------------
+# Decides which matches are eligible given their format codes and the best-of-3 / best-of-5
+# flags. Tournaments whose matches can be either length are only kept when both are asked for.
+#--------------------------------------------------------------------------------------------
+
+def eligible_matches(formats, three_set=True, five_set=False):
+    formats = np.asarray(formats, dtype=np.int64)
+    eligible = np.ones(len(formats), dtype=bool)
+    if three_set == True and five_set == False:
+        eligible = (format_best_of[formats] == 3) & format_fixed_length[formats]
+    if three_set == False and five_set == True:
+        eligible = (format_best_of[formats] == 5) & format_fixed_length[formats]
+    return eligible
+
+
+#--------------------------------------------------------------------------------------------
+# Combines the engine's column arrays with the match-level information of the raw data into
+# the point data frame that the rest of the project uses.
+#--------------------------------------------------------------------------------------------
+
+def point_frame(raw_data, columns):
+    match = columns['Match']
+    years = np.array([x.split(' ')[-1] for x in raw_data['date'].values], dtype=object)
+    point_data = pd.DataFrame({
+        'Player 1': raw_data['server1'].values[match],
+        'Player 2': raw_data['server2'].values[match],
+        'Winner': raw_data['winner'].values[match],
+        'p1Set': columns['p1Set'], 'p2Set': columns['p2Set'],
+        'p1Game': columns['p1Game'], 'p2Game': columns['p2Game'],
+        'p1Score': columns['p1Score'], 'p2Score': columns['p2Score'],
+        'Server': columns['Server'],
+        'Points': [pts] * len(match),
+        'Result': result_chars[columns['Result']],
+        'Score': raw_data['score'].values[match],
+        'Year': years[match],
+        'Tourney': raw_data['tny_name'].values[match],
+        'MatchNum': raw_data.index.values[match]})
+    return point_data[['Player 1', 'Player 2', 'Winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game',
+                       'p1Score', 'p2Score', 'Server','Points','Result','Score',
+                       'Year','Tourney','MatchNum']]
+
+
+#--------------------------------------------------------------------------------------------
+# Score pairs that can be seen in a regular game. Any other pair of point scores is a
+# tiebreak score.
+#--------------------------------------------------------------------------------------------
+
+regular_pairs = np.zeros((max(pts) + 1, max(pts) + 1), dtype=bool)
+for p1 in pts[:-1]:
+    for p2 in pts[:-1]:
+        regular_pairs[p1, p2] = True
+regular_pairs[45, 40], regular_pairs[40, 45] = True, True
+
+
+#--------------------------------------------------------------------------------------------
+# Validates the engine output of every match as it is parsed. While Jeff Sackmann's data is
+# robust, there are still a few matches where the point-by-point data does not lead to a
+# sensible score. A match is flagged if it has any of the following states:
+# (1) A tiebreak score when the game score is not 6-6 (or outside a match tiebreak)
+# (2) A game score that should have already ended the set (e.g. 6-4, 7-5 or 8-4). 7-6, 8-7
+#     etc. are allowed in a final set that is played without a tiebreak, and no games at all
+#     can be won in a final set that is a match tiebreak.
+# (3) A player leading by more sets than the format allows (e.g. 2 sets in a best-of-3 match)
+# (4) An advantage score in a match played with no-ad scoring
+# (5) A tiebreak score that should have already ended the tiebreak (e.g. 7-5, or 10-8 in a
+#     match tiebreak), which is common in the lower-level files where points are missing or
+#     doubled
+#
+# Returns the reasons each match was flagged ('' if the match is valid).
+#--------------------------------------------------------------------------------------------
+
+def validate_matches(columns, n, formats):
+    match = columns['Match']
+    formats = np.asarray(formats, dtype=np.int64)[match]
+    best_of, final_rule = format_best_of[formats], format_final_set[formats]
+    a, b = columns['p1Score'], columns['p2Score']
+    g1, g2 = columns['p1Game'], columns['p2Game']
+    s1, s2 = columns['p1Set'], columns['p2Set']
+
+    in_range = (a <= max(pts)) & (b <= max(pts))
+    regular = in_range & regular_pairs[np.minimum(a, max(pts)), np.minimum(b, max(pts))]
+    final_set = (s1 == best_of // 2) & (s2 == best_of // 2)
+    advantage_set = (final_rule == FINAL_ADVANTAGE) & final_set
+    match_tiebreak = (final_rule == FINAL_MATCH_TIEBREAK) & final_set
+    hi, lo = np.maximum(g1, g2), np.minimum(g1, g2)
+    tiebreak = ((g1 == 6) & (g2 == 6) & ~advantage_set) | match_tiebreak
+    tiebreak_end = np.where(match_tiebreak, 10, 7)
+
+    checks = [(~regular & ~match_tiebreak & ((g1 != 6) | (g2 != 6)), 'Tiebreak score outside 6-6'),
+              (((hi >= 6) & (hi - lo >= 2)) | (~advantage_set & (hi >= 7)) | (match_tiebreak & (hi > 0)),
+               'Impossible game score'),
+              (np.maximum(s1, s2) > best_of // 2, 'Impossible set score'),
+              (format_no_ad[formats] & regular & ((a == 45) | (b == 45)), 'Advantage score in no-ad game'),
+              (tiebreak & (np.maximum(a, b) >= tiebreak_end) & (np.abs(a - b) >= 2), 'Impossible tiebreak score')]
+
+    reasons = np.array([''] * n, dtype=object)
+    for flagged, reason in checks:
+        bad = np.unique(match[flagged])
+        reasons[bad] = [x + '; ' + reason if x != '' else reason for x in reasons[bad]]
+    return reasons
+
+
+#--------------------------------------------------------------------------------------------
+# Parses one chunk of matches. This is the unit of work for the process pool, so it only
+# takes and returns NumPy arrays: the pbp strings and format codes of the chunk go in, and the
+# engine's column arrays and the validation reasons come out.
+#--------------------------------------------------------------------------------------------
+
+def parse_chunk(task):
+    pbp_strings, formats = task
+    columns = score_transition_engine(pbp_strings, formats)
+    reasons = validate_matches(columns, len(pbp_strings), formats)
+    return columns, reasons
+
+
+#--------------------------------------------------------------------------------------------
+# Runs the tasks in order, either serially or on a pool of worker processes. Results always
+# come back in the order of the tasks, so the output does not depend on the worker count.
+# iter_tasks yields the results one at a time and only keeps one round of tasks (one per
+# worker) in flight, so tasks can be generated lazily and results are not piled up.
+#--------------------------------------------------------------------------------------------
+
+def run_tasks(function, tasks, workers=1):
+    return list(iter_tasks(function, tasks, workers))
+
+
+def iter_tasks(function, tasks, workers=1):
+    if workers <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) == workers:
+                for result in pool.map(function, batch, chunksize=1):
+                    yield result
+                batch = []
+        for result in pool.map(function, batch, chunksize=1):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+#--------------------------------------------------------------------------------------------
+# Cuts the eligible matches of one raw data set into chunks of chunk_size matches. The format
+# of every match is resolved here, once. Returns the eligible raw data and a list of
+# (start, task) pairs for parse_chunk.
+#--------------------------------------------------------------------------------------------
+
+def source_tasks(raw_data, three_set=True, five_set=False, chunk_size=5000, format_names=None):
+    formats = resolve_formats(raw_data['tny_name'].values, format_names)
+    eligible = eligible_matches(formats, three_set, five_set)
+    raw_data, formats = raw_data[eligible], formats[eligible]
+    pbp_strings = raw_data['pbp'].values
+    tasks = [(start, (pbp_strings[start:start + chunk_size], formats[start:start + chunk_size]))
+             for start in range(0, max(len(raw_data), 1), chunk_size)]
+    return raw_data, tasks
+
+
+#--------------------------------------------------------------------------------------------
+# Streams the point data of a list of (source name, raw data) pairs, one chunk of matches at
+# a time. Yields (source, point_data, rejected) for every chunk, in the order of the sources
+# and matches (the source name is only passed through). The index of the point data runs on
+# across the chunks of a source, so the chunks put together give the same frame as parsing
+# the whole source at once.
+#--------------------------------------------------------------------------------------------
+
+def iter_point_frames(sources, three_set=True, five_set=False, drop_invalid=True,
+                      workers=1, chunk_size=5000, format_names=None):
+    chunks = [(source,) + source_tasks(raw_data, three_set, five_set, chunk_size, format_names)
+              for source, raw_data in sources]
+    tasks = (task for source, raw_data, source_tasks_ in chunks for start, task in source_tasks_)
+    results = iter_tasks(parse_chunk, tasks, workers)
+
+    for source, raw_data, source_tasks_ in chunks:
+        offset = 0
+        for start, task in source_tasks_:
+            columns, reasons = next(results)
+            point_data, rejected = collect_results(raw_data.iloc[start:start + chunk_size], columns,
+                                                   reasons, drop_invalid)
+            point_data.index = np.arange(offset, offset + len(point_data))
+            offset = offset + len(point_data)
+            yield source, point_data, rejected
+
+
+#--------------------------------------------------------------------------------------------
+# Splits every eligible match of a list of (source name, raw data) pairs into its point
+# components using the engine, and validates the result in the same pass. Each source is
+# cut into chunks of chunk_size matches, and all chunks of all sources are parsed on a pool
+# of workers. The chunks are then put back together per source in their original order.
+#
+# Returns a list with the point data and a manifest of the flagged matches (with reasons)
+# for each source. If drop_invalid is set, the flagged matches are removed from the point
+# data. The MatchNum of every point is the index of its match in the raw data.
+#--------------------------------------------------------------------------------------------
+
+def parse_sources(sources, three_set=True, five_set=False, drop_invalid=True,
+                  workers=1, chunk_size=5000, format_names=None):
+    parsed = [([], []) for x in sources]
+    numbered = [(i, raw_data) for i, (source, raw_data) in enumerate(sources)]
+    for i, point_data, rejected in iter_point_frames(numbered, three_set, five_set, drop_invalid,
+                                                     workers, chunk_size, format_names):
+        parsed[i][0].append(point_data)
+        parsed[i][1].append(rejected)
+    return [(pd.concat(parsed[i][0], axis=0), pd.concat(parsed[i][1], axis=0, ignore_index=True))
+            for i in range(len(sources))]
+
+
+#--------------------------------------------------------------------------------------------
+# Turns the engine output and validation reasons of one source into the point data and the
+# manifest of flagged matches.
+#--------------------------------------------------------------------------------------------
+
+def collect_results(raw_data, columns, reasons, drop_invalid=True):
+    invalid = np.flatnonzero(reasons != '')
+    rejected = pd.DataFrame({'MatchNum': raw_data.index.values[invalid],
+                             'Tourney': raw_data['tny_name'].values[invalid],
+                             'Date': raw_data['date'].values[invalid],
+                             'Player 1': raw_data['server1'].values[invalid],
+                             'Player 2': raw_data['server2'].values[invalid],
+                             'Reason': reasons[invalid]},
+                            columns=['MatchNum', 'Tourney', 'Date', 'Player 1', 'Player 2', 'Reason'])
+
+    if drop_invalid:
+        keep = reasons[columns['Match']] == ''
+        columns = dict((k, v[keep]) for k, v in columns.items())
+    return point_frame(raw_data, columns), rejected
+
+
+#--------------------------------------------------------------------------------------------
+# Splits every eligible match of a single raw data set into its point components. Returns
+# the point data and the manifest of flagged matches.
+#--------------------------------------------------------------------------------------------
+
+def parse_matches(raw_data, three_set=True, five_set=False, drop_invalid=True):
+    return parse_sources([('', raw_data)], three_set=three_set, five_set=five_set,
+                         drop_invalid=drop_invalid)[0]
+
+
+#--------------------------------------------------------------------------------------------
+# Compact record of a single point, as yielded by iter_points. The match fields (players,
+# score, tourney) are shared with the raw data rather than copied for every point.
+#--------------------------------------------------------------------------------------------
+
+Point = namedtuple('Point', ['player1', 'player2', 'winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game',
+                             'p1Score', 'p2Score', 'server', 'result', 'score', 'year', 'tourney',
+                             'match_num'])
+
+point_fields = ['Player 1', 'Player 2', 'Winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game',
+                'p1Score', 'p2Score', 'Server', 'Result', 'Score', 'Year', 'Tourney', 'MatchNum']
+
+#--------------------------------------------------------------------------------------------
+# Yields the points of every eligible match of the raw data one at a time, as Point records.
+# Only one chunk of matches is parsed at a time.
+#--------------------------------------------------------------------------------------------
+
+def iter_points(raw_data, three_set=True, five_set=False, drop_invalid=True, chunk_size=5000):
+    for source, point_data, rejected in iter_point_frames([('', raw_data)], three_set, five_set,
+                                                          drop_invalid, chunk_size=chunk_size):
+        columns = [point_data[x].tolist() for x in point_fields]
+        for i in range(len(point_data)):
+            yield Point(*[x[i] for x in columns])
+
+#--------------------------------------------------------------------------------------------
+# Regroups a stream of point data frames into frames of exactly batch_size points (except for
+# the last one), so whatever consumes them works on a fixed amount of memory.
+#--------------------------------------------------------------------------------------------
+
+def fixed_batches(frames, batch_size=500000):
+    pending, count = [], 0
+    for frame in frames:
+        pending.append(frame)
+        count = count + len(frame)
+        if count >= batch_size:
+            data = pd.concat(pending, axis=0)
+            full = count - count % batch_size
+            for start in range(0, full, batch_size):
+                yield data.iloc[start:start + batch_size].copy()
+            pending, count = [data.iloc[full:]], count - full
+    if count > 0:
+        yield pd.concat(pending, axis=0)
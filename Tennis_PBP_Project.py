@@ -7,113 +7,46 @@
 
 # Import Packages
 
-import numpy as np
 import pandas as pd
+import multiprocessing
+import hashlib
+import os
+from Tennis_PBP_Engine import parse_matches, iter_point_frames, fixed_batches, resolve_formats, \
+                              match_tiebreak_points, FINAL_ADVANTAGE, FINAL_MATCH_TIEBREAK
+from Tennis_Point_Store import open_point_sink, append_point_batch, close_point_sink, \
+                               update_point_store, point_store_path
+from Tennis_Score_States import score_states, state_counts, win_pct_data
 
 #--------------------------------------------------------------------------------------------
-# These dictionaries and functions help map game states to easily comprehensible game
-# situations (in both regular game and tiebreak scenarios)
+# Catalog of the point-by-point files. Jeff Sackmann's files are named
+# pbp_matches_<tour>_<draw>_<era>.csv, with tours atp, ch (Challenger), wta, itf and fu
+# (Futures), draws main and qual (qualifying), and eras current and archive. pbp_tours and
+# pbp_draws select the files that are parsed into the point store; adding or removing one
+# and running main() again only parses or retracts the matches of those files.
 #--------------------------------------------------------------------------------------------
 
-all_game_states = {
-    (0,0,1): 'Start of Game',
-    (0,0,2): 'Start of Game',
-    (15,0,1): 'Server 15-0',
-    (0,15,2): 'Server 15-0',
-    (0,15,1): 'Server 0-15',
-    (15,0,2): 'Server 0-15',
-    (15,15,1): 'Server 15-15',
-    (15,15,2): 'Server 15-15',
-    (30,0,1): 'Server 30-0',
-    (0,30,2): 'Server 30-0',
-    (0,30,1): 'Server 0-30',
-    (30,0,2): 'Server 0-30',
-    (30,15,1): 'Server 30-15',
-    (15,30,2): 'Server 30-15',
-    (15,30,1): 'Server 15-30',
-    (30,15,2): 'Server 15-30',
-    (30,30,1): 'Server 30-30',
-    (30,30,2): 'Server 30-30',
-    (40,0,1): 'Server 40-0',
-    (0,40,2): 'Server 40-0',
-    (40,15,1): 'Server 40-15',
-    (15,40,2): 'Server 40-15',
-    (40,30,1): 'Server 40-30',
-    (30,40,2): 'Server 40-30',
-    (0,40,1): 'Server 0-40',
-    (40,0,2): 'Server 0-40',
-    (15,40,1): 'Server 15-40',
-    (40,15,2): 'Server 15-40',
-    (30,40,1): 'Server 30-40',
-    (40,30,2): 'Server 30-40',
-    (40,40,1): 'Server 40-40',
-    (40,40,2): 'Server 40-40',
-    (45,40,1): 'Server AD-40',
-    (40,45,2): 'Server AD-40',
-    (40,45,1): 'Server 40-AD',
-    (45,40,2): 'Server 40-AD'
-}
-
-
-def tiebreak_state(state):
-    p1,p2,server = state
-    if p1 >= 6 and p2 >=6:
-        if p1 > p2 and server == 1:
-            return 'Server 7-6'
-        elif p1 > p2 and server == 2:
-            return 'Server 6-7'
-        elif p1 < p2 and server == 1:
-            return 'Server 6-7'
-        elif p1 < p2 and server == 2:
-            return 'Server 7-6'
-        else:
-            return 'Server 6-6'
-    elif server == 1:
-        return 'Server ' + str(p1)+'-'+str(p2)
-    elif server == 2:
-        return 'Server ' + str(p2)+'-'+str(p1)
-    
-
-coordinate_states = {
-    'Start of Game': (0,0),
-    'Server 15-0': (1,1),
-    'Server 0-15': (1,-1),
-    'Server 15-15': (2,0),
-    'Server 30-0': (2,2),
-    'Server 0-30': (2,-2),
-    'Server 30-15': (3,1),
-    'Server 15-30': (3,-1),
-    'Server 30-30': (4,0),
-    'Server 40-0': (3,3),
-    'Server 40-15': (4,2),
-    'Server 40-30': (5,1),
-    'Server 0-40': (3,-3),
-    'Server 15-40': (4,-2),
-    'Server 30-40': (5,-1),
-    'Server 40-40': (6,0),
-    'Server AD-40': (7,1),
-    'Server 40-AD': (7,-1)
-}
-
-def tiebreak_coordinates(game_state):
-    if game_state not in coordinate_states.keys():
-        print game_state#[7:]
-        g1, g2 = game_state[7:].split('-')
-        #print g1, g2
-        return (int(g1)+int(g2), int(g1)-int(g2))
-    else:
-        return coordinate_states[game_state]
+pbp_path = 'tennis_pointbypoint-master/'
+pbp_tours = ['atp', 'ch']
+pbp_draws = ['main']
+pbp_eras = ['current', 'archive']
+pbp_columns = ['date', 'tny_name', 'tour', 'draw', 'server1', 'server2', 'winner', 'pbp', 'score', 'adf_flag']
 
+match_manifest_path = os.path.join(point_store_path, 'Match Manifest.csv')
+source_manifest_path = os.path.join(point_store_path, 'Source Manifest.csv')
+state_counts_path = os.path.join(point_store_path, 'State Counts.csv')
+rejected_matches_path = os.path.join(point_store_path, 'Rejected Matches.csv')
 
 #--------------------------------------------------------------------------------------------
 # This function adds a new row to the point by point dataset. It does certain edits to
 # the raw data to ensure consistency, (e.g. converting game points to changing the game
 # score, set score, serve/return situations etc). It also uses specific rules on the ATP
 # World Tour to make necessary adjustments (e.g. Grand Slams are best-of-5 matches, and 
-# fifth set tiebreakers only apply to the US Open.)
+# fifth set tiebreakers only apply to the US Open.) The rules come from the match's entry in
+# the format registry (match_formats in Tennis_PBP_Engine), which is looked up once per match.
 #--------------------------------------------------------------------------------------------
 
-def getNewRow(player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p2score, server, pts, char, tourney):
+def getNewRow(player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p2score, server, pts, char, match_format):
+    final_set = p1set == match_format.best_of // 2 and p2set == match_format.best_of // 2
     flag = 0
     if char == '/':
         if server == 1:
@@ -163,14 +96,8 @@ def getNewRow(player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p
         elif server == 2:
             server = 1  
         flag = 1
-    elif p1game == 6 and p2game == 6 and ((tourney not in ["Men'sAustralianOpen","Men'sAustralianOpen.",
-                                                           'MensAustralianOpen', 'MensAustralianOpen.html',
-                                                           "Men'sFrenchOpen", "Men'sFrenchOpen.",'MensFrenchOpen',
-                                                           'MensFrenchOpen.html', "Gentlemen'sWimbledonSingles",
-                                                           "Gentlemen'sWimbledonSingles.","Gentlemen'sWimbledonSingles.html",
-                                                           #"Men'sUSOpen", "Men'sUSOpen.","Men'sUSOpen.html",
-                                                           'DavisCup','DavisCup-Live', 'DavisCup.html', 'DavisCupLive']) \
-     or p1set != 2 or p2set != 2):
+    elif (p1game == 6 and p2game == 6 and (match_format.final_set != FINAL_ADVANTAGE or not final_set)) \
+     or (match_format.final_set == FINAL_MATCH_TIEBREAK and final_set):
         if server == 1:
             if char in ['S','A']:
                 p1score = p1score + 1
@@ -209,286 +136,271 @@ def getNewRow(player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p
 
 #--------------------------------------------------------------------------------------------
 # This function extracts the necessary information from each row of the raw_data (which
-# represents a tennis match) and calls the function above, to split a match into its point
-# components. This can be adjusted to include best-of-3 or best-of-5 matches.
+# represents a tennis match) and splits a match into its point components. This can be
+# adjusted to include best-of-3 or best-of-5 matches. The splitting is done by the table-
+# driven engine in Tennis_PBP_Engine, which gives the same rows as calling getNewRow above
+# on every character of the pbp string.
 #--------------------------------------------------------------------------------------------
 
 def tourDataSet(raw_data, three_set=True, five_set=False):
-    master_data = []
-    for i,row in raw_data.iterrows():
-        five_set_tourneys = ["Men'sAustralianOpen","Men'sAustralianOpen.",'MensAustralianOpen', 'MensAustralianOpen.html',
-                     "Men'sFrenchOpen", "Men'sFrenchOpen.",'MensFrenchOpen', 'MensFrenchOpen.html',
-                     "Gentlemen'sWimbledonSingles", "Gentlemen'sWimbledonSingles.","Gentlemen'sWimbledonSingles.html",
-                     "Men'sUSOpen", "Men'sUSOpen.","Men'sUSOpen.html"]
-        only_both = ['DavisCup','DavisCup-Live', 'DavisCup.html', 'DavisCupLive',
-                     "Men'sAustralianOpenWildcardPlayoff"]
-        
-        pts = [0,15,30,40,45]
-        player1 = row['server1']
-        player2 = row['server2']
-        winner = row['winner']
-        score = row['score']
-        year = row['date'].split(' ')[-1]
-        tourney = row['tny_name']
-        server = 1
-        p1set,p2set,p1game,p2game,p1score,p2score = 0,0,0,0,0,0
-        
-        eligible = True
-        if three_set == True and five_set == False:
-            if tourney in five_set_tourneys or tourney in only_both:
-                eligible = False
-        if three_set == False and five_set == True:
-            if tourney not in five_set_tourneys or tourney in only_both:
-                eligible = False
-        
-        if eligible:
-            master_data.append([player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p2score,
-                            server, pts, '', score, year, tourney, i])
-            for char in row['pbp']:
-                newrow = getNewRow(player1, player2, winner, p1set, p2set, 
-                                   p1game, p2game, p1score, p2score, server, pts, char, tourney)
-                flag = newrow[-1]
-                if flag == 0:
-                    master_data.append(newrow[:-1] + [score, year, tourney, i])
-                elif flag == 1:
-                    master_data[-1] = newrow[:-1] + [score, year, tourney, i]
-                player1, player2, winner, p1set, p2set, p1game, p2game, p1score, p2score, server, pts, char = newrow[:-1]
-            master_data.pop()
-        
-    return pd.DataFrame(master_data,columns=['Player 1', 'Player 2', 'Winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game', 
-                                             'p1Score', 'p2Score', 'Server','Points','Result','Score',
-                                             'Year','Tourney','MatchNum'])    
+    point_data, rejected = parse_matches(raw_data, three_set=three_set, five_set=five_set,
+                                         drop_invalid=False)
+    return point_data
 
 
 #--------------------------------------------------------------------------------------------
-# Step 1: This function extracts initial data from the CSV files compiled by Jeff Sackmann
+# Step 1: This function extracts initial data from the CSV files compiled by Jeff Sackmann.
+# While Jeff Sackmann's data is robust, there are still a few matches where the point-by-point
+# data does not lead to sensible scores. These are flagged and removed as each file is parsed
+# (see validate_matches in Tennis_PBP_Engine), and returned as a manifest with the reasons.
+# The files are split into chunks of matches that are parsed on a pool of worker processes.
+# Every point is tagged with its file ('Source'), its tour (e.g. 'wta') and its tour level
+# (tour and draw, e.g. 'atp_main'), so that the results can be split by tour or pooled. A
+# list of (source, raw_data) pairs can be passed in to parse only part of the files.
+#
+# iter_point_data streams the same point data one chunk of matches at a time, and adds the
+# flagged matches of every chunk to the rejected list that is passed in.
 #--------------------------------------------------------------------------------------------
 
-def compile_initial_point_data(challenger_15_idx, challenger_archive_idx):
-    pbp_2015 = pd.read_csv('tennis_pointbypoint-master/pbp_matches_atp_main_current.csv')
-    pbp_archive = pd.read_csv('tennis_pointbypoint-master/pbp_matches_atp_main_archive.csv')
-    pbp_2015_q = pd.read_csv('tennis_pointbypoint-master/pbp_matches_atp_qual_current.csv')
-    pbp_archive_q = pd.read_csv('tennis_pointbypoint-master/pbp_matches_atp_qual_archive.csv')
-    pbp_2015_ch = pd.read_csv('tennis_pointbypoint-master/pbp_matches_ch_main_current.csv')
-    pbp_archive_ch = pd.read_csv('tennis_pointbypoint-master/pbp_matches_ch_main_archive.csv')
-    pbp_2015_q_ch = pd.read_csv('tennis_pointbypoint-master/pbp_matches_ch_qual_current.csv')
-    pbp_archive_q_ch = pd.read_csv('tennis_pointbypoint-master/pbp_matches_ch_qual_archive.csv')
+def pbp_catalog(tours=None, draws=None):
+    tours = pbp_tours if tours is None else tours
+    draws = pbp_draws if draws is None else draws
+    sources = ['pbp_matches_' + '_'.join([tour, draw, era])
+               for tour in tours for draw in draws for era in pbp_eras]
+    return [x for x in sources if os.path.exists(pbp_path + x + '.csv')]
+
+
+def source_tour(source):
+    return source.split('_')[2]
+
 
+def source_level(source):
+    return '_'.join(source.split('_')[2:4])
 
-    data_15 = tourDataSet(pbp_2015)
-    data_archive = tourDataSet(pbp_archive.loc[[x not in [2165,2381,2543] 
-                                                for x in pbp_archive.index.values]],three_set=True,five_set=False)
 
-    data_15_ch = tourDataSet(pbp_2015_ch[[x not in challenger_15_idx for x in pbp_2015_ch.index.values]])
-    data_archive_ch = tourDataSet(pbp_archive_ch[[x not in challenger_archive_idx for x in pbp_archive_ch.index.values]])
+def read_pbp_sources(catalog=None):
+    catalog = pbp_catalog() if catalog is None else catalog
+    return [(source, pd.read_csv(pbp_path + source + '.csv')) for source in catalog]
 
-    all_point_data = pd.concat([data_15,data_archive, data_15_ch,data_archive_ch],axis=0)
+
+def iter_point_data(sources, rejected, workers=1, chunk_size=5000):
+    for source, point_data, chunk_rejected in iter_point_frames(sources, three_set=True, five_set=False,
+                                                                workers=workers, chunk_size=chunk_size):
+        point_data['Level'] = source_level(source)
+        point_data['Tour'] = source_tour(source)
+        point_data['Source'] = source
+        chunk_rejected.insert(0, 'Source', source)
+        rejected.append(chunk_rejected)
+        yield point_data
+
+
+def compile_initial_point_data(workers=1, chunk_size=5000, sources=None):
+    if sources is None:
+        sources = read_pbp_sources()
+    rejected = []
+    all_point_data = pd.concat(list(iter_point_data(sources, rejected, workers, chunk_size)), axis=0)
+    rejected_matches = pd.concat(rejected, axis=0, ignore_index=True)
     
-    return all_point_data
+    return all_point_data, rejected_matches
+
+#--------------------------------------------------------------------------------------------
+# The match manifest holds a content hash of every raw match (row of a pbp file), with its
+# source and row number (MatchNum). Comparing it with the manifest of the last build tells
+# which matches were added, changed or deleted in a new pull of the files. Matches are paired
+# on their content, so a match that only moved to another row (e.g. because an earlier row
+# was deleted) is renumbered instead of parsed again.
+#
+# The source manifest keeps the size and modification time of every file. A file whose
+# fingerprint has not changed since the last build is not read at all: its part of the match
+# manifest is carried over, so each file is cached on its own.
+#--------------------------------------------------------------------------------------------
+
+def content_hash(values):
+    text = '\x1f'.join([str(x) for x in values])
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+
+def match_manifest(sources):
+    manifest = [pd.DataFrame({'Source': source,
+                              'MatchNum': raw_data.index.values,
+                              'Hash': [content_hash(x) for x in raw_data.values]},
+                             columns=['Source', 'MatchNum', 'Hash'])
+                for source, raw_data in sources]
+    return pd.concat(manifest, axis=0, ignore_index=True)
+
+
+def source_fingerprints(catalog):
+    stats = [os.stat(pbp_path + source + '.csv') for source in catalog]
+    return pd.DataFrame({'Source': catalog,
+                         'Size': [x.st_size for x in stats],
+                         'Modified': [int(x.st_mtime) for x in stats]},
+                        columns=['Source', 'Size', 'Modified'])
+
 
+def unchanged_sources(old_fingerprints, new_fingerprints):
+    merged = pd.merge(new_fingerprints, old_fingerprints, on=['Source', 'Size', 'Modified'])
+    return list(merged['Source'])
+
+
+def changed_matches(old_manifest, new_manifest):
+    old_manifest = old_manifest.assign(Copy=old_manifest.groupby(['Source', 'Hash']).cumcount())
+    new_manifest = new_manifest.assign(Copy=new_manifest.groupby(['Source', 'Hash']).cumcount())
+    merged = pd.merge(new_manifest, old_manifest, on=['Source', 'Hash', 'Copy'], how='outer',
+                      suffixes=('', ' Old'))
+
+    retracted = merged[merged['MatchNum'].isnull()]
+    added = merged[merged['MatchNum Old'].isnull()]
+    moved = merged[merged['MatchNum'].notnull() & merged['MatchNum Old'].notnull() &
+                   (merged['MatchNum'] != merged['MatchNum Old'])]
+    return list(zip(retracted['Source'], retracted['MatchNum Old'].astype(int))), \
+           list(zip(added['Source'], added['MatchNum'].astype(int))), \
+           list(zip(moved['Source'], moved['MatchNum Old'].astype(int), moved['MatchNum'].astype(int)))
 
 #--------------------------------------------------------------------------------------------
 # Step 2: This function adds additional columns to point data dataset for ease of analysis
-# and interpretation
+# and interpretation. The game situation of every point is coded as a single integer 'State'
+# (set score, game score and point score from the server's view, see Tennis_Score_States;
+# points of a match tiebreak are coded in the tiebreak point scores by the match format),
+# and 'Game State Code' codes the regular game state. The labels are derived from these
+# codes when the results are written out.
 #--------------------------------------------------------------------------------------------
 
 def add_columns_to_point_data(all_point_data):
-    states = [(x,y,z) for x,y,z in zip(all_point_data['p1Score'],all_point_data['p2Score'],all_point_data['Server'])]
-    all_point_data['Game State'] = [all_game_states[x] if x in all_game_states.keys() else 'Tiebreak' for x in states]
-    all_point_data['Server Winner'] = [x == y for x,y in zip(all_point_data['Winner'],all_point_data['Server'])]
-    all_point_data['Game Score Server View'] = [str(x)+'-'+str(y) if z == 1 else str(y)+'-'+str(x)
-                                               for x,y,z in zip(all_point_data['p1Game'],all_point_data['p2Game'], 
-                                                                all_point_data['Server'])]
-    all_point_data['Set Score Server View'] = [str(x)+'-'+str(y) if z == 1 else str(y)+'-'+str(x)
-                                               for x,y,z in zip(all_point_data['p1Set'],all_point_data['p2Set'], 
-                                                                all_point_data['Server'])]
-
-    all_point_data['Game State New'] = [tiebreak_state(x) if y == '6-6' else z 
-                                        for x,y,z in zip(states,all_point_data['Game Score Server View'],
-                                                         all_point_data['Game State'])]
+    all_point_data['Server Winner'] = all_point_data['Winner'].values == all_point_data['Server'].values
+    match_tiebreak = match_tiebreak_points(resolve_formats(all_point_data['Tourney'].values),
+                                           all_point_data['p1Set'].values, all_point_data['p2Set'].values)
+    all_point_data['State'], all_point_data['Game State Code'] = \
+        score_states(all_point_data['p1Set'].values, all_point_data['p2Set'].values,
+                     all_point_data['p1Game'].values, all_point_data['p2Game'].values,
+                     all_point_data['p1Score'].values, all_point_data['p2Score'].values,
+                     all_point_data['Server'].values, match_tiebreak)
     return all_point_data
 
 #--------------------------------------------------------------------------------------------
-# Step 2.5: This function identifies bad scorelines and removes it from our analysis. While
-# Jeff Sackmann's data is robust, there are still a few situations where the point-by-point
-# data does not lead to a sensible scores and has to be removed.
+# Step 3: The instances and server wins of every game situation (see state_counts in
+# Tennis_Score_States) are kept with the point store, so that a refresh only adds the counts
+# of new matches and subtracts those of retracted ones. summarize_results turns the counts
+# into the match win % from all game situations.
 #--------------------------------------------------------------------------------------------
 
-def identify_bad_states(all_point_data):
-    bad_states = all_point_data[((all_point_data['Game State'] == 'Tiebreak') & 
-                                (all_point_data['Game Score Server View'] != '6-6')) |
-                                ([x in ['4-6', '0-6', '6-4', '4-7', '8-4', '4-8','7-6', '6-3',
-                                        '7-4', '5-7', '7-5', '6-7', '2-6', '1-6'] 
-                                  for x in all_point_data['Game Score Server View']]) |
-                                ([x in ['2-0','0-2'] for x in all_point_data['Set Score Server View']])]
-    challenger_tour_15_idx = []
-    challenger_tour_15_q_idx = []
-    challenger_tour_archive_idx = []
-    challenger_tour_archive_q_idx = []
-
-    for i,row in bad_states.iterrows():
-        #print 'Challenger' in row['Year']
-        if 'Challenger' in row['Tourney'] and 'Qualifying' not in row['Tourney'] and '15' in row['Year']:
-            challenger_tour_15_idx.append(row['MatchNum'])
-        elif 'Challenger' in row['Tourney'] and 'Qualifying' not in row['Tourney'] and '15' not in row['Year']:
-            challenger_tour_archive_idx.append(row['MatchNum'])
-
-    challenger_15_idx = np.unique(challenger_tour_15_idx)
-    challenger_archive_idx = np.unique(challenger_tour_archive_idx)
-    
-    return challenger_15_idx, challenger_archive_idx
-
-
-#--------------------------------------------------------------------------------------------
-# Step 3: This function summarizes the point data dataset, to get the match win % from
-# all game situations.
-#--------------------------------------------------------------------------------------------
+def update_state_counts(counts, new_points, removed_points):
+    counts = counts.add(state_counts(new_points), fill_value=0)
+    counts = counts.sub(state_counts(removed_points), fill_value=0)
+    counts = counts[counts['Instances'] > 0].astype(int)
+    return counts.sort_index()
 
-def summarize_results(all_point_data):
-
-    score_state_all = pd.DataFrame(all_point_data.groupby(['Set Score Server View','Game Score Server View', 
-                                         'Game State New']).count()['Player 1'])
-    score_state_sum = pd.DataFrame(all_point_data.groupby(['Set Score Server View','Game Score Server View', 
-                                         'Game State New', 'Server Winner']).count()['Player 1'])
-
-    all_results = []
-    for set_score, game_score, game_state in score_state_all.index.values:
-        #print set_score, game_score, game_state
-
-        try:
-            x, y = tiebreak_coordinates(game_state)
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    all_results.append((set_score,game_score,'Serving',game_state[7:]+ ' (R)', 
-                                1.0*float(score_state_sum.loc[(set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(set_score,game_score,game_state)]),
-                                x, y))
-                else:
-                    all_results.append((set_score,game_score,'Serving',game_state[7:]+ ' (S)', 
-                                1.0*float(score_state_sum.loc[(set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(set_score,game_score,game_state)]),
-                                x, y))
-            elif 'Server' in game_state:
-                all_results.append((set_score,game_score,'Serving',game_state[7:], 
-                                1.0*float(score_state_sum.loc[(set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(set_score,game_score,game_state)]),
-                                x, y))
-            else:
-                all_results.append((set_score,game_score,'Serving',game_state, 
-                                1.0*float(score_state_sum.loc[(set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(set_score,game_score,game_state)]),
-                                x, y))
-
-            if 'Start of Game' not in game_state:
-                score1, score2 = game_state[7:].split('-')
-                new_score = score2+'-'+score1   
-            else:
-                new_score = game_state
-
-            if game_score == 'Up 1 from 6-6 5th Set':
-                newgscore = 'Down 1 from 6-6 5th Set'
-            elif game_score == 'Down 1 from 6-6 5th Set':
-                newgscore = 'Up 1 from 6-6 5th Set'
-            elif game_score == 'All Square from 6-6 5th Set':
-                newgscore = game_score
-            else:
-                gscore1, gscore2 = game_score.split('-')
-                newgscore = gscore2+'-'+gscore1
-
-            sscore1, sscore2 = set_score.split('-')
-            newsscore = sscore2+'-'+sscore1
-
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    new_score = new_score + ' (S)'
-                else:
-                    new_score = new_score + ' (R)'
-
-            all_results.append((newsscore,newgscore,'Returning',new_score, 
-                                1.0 - 1.0*float(score_state_sum.loc[(set_score, game_score, game_state, True)])/
-                                float(score_state_all.loc[(set_score,game_score,game_state)]),
-                                int(score_state_all.loc[(set_score,game_score,game_state)]),
-                                x, -1*y))
-        except KeyError:
-            x, y = tiebreak_coordinates(game_state)
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    all_results.append((set_score, game_score, 'Serving',game_state[7:]+ ' (R)', 0.,
-                                int(score_state_all.loc[(set_score,game_score,game_state)]), x, y))
-                else:
-                    all_results.append((set_score, game_score, 'Serving',game_state[7:]+ ' (S)', 0.,
-                                int(score_state_all.loc[(set_score,game_score,game_state)]), x, y))
-            elif 'Server' in game_state:
-                all_results.append((set_score, game_score, 'Serving',game_state[7:], 0.,
-                                int(score_state_all.loc[(set_score,game_score,game_state)]), x, y))
-            else:
-                all_results.append((set_score, game_score, 'Serving',game_state, 0.,
-                                int(score_state_all.loc[(set_score,game_score,game_state)]), x, y))
 
-            #print game_state
-            if 'Start of Game' not in game_state:
-                score1, score2 = game_state[7:].split('-')
-                new_score = score2+'-'+score1   
-            else:
-                new_score = game_state
-
-            if game_score == 'Up 1 from 6-6 5th Set':
-                newgscore = 'Down 1 from 6-6 5th Set'
-            elif game_score == 'Down 1 from 6-6 5th Set':
-                newgscore = 'Up 1 from 6-6 5th Set'
-            elif game_score == 'All Square from 6-6 5th Set':
-                newgscore = game_score
-            else:
-                gscore1, gscore2 = game_score.split('-')
-                newgscore = gscore2+'-'+gscore1
-            sscore1, sscore2 = set_score.split('-')
-            newsscore = sscore2+'-'+sscore1
+def read_state_counts(path=state_counts_path):
+    return pd.read_csv(path, index_col=0)
 
-            if game_score == '6-6':
-                if x % 4 == 1 or x % 4 == 2:
-                    new_score = new_score + ' (S)'
-                else:
-                    new_score = new_score + ' (R)'
 
-            all_results.append((newsscore, newgscore, 'Returning',new_score, 1.,
-                                int(score_state_all.loc[(set_score,game_score,game_state)]), x, -1*y))
+def summarize_results(counts):
+    return win_pct_data(counts)
 
 #--------------------------------------------------------------------------------------------
 # Step 4: This function organizes the grouped results to be exported to a CSV file
 # for further analysis in our predictive model.
 #--------------------------------------------------------------------------------------------
 
-def send_to_csv(all_results):
-    sum_data = pd.DataFrame(all_results,columns=['Set Score','Game Score','Serving at Start of Game?','Point Score','% Win',
-                                                 'Number of Instances','Points Elapsed','Y'])
+def send_to_csv(sum_data):
     sum_data['Stdev'] = [((x*(1-x))/y)**0.5 for x,y in zip(sum_data['% Win'],sum_data['Number of Instances'])]
     sum_data.to_csv('Match_Probs_best5_50_50.csv')
 
+#--------------------------------------------------------------------------------------------
+# Builds the point store from scratch, along with the state counts, the match manifest and
+# the rejected matches. The point data is streamed into the store in batches of batch_size
+# points, so the full point data is never held in memory.
+#--------------------------------------------------------------------------------------------
+
+def build_point_data(workers=1, batch_size=500000):
+    catalog = pbp_catalog()
+    sources = read_pbp_sources(catalog)
+    rejected, counts = [], None
+    sink = open_point_sink()
+    for point_data in fixed_batches(iter_point_data(sources, rejected, workers=workers), batch_size):
+        point_data = add_columns_to_point_data(point_data)
+        if counts is None:
+            counts = state_counts(point_data)
+        else:
+            counts = update_state_counts(counts, point_data, point_data.iloc[:0])
+        append_point_batch(sink, point_data)
+    close_point_sink(sink)
+
+    rejected_matches = pd.concat(rejected, axis=0, ignore_index=True)
+    print(str(len(rejected_matches)) + ' Instances found to have Bad Scores')
+
+    counts.to_csv(state_counts_path)
+    match_manifest(sources).to_csv(match_manifest_path, index=False)
+    source_fingerprints(catalog).to_csv(source_manifest_path, index=False)
+    rejected_matches.to_csv(rejected_matches_path)
+    return counts
+
+#--------------------------------------------------------------------------------------------
+# Refreshes the point store after a new pull of the pbp files, or after a change to the
+# catalog (pbp_tours, pbp_draws). Only the files whose fingerprint changed are read, and only
+# matches that are new or whose content changed are parsed; the points of changed and deleted
+# matches (including every match of a file dropped from the catalog) are retracted from the
+# store, and the state counts are updated by adding and subtracting counts.
+#--------------------------------------------------------------------------------------------
+
+def refresh_point_data(workers=1):
+    catalog = pbp_catalog()
+    old_manifest = pd.read_csv(match_manifest_path)
+    fingerprints = source_fingerprints(catalog)
+    unchanged = unchanged_sources(pd.read_csv(source_manifest_path), fingerprints) \
+                if os.path.exists(source_manifest_path) else []
+    sources = read_pbp_sources([x for x in catalog if x not in unchanged])
+    if len(sources) == 0:
+        # Nothing to parse (or no file left in the catalog), but the (empty) point data still
+        # needs its columns
+        sources = [('pbp_matches_none_none_none', pd.DataFrame(columns=pbp_columns))]
+    new_manifest = pd.concat([old_manifest[old_manifest['Source'].isin(unchanged)],
+                              match_manifest(sources)], axis=0, ignore_index=True)
+    retracted, added, renumbered = changed_matches(old_manifest, new_manifest)
+    print(str(len(added)) + ' Matches to parse, ' + str(len(retracted)) + ' Matches to retract, ' +
+          str(len(renumbered)) + ' Matches renumbered')
+
+    added = pd.DataFrame(added, columns=['Source', 'MatchNum'])
+    changed_sources = [(source, raw_data.loc[added['MatchNum'][added['Source'] == source].values])
+                       for source, raw_data in sources]
+    new_points, new_rejected = compile_initial_point_data(workers=workers, sources=changed_sources)
+    new_points = add_columns_to_point_data(new_points)
+
+    removed_points = update_point_store(new_points, retracted, renumbered)
+    counts = update_state_counts(read_state_counts(), new_points, removed_points)
+
+    rejected_matches = pd.read_csv(rejected_matches_path, index_col=0)
+    retracted_keys = set(retracted)
+    moved_keys = dict(((s, m), n) for s, m, n in renumbered)
+    keys = list(zip(rejected_matches['Source'], rejected_matches['MatchNum']))
+    rejected_matches['MatchNum'] = [moved_keys.get(x, x[1]) for x in keys]
+    rejected_matches = rejected_matches[[x not in retracted_keys for x in keys]]
+    rejected_matches = pd.concat([rejected_matches, new_rejected], axis=0, ignore_index=True)
+    print(str(len(rejected_matches)) + ' Instances found to have Bad Scores')
+
+    counts.to_csv(state_counts_path)
+    new_manifest.to_csv(match_manifest_path, index=False)
+    fingerprints.to_csv(source_manifest_path, index=False)
+    rejected_matches.to_csv(rejected_matches_path)
+    return counts
+
 #--------------------------------------------------------------------------------------------
 # Main Function
 #--------------------------------------------------------------------------------------------
 
 def main():
-    challenger_15_idx, challenger_archive_idx = [], []
-    all_point_data = compile_initial_point_data(challenger_15_idx, challenger_archive_idx)
-    all_point_data = add_columns_to_point_data(all_point_data)
-    
-    # Check for Bad State
-    challenger_15_idx, challenger_archive_idx = identify_bad_states(all_point_data)
-    while len(challenger_15_idx) > 0 or len(challenger_archive_idx) > 0:
-        all_point_data = compile_initial_point_data(challenger_15_idx, challenger_archive_idx)
-        all_point_data = add_columns_to_point_data(all_point_data)
-        challenger_15_idx, challenger_archive_idx = identify_bad_states(all_point_data)
-        print str(len(challenger_15_idx) + len(challenger_archive_idx)) + ' Instances found to have Bad Scores'
+    workers = multiprocessing.cpu_count()
+    if os.path.exists(match_manifest_path):
+        counts = refresh_point_data(workers=workers)
+    else:
+        counts = build_point_data(workers=workers)
     
-    all_results = summarize_results(all_point_data)
+    sum_data = summarize_results(counts)
     
     # Complete Operations
-    send_to_csv(all_results)
-    all_point_data.to_csv('All Point Data.csv')
+    send_to_csv(sum_data)
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Player_Names.py
+#
+# Description: This module resolves the player names found in the point data and on the
+# live scoreboard to the names and Player IDs of the players dataset. Known misspellings
+# are kept in 'Player Aliases.csv' (Alias, Name and optionally Player ID), so a new alias
+# is added by adding a row to that file. Names are resolved once per unique name and the
+# result is broadcast back to every row through the name codes. Names that still do not
+# match a player are looked up in a trigram index of the players dataset, and confident
+# matches are kept in 'Player Name Matches.csv' so that they are only scored once.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+from collections import defaultdict, namedtuple
+import os
+import re
+import unicodedata
+
+alias_path = 'Player Aliases.csv'
+name_match_path = 'Player Name Matches.csv'
+players_path = 'tennis_atp-master/atp_players.csv'
+player_columns = ['Player ID','First','Last','L/R','DOB','Country']
+name_match_columns = ['Name', 'Player ID', 'Matched Name', 'Score']
+
+alias_tables = dict()
+
+# A fuzzy match is accepted if its score is at least accept_score and it beats the next
+# player by at least accept_margin
+accept_score = 0.75
+accept_margin = 0.1
+
+# Trigrams found in more than common_gram player names are only used to score candidates
+common_gram = 1000
+
+#--------------------------------------------------------------------------------------------
+# Read the alias table. Each table is read once and kept for the rest of the session. The
+# result maps an alias to its (Name, Player ID), where the Player ID is None if the alias
+# should be looked up by name in the players dataset.
+#--------------------------------------------------------------------------------------------
+
+def read_aliases(path=alias_path):
+    if path not in alias_tables:
+        table = pd.read_csv(path, dtype={'Alias': str, 'Name': str}, keep_default_na=False)
+        ids = pd.to_numeric(table['Player ID'], errors='coerce')
+        alias_tables[path] = dict((alias, (name, None if np.isnan(pid) else int(pid)))
+                                  for alias, name, pid in zip(table['Alias'], table['Name'], ids))
+    return alias_tables[path]
+
+
+#--------------------------------------------------------------------------------------------
+# Read the players dataset with the name keys used to join it: 'Name' is the full name
+# used in the point data and 'Scoreboard Name' the 'Last F.' form used by the live
+# scoreboard.
+#--------------------------------------------------------------------------------------------
+
+def read_players(path=players_path):
+    players = pd.read_csv(path, header=None)
+    players.columns = player_columns
+    players['Name'] = [str(x) + ' ' + str(y) for x,y in zip(players['First'],players['Last'])]
+    players['Scoreboard Name'] = players['Last'] + np.array([' ' + str(x)[0] + '.' if str(x) != 'nan' else ''
+                                                             for x in players['First']])
+    return players
+
+
+#--------------------------------------------------------------------------------------------
+# Canonical name of a single raw name: the alias table entry if there is one, and otherwise
+# the name with hyphens replaced by spaces
+#--------------------------------------------------------------------------------------------
+
+def canonical_name(name, aliases=None):
+    if aliases is None:
+        aliases = read_aliases()
+    if name in aliases:
+        return aliases[name][0]
+    return name.replace('-',' ')
+
+
+#--------------------------------------------------------------------------------------------
+# Canonical names of a column of raw names. The column is factorized, only the unique names
+# are resolved, and the result is returned as a Categorical over the canonical names.
+# Missing names stay missing.
+#--------------------------------------------------------------------------------------------
+
+def resolve_names(values, aliases=None):
+    if aliases is None:
+        aliases = read_aliases()
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    names, name_codes = np.unique(np.array([canonical_name(x, aliases) for x in uniques], dtype=object),
+                                  return_inverse=True)
+    return pd.Categorical.from_codes(np.append(name_codes, -1)[codes], names)
+
+
+#--------------------------------------------------------------------------------------------
+# Player IDs given in the alias table for a column of raw names, resolved once per unique
+# name. Names without an alias or whose alias has no Player ID get a missing ID, and are
+# left to be joined by their canonical name.
+#--------------------------------------------------------------------------------------------
+
+def alias_player_ids(values, aliases=None):
+    if aliases is None:
+        aliases = read_aliases()
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    unique_ids = [aliases[x][1] if x in aliases and aliases[x][1] is not None else np.nan for x in uniques]
+    return np.array(unique_ids + [np.nan], dtype=float)[codes]
+
+
+#--------------------------------------------------------------------------------------------
+# Map of name to Player ID for the given name key of the players dataset. If several
+# players share a name the last one is used, as the scraper always has.
+#--------------------------------------------------------------------------------------------
+
+def player_ids(players, key='Name'):
+    return dict(zip(players[key], players['Player ID']))
+
+
+#--------------------------------------------------------------------------------------------
+# Player ID of a single raw name: an ID given in the alias table wins, and otherwise the
+# name is looked up in ids as given and then as its canonical name. Raises a KeyError for
+# an unknown player.
+#--------------------------------------------------------------------------------------------
+
+def resolve_player_id(name, ids, aliases=None):
+    if aliases is None:
+        aliases = read_aliases()
+    if name in aliases:
+        alias_name, player_id = aliases[name]
+        return player_id if player_id is not None else ids[alias_name]
+    if name in ids:
+        return ids[name]
+    return ids[canonical_name(name, aliases)]
+
+
+#--------------------------------------------------------------------------------------------
+# Player IDs of a column of raw names, resolved once per unique name. Unknown players get
+# a missing ID.
+#--------------------------------------------------------------------------------------------
+
+def resolve_player_ids(values, ids, aliases=None):
+    if aliases is None:
+        aliases = read_aliases()
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    unique_ids = []
+    for name in uniques:
+        try:
+            unique_ids.append(resolve_player_id(name, ids, aliases))
+        except KeyError:
+            unique_ids.append(np.nan)
+    return np.array(unique_ids + [np.nan], dtype=float)[codes]
+
+
+#--------------------------------------------------------------------------------------------
+# Fuzzy matching. A name is normalized (accents removed, lower case, punctuation and hyphens
+# replaced by spaces) and split into the trigrams of its words. The index lists, for every
+# trigram, the players whose name contains it, and a candidate's score is the Dice
+# coefficient of its trigrams and those of the name (1.0 for the same trigrams). Only
+# players that share one of the name's less common trigrams are scored, which keeps a lookup
+# well under a millisecond.
+#--------------------------------------------------------------------------------------------
+
+NameIndex = namedtuple('NameIndex', ['ids', 'names', 'sizes', 'grams'])
+Candidate = namedtuple('Candidate', ['player_id', 'name', 'score'])
+
+def normalize_name(name):
+    if isinstance(name, bytes):
+        name = name.decode('utf-8', 'ignore')
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower().replace("'", '')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name).split())
+
+
+def name_trigrams(name):
+    grams = set()
+    for word in normalize_name(name).split():
+        word = ' ' + word + ' '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def build_name_index(players):
+    first = players['First'].fillna('').astype(str)
+    last = players['Last'].fillna('').astype(str)
+    grams = defaultdict(list)
+    sizes = np.zeros(len(players), dtype=np.int16)
+    for row, name in enumerate(first + ' ' + last):
+        name_grams = name_trigrams(name)
+        sizes[row] = len(name_grams)
+        for gram in name_grams:
+            grams[gram].append(row)
+    return NameIndex(ids=players['Player ID'].values, names=players['Name'].values, sizes=sizes,
+                     grams=dict((gram, np.array(rows, dtype=np.int32)) for gram, rows in grams.items()))
+
+
+#--------------------------------------------------------------------------------------------
+# Best candidates for a name, highest score first.
+#--------------------------------------------------------------------------------------------
+
+def name_candidates(name, index, limit=5):
+    grams = name_trigrams(name)
+    rows = [index.grams[gram] for gram in grams if gram in index.grams]
+    if not rows:
+        return []
+    rare = [x for x in rows if len(x) <= common_gram]
+    common = [x for x in rows if len(x) > common_gram]
+    if not rare:
+        rare, common = common, []
+    players, hits = np.unique(np.concatenate(rare), return_counts=True)
+    sizes = len(grams) + index.sizes[players]
+    if common and len(players) > limit:
+        # A player gains at most one hit per common trigram, so players that cannot reach
+        # the limit-th best score without them are not scored further
+        bound = np.partition(-2.0 * hits / sizes, limit - 1)[limit - 1]
+        keep = 2.0 * (hits + len(common)) / sizes >= -bound
+        players, hits, sizes = players[keep], hits[keep], sizes[keep]
+    for x in common:
+        hits += x[np.minimum(np.searchsorted(x, players), len(x) - 1)] == players
+    scores = 2.0 * hits / sizes
+    best = np.argpartition(-scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+    best = best[np.lexsort((players[best], -scores[best]))]
+    return [Candidate(index.ids[row], index.names[row], score)
+            for row, score in zip(players[best], scores[best])]
+
+
+#--------------------------------------------------------------------------------------------
+# Read and write the cache of accepted fuzzy matches. Rows can be removed or corrected by
+# hand, and a name that is in the cache is not scored again.
+#--------------------------------------------------------------------------------------------
+
+def read_name_matches(path=name_match_path):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=name_match_columns)
+    return pd.read_csv(path, keep_default_na=False)
+
+
+def write_name_matches(matches, path=name_match_path):
+    matches.sort_values('Name')[name_match_columns].to_csv(path, index=False)
+
+
+#--------------------------------------------------------------------------------------------
+# Whether a name can be a single player. Doubles pairs ('A/B'), Davis Cup teams ('Spain
+# Doubles') and one-word names ('David', 'Tennis') are never matched.
+#--------------------------------------------------------------------------------------------
+
+def single_player_name(name):
+    words = normalize_name(name).split()
+    return '/' not in name and len(words) >= 2 and words[-1] != 'doubles'
+
+
+#--------------------------------------------------------------------------------------------
+# Match names that are not in the players dataset. Cached matches are used as they are, and
+# the other names are matched against an index of players and accepted if they are
+# confident enough. The index is only built if some name is not in the cache. Returns a
+# dictionary of name to Candidate for the matched names, the names that could not be matched
+# with their best candidates, and the updated cache.
+#--------------------------------------------------------------------------------------------
+
+def match_player_names(names, players, matches, score=accept_score, margin=accept_margin):
+    cached = dict((name, Candidate(pid, matched, float(s))) for name, pid, matched, s in
+                  zip(matches['Name'], matches['Player ID'], matches['Matched Name'], matches['Score']))
+    matched = dict()
+    unmatched = dict()
+    new = []
+    index = None
+    for name in names:
+        if name in cached:
+            matched[name] = cached[name]
+            continue
+        if not single_player_name(name):
+            unmatched[name] = []
+            continue
+        if index is None:
+            index = build_name_index(players)
+        candidates = name_candidates(name, index)
+        if candidates and candidates[0].score >= score and \
+           (len(candidates) == 1 or candidates[0].score - candidates[1].score >= margin):
+            matched[name] = candidates[0]
+            new.append((name, candidates[0].player_id, candidates[0].name, round(candidates[0].score, 3)))
+        else:
+            unmatched[name] = candidates
+    if new:
+        matches = pd.concat([matches, pd.DataFrame(new, columns=name_match_columns)], ignore_index=True)
+    return matched, unmatched, matches
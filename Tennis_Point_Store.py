@@ -0,0 +1,411 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Point_Store.py
+#
+# Description: This module stores the point data produced by Tennis_PBP_Project in a typed,
+# binary columnar format that replaces 'All Point Data.csv'. Each column of each partition
+# (tour level and year) is a NumPy .npy file that can be memory-mapped, so a script only
+# opens the partitions it needs. Scores and sets are int8, and names and score labels are
+# dictionary-encoded. A compatibility export writes the store back to the old CSV.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+from Tennis_Score_States import add_state_labels, state_label_columns, max_sets, max_games, n_point_states
+
+point_store_path = 'Point Store'
+
+#--------------------------------------------------------------------------------------------
+# Store schema. Numeric columns are stored with the given NumPy type, while string columns
+# are stored as int32 codes into the named dictionary. The game situation is stored as its
+# state ID ('State' and 'Game State Code', see Tennis_Score_States); the label columns of the
+# old point data are derived from them when read. 'Source' is the pbp file a point
+# came from, which together with 'MatchNum' identifies its match. 'Row' and 'Index' keep the
+# position and index label of every point in the original point data, so that the old CSV
+# can be written in its original order.
+#--------------------------------------------------------------------------------------------
+
+store_columns = [('Player 1', 'Player'),
+                 ('Player 2', 'Player'),
+                 ('Winner', np.int8),
+                 ('p1Set', np.int8),
+                 ('p2Set', np.int8),
+                 ('p1Game', np.int8),
+                 ('p2Game', np.int8),
+                 ('p1Score', np.int8),
+                 ('p2Score', np.int8),
+                 ('Server', np.int8),
+                 ('Result', 'Result'),
+                 ('Score', 'Score'),
+                 ('Year', 'Year'),
+                 ('Tourney', 'Tourney'),
+                 ('MatchNum', np.int32),
+                 ('Server Winner', np.bool_),
+                 ('State', np.int32),
+                 ('Game State Code', np.int8),
+                 ('Source', 'Source'),
+                 ('Row', np.int64),
+                 ('Index', np.int64)]
+
+legacy_columns = ['Player 1', 'Player 2', 'Winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game',
+                  'p1Score', 'p2Score', 'Server','Points','Result','Score',
+                  'Year','Tourney','MatchNum', 'Game State', 'Server Winner',
+                  'Game Score Server View', 'Set Score Server View', 'Game State New']
+
+label_columns = ['Game State'] + state_label_columns
+
+pts = [0,15,30,40,45]
+
+#--------------------------------------------------------------------------------------------
+# JSON returns unicode labels in Python 2. Converts them back to str so the decoded columns
+# join cleanly with the other data sets.
+#--------------------------------------------------------------------------------------------
+
+def native_label(label):
+    if label is None or isinstance(label, str):
+        return label
+    return label.encode('utf-8')
+
+#--------------------------------------------------------------------------------------------
+# Encodes an array of strings as codes into a dictionary (list of labels). Labels that are
+# not in the dictionary yet are appended to it, so existing codes never change. Missing
+# values are coded as -1.
+#--------------------------------------------------------------------------------------------
+
+def encode_labels(values, labels):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    lookup = dict((x, i) for i, x in enumerate(labels))
+    mapping = np.zeros(len(uniques) + 1, dtype=np.int32)
+    for i, x in enumerate(uniques):
+        if x not in lookup:
+            lookup[x] = len(labels)
+            labels.append(x)
+        mapping[i] = lookup[x]
+    mapping[-1] = -1
+    return mapping[codes]
+
+#--------------------------------------------------------------------------------------------
+# Decodes dictionary codes back to an object array of strings (NaN for missing values)
+#--------------------------------------------------------------------------------------------
+
+def decode_labels(codes, labels):
+    lookup = np.empty(len(labels) + 1, dtype=object)
+    lookup[:-1] = labels
+    lookup[-1] = np.nan
+    return lookup[np.asarray(codes)]
+
+#--------------------------------------------------------------------------------------------
+# Converts a numeric column to its store type, and makes sure no value is lost on the way
+#--------------------------------------------------------------------------------------------
+
+def typed_column(name, values, dtype):
+    values = np.asarray(values)
+    typed = values.astype(dtype)
+    if len(values) > 0 and not (typed == values).all():
+        raise ValueError('Column ' + name + ' does not fit in ' + np.dtype(dtype).name)
+    return typed
+
+#--------------------------------------------------------------------------------------------
+# Reads and writes the store manifest, which lists the columns, the dictionaries and the
+# partitions (with their row counts) in the store, and the layout of the state IDs it was
+# written with. A store written with another layout (or before the layout was recorded)
+# holds state IDs that no longer decode, so it has to be built again (build_point_data).
+#--------------------------------------------------------------------------------------------
+
+state_layout = [max_sets, max_games, n_point_states]
+
+def read_manifest(path=point_store_path):
+    with open(os.path.join(path, 'store.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('state_layout') != state_layout:
+        raise ValueError('The point store at ' + path + ' was written with another state ID layout; '
+                         'build it again with build_point_data')
+    manifest.setdefault('next_row', sum(p['rows'] for p in manifest['partitions']))
+    manifest['dictionaries'] = dict((native_label(k), [native_label(x) for x in v])
+                                    for k, v in manifest['dictionaries'].items())
+    manifest['columns'] = [native_label(x) for x in manifest['columns']]
+    for partition in manifest['partitions']:
+        partition['level'] = native_label(partition['level'])
+        partition['year'] = native_label(partition['year'])
+    return manifest
+
+
+def write_manifest(manifest, path=point_store_path):
+    with open(os.path.join(path, 'store.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def partition_path(path, level, year):
+    return os.path.join(path, level, year)
+
+#--------------------------------------------------------------------------------------------
+# Writes the point data to the store, partitioned by tour level ('Level') and 'Year'. Any
+# existing store at the path is replaced.
+#--------------------------------------------------------------------------------------------
+
+def write_point_store(point_data, path=point_store_path):
+    sink = open_point_sink(path)
+    append_point_batch(sink, point_data)
+    return close_point_sink(sink)
+
+#--------------------------------------------------------------------------------------------
+# Streaming writer for the store, for point data that comes in batches. open_point_sink
+# starts a new store at the path, and append_point_batch appends a batch to raw column files
+# in its partitions. close_point_sink copies the raw files into .npy files block by block
+# and writes the manifest. Memory use only depends on the size of a batch.
+#--------------------------------------------------------------------------------------------
+
+def open_point_sink(path=point_store_path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return {'path': path, 'manifest': None, 'rows': dict()}
+
+
+def append_point_batch(sink, point_data):
+    if sink['manifest'] is None:
+        sink['manifest'] = new_manifest(point_data.columns)
+    encoded, partitions = encode_points(point_data, sink['manifest'])
+    for (level, year), idx in partitions.groupby(['Level', 'Year']).indices.items():
+        level, year = str(level), str(year)
+        folder = partition_path(sink['path'], level, year)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in sink['manifest']['columns']:
+            with open(os.path.join(folder, name + '.bin'), 'ab') as f:
+                encoded[name][idx].tofile(f)
+        sink['rows'][(level, year)] = sink['rows'].get((level, year), 0) + len(idx)
+
+
+def close_point_sink(sink, block_size=1000000):
+    manifest = sink['manifest'] if sink['manifest'] is not None else new_manifest([])
+    for (level, year), count in sorted(sink['rows'].items()):
+        folder = partition_path(sink['path'], level, year)
+        for name in manifest['columns']:
+            dtype = store_dtype(name)
+            array = np.lib.format.open_memmap(os.path.join(folder, name + '.npy'), mode='w+',
+                                              dtype=dtype, shape=(count,))
+            with open(os.path.join(folder, name + '.bin'), 'rb') as f:
+                for start in range(0, count, block_size):
+                    block = np.fromfile(f, dtype=dtype, count=block_size)
+                    array[start:start + len(block)] = block
+            del array
+            os.remove(os.path.join(folder, name + '.bin'))
+
+    manifest['partitions'] = [{'level': level, 'year': year, 'rows': count}
+                              for (level, year), count in sorted(sink['rows'].items())]
+    write_manifest(manifest, sink['path'])
+    return manifest
+
+#--------------------------------------------------------------------------------------------
+# Starts the manifest of a new store holding the store columns of the point data, and gives
+# the NumPy type a column is stored with.
+#--------------------------------------------------------------------------------------------
+
+def new_manifest(point_columns):
+    specs = dict(store_columns)
+    columns = [name for name, spec in store_columns
+               if name in point_columns or name in ['Row', 'Index']]
+    return {'columns': columns,
+            'dictionaries': dict((specs[x], []) for x in columns if isinstance(specs[x], str)),
+            'partitions': [],
+            'next_row': 0,
+            'state_layout': state_layout}
+
+
+def store_dtype(name):
+    spec = dict(store_columns)[name]
+    return np.int32 if isinstance(spec, str) else spec
+
+#--------------------------------------------------------------------------------------------
+# Encodes the store columns of the point data, extending the dictionaries of the manifest
+# with new labels. New points are numbered from the manifest's next 'Row'. Returns the
+# encoded columns and the (level, year) partition of every point.
+#--------------------------------------------------------------------------------------------
+
+def encode_points(point_data, manifest):
+    specs = dict(store_columns)
+    encoded = dict()
+    for name in manifest['columns']:
+        spec = specs[name]
+        if name == 'Row':
+            encoded[name] = np.arange(manifest['next_row'], manifest['next_row'] + len(point_data),
+                                      dtype=np.int64)
+        elif name == 'Index':
+            encoded[name] = typed_column(name, point_data.index.values, spec)
+        elif isinstance(spec, str):
+            encoded[name] = encode_labels(point_data[name].values, manifest['dictionaries'][spec])
+        else:
+            encoded[name] = typed_column(name, point_data[name].values, spec)
+    manifest['next_row'] = manifest['next_row'] + len(point_data)
+    partitions = pd.DataFrame({'Level': point_data['Level'].values, 'Year': point_data['Year'].values})
+    return encoded, partitions
+
+#--------------------------------------------------------------------------------------------
+# Writes partitions to the store. kept holds the remaining columns of existing partitions
+# (by (level, year)), and new holds encoded points that are appended to their partitions.
+# Partitions that end up empty are removed. The manifest is updated and saved.
+#--------------------------------------------------------------------------------------------
+
+def write_partitions(manifest, kept, new, partitions, path=point_store_path):
+    groups = dict(((str(k[0]), str(k[1])), idx) for k, idx in
+                  partitions.groupby(['Level', 'Year']).indices.items())
+    rows = dict()
+    for p in manifest['partitions']:
+        rows.setdefault(p['level'], dict())[p['year']] = p['rows']
+
+    for level, year in sorted(set(kept.keys()) | set(groups.keys())):
+        folder = partition_path(path, level, year)
+        parts = [kept[(level, year)]] if (level, year) in kept else []
+        if (level, year) in groups:
+            parts.append(dict((name, new[name][groups[(level, year)]]) for name in manifest['columns']))
+        count = sum(len(x['Row']) for x in parts)
+
+        if count == 0:
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+            rows.get(level, dict()).pop(year, None)
+            continue
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for name in manifest['columns']:
+            np.save(os.path.join(folder, name + '.npy'), np.concatenate([x[name] for x in parts]))
+        rows.setdefault(level, dict())[year] = count
+
+    manifest['partitions'] = [{'level': level, 'year': year, 'rows': rows[level][year]}
+                              for level in sorted(rows) for year in sorted(rows[level])]
+    write_manifest(manifest, path)
+
+#--------------------------------------------------------------------------------------------
+# Matches are identified in the store by their source and MatchNum, which are packed into
+# a single int64 key.
+#--------------------------------------------------------------------------------------------
+
+def match_keys(matches, manifest):
+    source_codes = dict((x, i) for i, x in enumerate(manifest['dictionaries']['Source']))
+    return np.array([source_codes[s] * 2**32 + int(m) for s, m in matches if s in source_codes],
+                    dtype=np.int64)
+
+#--------------------------------------------------------------------------------------------
+# Updates the store in place: removes every point of the retracted matches (a list of
+# (source, MatchNum) pairs), gives the renumbered matches (a list of (source, old MatchNum,
+# new MatchNum)) their new MatchNum, and appends the new point data. Only the partitions
+# that hold affected points are rewritten. Returns the removed points as a decoded frame, so
+# that anything counted from them can be subtracted.
+#--------------------------------------------------------------------------------------------
+
+def update_point_store(new_points, retracted, renumbered=[], path=point_store_path):
+    manifest = read_manifest(path)
+    retract_keys = match_keys(retracted, manifest)
+    old_keys = match_keys([(s, m) for s, m, n in renumbered], manifest)
+    new_numbers = np.array([n for s, m, n in renumbered if s in manifest['dictionaries']['Source']],
+                           dtype=np.int32)
+    order = np.argsort(old_keys)
+    old_keys, new_numbers = old_keys[order], new_numbers[order]
+
+    kept, removed = dict(), []
+    for p in manifest['partitions']:
+        folder = partition_path(path, p['level'], p['year'])
+        keys = np.load(os.path.join(folder, 'Source.npy')).astype(np.int64) * 2**32 + \
+               np.load(os.path.join(folder, 'MatchNum.npy'))
+        drop = np.in1d(keys, retract_keys)
+        moved = np.in1d(keys, old_keys)
+        if drop.any() or moved.any():
+            data = dict((name, np.load(os.path.join(folder, name + '.npy'))) for name in manifest['columns'])
+            removed.append((p['level'], dict((name, v[drop]) for name, v in data.items())))
+            if moved.any():
+                data['MatchNum'] = data['MatchNum'].copy()
+                data['MatchNum'][moved] = new_numbers[np.searchsorted(old_keys, keys[moved])]
+            kept[(p['level'], p['year'])] = dict((name, v[~drop]) for name, v in data.items())
+
+    encoded, partitions = encode_points(new_points, manifest)
+    write_partitions(manifest, kept, encoded, partitions, path)
+
+    specs = dict(store_columns)
+    removed_data = dict()
+    for name in manifest['columns']:
+        values = np.concatenate([x[name] for level, x in removed]) if len(removed) > 0 else \
+                 np.zeros(0, dtype=store_dtype(name))
+        if isinstance(specs[name], str):
+            values = decode_labels(values, manifest['dictionaries'][specs[name]])
+        removed_data[name] = values
+    removed_data['Level'] = np.concatenate([np.repeat(np.array([level], dtype=object), len(x['Row']))
+                                            for level, x in removed]) if len(removed) > 0 else \
+                            np.zeros(0, dtype=object)
+    return pd.DataFrame(removed_data, columns=manifest['columns'] + ['Level'])
+
+
+#--------------------------------------------------------------------------------------------
+# Opens a single partition. Every column is memory-mapped, so this only reads the headers of
+# the column files. Returns a dictionary of (read-only) arrays, with string columns as codes.
+#--------------------------------------------------------------------------------------------
+
+def open_partition(level, year, path=point_store_path, columns=None, manifest=None):
+    if manifest is None:
+        manifest = read_manifest(path)
+    if columns is None:
+        columns = manifest['columns']
+    folder = partition_path(path, level, year)
+    return dict((name, np.load(os.path.join(folder, name + '.npy'), mmap_mode='r'))
+                for name in columns)
+
+#--------------------------------------------------------------------------------------------
+# Reads the requested tour levels, years and columns of the store into a point data frame.
+# If decode is set, dictionary columns are turned back into strings, otherwise they are
+# returned as int32 codes. The label columns of the old point data (label_columns) can also
+# be requested when decoding. The frame has a 'Level' (e.g. 'wta_qual') and a 'Tour' (e.g.
+# 'wta') column, taken from the partitions, and its index is the index of the original point
+# data.
+#--------------------------------------------------------------------------------------------
+
+def read_point_store(path=point_store_path, levels=None, years=None, columns=None, decode=True):
+    manifest = read_manifest(path)
+    if columns is None:
+        columns = [x for x in manifest['columns'] if x not in ['Row', 'Index']]
+    specs = dict(store_columns)
+    requested = list(columns)
+    labels = decode and len(set(label_columns) & set(columns)) > 0
+    columns = [x for x in columns if x not in label_columns]
+    if labels:
+        columns = columns + [x for x in ['State', 'Game State Code'] if x not in columns]
+
+    selected = [p for p in manifest['partitions']
+                if (levels is None or p['level'] in levels) and
+                   (years is None or p['year'] in [str(y) for y in years])]
+    parts = [open_partition(p['level'], p['year'], path, list(columns) + ['Index'], manifest)
+             for p in selected]
+
+    data = dict()
+    for name in columns:
+        values = np.concatenate([x[name] for x in parts]) if len(parts) > 0 else \
+                 np.zeros(0, dtype=store_dtype(name))
+        if decode and isinstance(specs[name], str):
+            values = decode_labels(values, manifest['dictionaries'][specs[name]])
+        data[name] = values
+    data['Level'] = np.repeat(np.array([p['level'] for p in selected], dtype=object),
+                              [p['rows'] for p in selected])
+    data['Tour'] = np.repeat(np.array([p['level'].split('_')[0] for p in selected], dtype=object),
+                             [p['rows'] for p in selected])
+    index = np.concatenate([x['Index'] for x in parts]) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+
+    point_data = pd.DataFrame(data, columns=list(columns) + ['Level', 'Tour'], index=index)
+    if labels:
+        point_data = add_state_labels(point_data)
+    return point_data[requested + ['Level', 'Tour']]
+
+#--------------------------------------------------------------------------------------------
+# Compatibility export: writes the store back to the old 'All Point Data.csv' layout, in
+# the original row order and with the 'Points' column.
+#--------------------------------------------------------------------------------------------
+
+def export_point_csv(path=point_store_path, filename='All Point Data.csv'):
+    manifest = read_manifest(path)
+    columns = [x for x in legacy_columns if x in manifest['columns'] or x in label_columns] + ['Row']
+    point_data = read_point_store(path, columns=columns)
+    point_data = point_data.iloc[np.argsort(point_data['Row'].values, kind='mergesort')]
+    point_data['Points'] = [pts] * len(point_data)
+    point_data[[x for x in legacy_columns if x in point_data.columns]].to_csv(filename)
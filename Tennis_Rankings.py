@@ -0,0 +1,153 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Rankings.py
+#
+# Description: This module keeps the ATP rankings of Jeff Sackmann's atp_rankings_*.csv files
+# (one row per ranking week and player) in a compact binary store. The rows are sorted by
+# player and week, so the rankings of a player are one sorted run of weeks, and the ranking
+# of any player on any date is found with a binary search. Lookups take arrays of players
+# and dates, so the rankings of a whole match table are found in one call. The store is a
+# set of NumPy .npy files that are memory-mapped when opened.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+import json
+import os
+import re
+from Tennis_ATP_Matches import atp_path, file_fingerprint
+from Tennis_Calendar import yyyymmdd_days
+
+ranking_store_path = 'Ranking Store'
+ranking_file_pattern = re.compile(r'^atp_rankings_\w+\.csv$')
+ranking_columns = ['Week','Ranking','Player ID','Points']
+
+#--------------------------------------------------------------------------------------------
+# Store layout. 'Player' holds the sorted Player IDs and 'Start' the first row of each
+# player, with one extra entry for the end of the last player. Every row has a 'Key' (the
+# player's position in 'Player' in the high 32 bits and the YYYYMMDD week in the low 32
+# bits), so the keys are sorted and a (player, date) pair is found with one searchsorted.
+# Ranks fit in int16 and points in int32.
+#--------------------------------------------------------------------------------------------
+
+RankingStore = namedtuple('RankingStore', ['players', 'start', 'keys', 'ranks', 'points'])
+
+ranking_store_files = [('players', 'Player', np.int32),
+                       ('start', 'Start', np.int64),
+                       ('keys', 'Key', np.int64),
+                       ('ranks', 'Ranking', np.int16),
+                       ('points', 'Points', np.int32)]
+
+#--------------------------------------------------------------------------------------------
+# Lists the rankings files, with the size and modification time of each
+#--------------------------------------------------------------------------------------------
+
+def ranking_files(path=atp_path):
+    files = sorted(x for x in os.listdir(path) if ranking_file_pattern.match(x))
+    return [[x] + list(file_fingerprint(os.path.join(path, x))) for x in files]
+
+
+#--------------------------------------------------------------------------------------------
+# Builds the store from all rankings files. If a player appears twice in the same week, the
+# row read last is kept.
+#--------------------------------------------------------------------------------------------
+
+def build_ranking_store(path=ranking_store_path, source_path=atp_path):
+    files = ranking_files(source_path)
+    rankings = pd.concat([pd.read_csv(os.path.join(source_path, x[0]), header=None, names=ranking_columns,
+                                      dtype=np.int64) for x in files], axis=0, ignore_index=True)
+    ids, weeks = rankings['Player ID'].values, rankings['Week'].values
+    order = np.lexsort((np.arange(len(rankings)), weeks, ids))
+    last = np.append((ids[order][1:] != ids[order][:-1]) | (weeks[order][1:] != weeks[order][:-1]), True)
+    order = order[last]
+
+    players, codes = np.unique(ids[order], return_inverse=True)
+    columns = {'Player': players,
+               'Start': np.searchsorted(codes, np.arange(len(players) + 1)),
+               'Key': codes.astype(np.int64) * 2**32 + weeks[order],
+               'Ranking': rankings['Ranking'].values[order],
+               'Points': rankings['Points'].values[order]}
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for field, name, dtype in ranking_store_files:
+        np.save(os.path.join(path, name + '.npy'), columns[name].astype(dtype))
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump({'files': files, 'rows': len(order)}, f)
+
+
+#--------------------------------------------------------------------------------------------
+# Opens the store, memory-mapped unless mmap_mode is None. The store is built first if it
+# does not exist yet or if a rankings file was added, removed or changed since it was built.
+#--------------------------------------------------------------------------------------------
+
+def open_ranking_store(path=ranking_store_path, source_path=atp_path, mmap_mode='r'):
+    manifest_path = os.path.join(path, 'manifest.json')
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    if manifest is None or manifest['files'] != ranking_files(source_path):
+        build_ranking_store(path, source_path)
+    return RankingStore(**dict((field, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+                               for field, name, dtype in ranking_store_files))
+
+#--------------------------------------------------------------------------------------------
+# Row of the latest ranking of every player on or before the matching YYYYMMDD date, or -1 if
+# there is none. If tolerance is given, rankings more than tolerance days older than the date
+# are not used. Missing players or dates (NaN) are not found.
+#--------------------------------------------------------------------------------------------
+
+def ranking_rows(store, player_ids, dates, tolerance=None):
+    player_ids = np.asarray(player_ids, dtype=np.float64)
+    dates = np.broadcast_to(np.asarray(dates, dtype=np.float64), player_ids.shape)
+    valid = ~(np.isnan(player_ids) | np.isnan(dates))
+    player_ids = np.where(valid, player_ids, 0).astype(np.int64)
+    dates = np.where(valid, dates, 0).astype(np.int64)
+
+    codes = np.minimum(np.searchsorted(store.players, player_ids), len(store.players) - 1)
+    rows = np.searchsorted(store.keys, codes * 2**32 + dates, side='right') - 1
+    found = valid & (store.players[codes] == player_ids) & (rows >= store.start[codes])
+    if tolerance is not None and found.any():
+        weeks = store.keys[rows[found]] % 2**32
+        found[found] = (yyyymmdd_days(dates[found]) - yyyymmdd_days(weeks)).astype(np.int64) <= tolerance
+    return np.where(found, rows, -1)
+
+
+def rank_at(store, player_ids, dates, tolerance=None):
+    rows = ranking_rows(store, player_ids, dates, tolerance)
+    return np.where(rows >= 0, store.ranks[rows].astype(np.float64), np.nan)
+
+
+def points_at(store, player_ids, dates, tolerance=None):
+    rows = ranking_rows(store, player_ids, dates, tolerance)
+    return np.where(rows >= 0, store.points[rows].astype(np.float64), np.nan)
+
+#--------------------------------------------------------------------------------------------
+# Rankings of a whole table at once: a frame with the 'Week', 'Ranking', 'Player ID' and
+# 'Points' found for every (player, date) pair, with NaN where no ranking was found.
+#--------------------------------------------------------------------------------------------
+
+def ranking_table(store, player_ids, dates, tolerance=None):
+    rows = ranking_rows(store, player_ids, dates, tolerance)
+    found = rows >= 0
+    values = np.full((len(rows), len(ranking_columns)), np.nan)
+    values[found] = np.column_stack([store.keys[rows[found]] % 2**32,
+                                     store.ranks[rows[found]],
+                                     store.players[store.keys[rows[found]] // 2**32],
+                                     store.points[rows[found]]])
+    return pd.DataFrame(values, columns=ranking_columns)
+
+#--------------------------------------------------------------------------------------------
+# All rankings of one player, oldest week first
+#--------------------------------------------------------------------------------------------
+
+def player_rankings(store, player_id):
+    code = np.searchsorted(store.players, player_id)
+    if code == len(store.players) or store.players[code] != player_id:
+        return pd.DataFrame(columns=ranking_columns)
+    rows = slice(store.start[code], store.start[code + 1])
+    return pd.DataFrame({'Week': store.keys[rows] % 2**32, 'Ranking': store.ranks[rows],
+                         'Player ID': store.players[code], 'Points': store.points[rows]},
+                        columns=ranking_columns)
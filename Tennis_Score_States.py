@@ -0,0 +1,476 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Score_States.py
+#
+# Description: This module codes the score situation of every point as a single integer
+# state ID. The ID covers the set score and game score (both from the server's view) and the
+# point score ('Game State New', which holds the tiebreak score in a 6-6 game score), so that
+# the point data can be grouped and joined on small ints. Lookup tables map the IDs back to
+# the labels used in the result files, which are only produced when they are written out.
+# win_pct_data turns win/instance counts per state into the match win % tables.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+#--------------------------------------------------------------------------------------------
+# These dictionaries and functions help map game states to easily comprehensible game
+# situations (in both regular game and tiebreak scenarios)
+#--------------------------------------------------------------------------------------------
+
+all_game_states = {
+    (0,0,1): 'Start of Game',
+    (0,0,2): 'Start of Game',
+    (15,0,1): 'Server 15-0',
+    (0,15,2): 'Server 15-0',
+    (0,15,1): 'Server 0-15',
+    (15,0,2): 'Server 0-15',
+    (15,15,1): 'Server 15-15',
+    (15,15,2): 'Server 15-15',
+    (30,0,1): 'Server 30-0',
+    (0,30,2): 'Server 30-0',
+    (0,30,1): 'Server 0-30',
+    (30,0,2): 'Server 0-30',
+    (30,15,1): 'Server 30-15',
+    (15,30,2): 'Server 30-15',
+    (15,30,1): 'Server 15-30',
+    (30,15,2): 'Server 15-30',
+    (30,30,1): 'Server 30-30',
+    (30,30,2): 'Server 30-30',
+    (40,0,1): 'Server 40-0',
+    (0,40,2): 'Server 40-0',
+    (40,15,1): 'Server 40-15',
+    (15,40,2): 'Server 40-15',
+    (40,30,1): 'Server 40-30',
+    (30,40,2): 'Server 40-30',
+    (0,40,1): 'Server 0-40',
+    (40,0,2): 'Server 0-40',
+    (15,40,1): 'Server 15-40',
+    (40,15,2): 'Server 15-40',
+    (30,40,1): 'Server 30-40',
+    (40,30,2): 'Server 30-40',
+    (40,40,1): 'Server 40-40',
+    (40,40,2): 'Server 40-40',
+    (45,40,1): 'Server AD-40',
+    (40,45,2): 'Server AD-40',
+    (40,45,1): 'Server 40-AD',
+    (45,40,2): 'Server 40-AD'
+}
+
+
+def tiebreak_state(state):
+    p1,p2,server = state
+    if p1 >= 6 and p2 >=6:
+        if p1 > p2 and server == 1:
+            return 'Server 7-6'
+        elif p1 > p2 and server == 2:
+            return 'Server 6-7'
+        elif p1 < p2 and server == 1:
+            return 'Server 6-7'
+        elif p1 < p2 and server == 2:
+            return 'Server 7-6'
+        else:
+            return 'Server 6-6'
+    elif server == 1:
+        return 'Server ' + str(p1)+'-'+str(p2)
+    elif server == 2:
+        return 'Server ' + str(p2)+'-'+str(p1)
+    
+
+coordinate_states = {
+    'Start of Game': (0,0),
+    'Server 15-0': (1,1),
+    'Server 0-15': (1,-1),
+    'Server 15-15': (2,0),
+    'Server 30-0': (2,2),
+    'Server 0-30': (2,-2),
+    'Server 30-15': (3,1),
+    'Server 15-30': (3,-1),
+    'Server 30-30': (4,0),
+    'Server 40-0': (3,3),
+    'Server 40-15': (4,2),
+    'Server 40-30': (5,1),
+    'Server 0-40': (3,-3),
+    'Server 15-40': (4,-2),
+    'Server 30-40': (5,-1),
+    'Server 40-40': (6,0),
+    'Server AD-40': (7,1),
+    'Server 40-AD': (7,-1)
+}
+
+#--------------------------------------------------------------------------------------------
+# Layout of the state ID space. Sets and games are counted from 0 up to max_sets - 1 and
+# max_games - 1. The point score is either one of the regular game states (including
+# 'Tiebreak' for tiebreak points outside a 6-6 game score), or a tiebreak score from the
+# server's view. Tiebreak scores only take the values in tiebreak_values: a tiebreak ends
+# at 7 unless both players reach 6 (those scores are folded into 6-6, 7-6 and 6-7), a match
+# tiebreak (played at 0-0 games in place of the final set) ends at 10 unless both players
+# reach 9 (folded into 9-9, 10-9 and 9-10), and an advantage set at 6-6 games keeps its
+# regular point scores.
+#
+#   State = ((set score * max_games^2) + game score) * number of point states + point state
+#--------------------------------------------------------------------------------------------
+
+max_sets = 4
+max_games = 32
+max_points = 46
+
+game_state_labels = sorted(set(all_game_states.values())) + ['Tiebreak']
+tiebreak_values = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 15, 30, 40, 45]
+
+n_set_states = max_sets * max_sets
+n_game_states = max_games * max_games
+n_point_states = len(game_state_labels) + len(tiebreak_values) * len(tiebreak_values)
+n_states = n_set_states * n_game_states * n_point_states
+
+state_label_columns = ['Set Score Server View', 'Game Score Server View', 'Game State New']
+
+#--------------------------------------------------------------------------------------------
+# Lookup tables. game_state_codes maps a (server score, returner score) pair to its regular
+# game state, and tiebreak_index maps a tiebreak score to its position in tiebreak_values.
+# set_labels, game_labels and point_labels map the parts of a state ID back to its labels.
+#--------------------------------------------------------------------------------------------
+
+game_state_codes = np.full((max_points, max_points), game_state_labels.index('Tiebreak'), dtype=np.int16)
+for (p1, p2, server), label in all_game_states.items():
+    if server == 1:
+        game_state_codes[p1, p2] = game_state_labels.index(label)
+    else:
+        game_state_codes[p2, p1] = game_state_labels.index(label)
+
+tiebreak_index = np.full(max_points, -1, dtype=np.int16)
+tiebreak_index[tiebreak_values] = np.arange(len(tiebreak_values))
+
+set_labels = np.array([str(x) + '-' + str(y) for x in range(max_sets) for y in range(max_sets)],
+                      dtype=object)
+game_labels = np.array([str(x) + '-' + str(y) for x in range(max_games) for y in range(max_games)],
+                       dtype=object)
+point_labels = np.array(game_state_labels + ['Server ' + str(x) + '-' + str(y) if max(x, y) <= 10 else
+                                             tiebreak_state((x, y, 1)) for x in tiebreak_values
+                                             for y in tiebreak_values], dtype=object)
+
+#--------------------------------------------------------------------------------------------
+# Derives the state ID of every point from the raw score columns, along with the code of its
+# regular game state ('Game State'). match_tiebreak marks the points played in a match
+# tiebreak (see match_tiebreak_points in Tennis_PBP_Engine); without it, only points at 6-6
+# games are tiebreak points. Scores outside the ID space raise a ValueError.
+#--------------------------------------------------------------------------------------------
+
+def score_states(p1Set, p2Set, p1Game, p2Game, p1Score, p2Score, server, match_tiebreak=None):
+    p1_serving = np.asarray(server) == 1
+    set_s = np.where(p1_serving, p1Set, p2Set).astype(np.int64)
+    set_r = np.where(p1_serving, p2Set, p1Set).astype(np.int64)
+    game_s = np.where(p1_serving, p1Game, p2Game).astype(np.int64)
+    game_r = np.where(p1_serving, p2Game, p1Game).astype(np.int64)
+    point_s = np.where(p1_serving, p1Score, p2Score).astype(np.int64)
+    point_r = np.where(p1_serving, p2Score, p1Score).astype(np.int64)
+
+    if len(set_s) > 0 and (max(set_s.max(), set_r.max()) >= max_sets or
+                           max(game_s.max(), game_r.max()) >= max_games or
+                           max(point_s.max(), point_r.max()) >= max_points):
+        raise ValueError('Score outside the state ID space')
+
+    game_state = game_state_codes[point_s, point_r]
+
+    # Tiebreak scores where both players reached 6 (9 in a match tiebreak) are folded into
+    # 6-6, 7-6 and 6-7 (9-9, 10-9 and 9-10)
+    match_tiebreak = np.zeros(len(set_s), dtype=bool) if match_tiebreak is None else \
+                     np.asarray(match_tiebreak, dtype=bool)
+    fold = np.where(match_tiebreak, 9, 6)
+    deuce = (point_s >= fold) & (point_r >= fold)
+    tb_s = np.where(deuce, fold + (point_s > point_r), point_s)
+    tb_r = np.where(deuce, fold + (point_s < point_r), point_r)
+    tb_s, tb_r = tiebreak_index[tb_s], tiebreak_index[tb_r]
+    tiebreak = ((game_s == 6) & (game_r == 6)) | match_tiebreak
+    if ((tb_s < 0) | (tb_r < 0))[tiebreak].any():
+        raise ValueError('Tiebreak score outside the state ID space')
+
+    point_state = np.where(tiebreak, len(game_state_labels) + tb_s * len(tiebreak_values) + tb_r,
+                           game_state)
+    states = ((set_s * max_sets + set_r) * n_game_states + game_s * max_games + game_r) * n_point_states + \
+             point_state
+    return states.astype(np.int32), game_state.astype(np.int8)
+
+#--------------------------------------------------------------------------------------------
+# Splits state IDs into their set score, game score and point state parts, and maps them
+# back to their labels.
+#--------------------------------------------------------------------------------------------
+
+def state_parts(states):
+    states = np.asarray(states, dtype=np.int64)
+    return {'Set Score Server View': states // (n_point_states * n_game_states),
+            'Game Score Server View': (states // n_point_states) % n_game_states,
+            'Game State New': states % n_point_states}
+
+
+label_tables = {'Set Score Server View': set_labels,
+                'Game Score Server View': game_labels,
+                'Game State New': point_labels}
+
+
+def state_labels(states):
+    parts = state_parts(states)
+    return dict((x, label_tables[x][parts[x]]) for x in state_label_columns)
+
+#--------------------------------------------------------------------------------------------
+# Adds the label columns of the old point data ('Game State' and the three state labels) to
+# point data with 'State' and 'Game State Code' columns. Only needed when writing files.
+#--------------------------------------------------------------------------------------------
+
+def add_state_labels(point_data):
+    point_data['Game State'] = np.array(game_state_labels, dtype=object)[point_data['Game State Code'].values]
+    labels = state_labels(point_data['State'].values)
+    for name in ['Game Score Server View', 'Set Score Server View', 'Game State New']:
+        point_data[name] = labels[name]
+    return point_data
+
+#--------------------------------------------------------------------------------------------
+# Replaces the 'State' level of a grouped frame's index by the three state label levels, and
+# sorts the result the way a groupby on the labels would. The index is built from integer
+# codes (the few distinct labels of each level are sorted once), so no labels are hashed
+# or compared per row.
+#--------------------------------------------------------------------------------------------
+
+def label_codes(values, table=None):
+    if table is None:
+        codes, level = pd.factorize(values, sort=True)
+        return codes, level
+    uniques, codes = np.unique(values, return_inverse=True)
+    labels = table[uniques]
+    order = np.argsort(labels, kind='mergesort')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[codes], labels[order]
+
+
+def expand_state_index(frame):
+    names = list(frame.index.names)
+    position = names.index('State')
+    values = [frame.index.get_level_values(x).values for x in names]
+    parts = state_parts(values[position])
+
+    coded = [label_codes(x) for x in values[:position]] + \
+            [label_codes(parts[x], label_tables[x]) for x in state_label_columns] + \
+            [label_codes(x) for x in values[position + 1:]]
+    names = names[:position] + state_label_columns + names[position + 1:]
+    order = np.lexsort([codes for codes, level in coded[::-1]])
+
+    frame = frame.iloc[order].copy()
+    frame.index = pd.MultiIndex([level for codes, level in coded],
+                                [codes[order] for codes, level in coded], names=names)
+    return frame
+
+#--------------------------------------------------------------------------------------------
+# Counts the instances and server wins of every state, optionally split further by the
+# columns in by (e.g. the ranking matchup or the surface). Like the old groupby counts, only
+# points with a 'Player 1' are counted. Point data without player columns (the point table
+# of the Bayesian script, whose players are in its match table) is counted in full.
+#--------------------------------------------------------------------------------------------
+
+def state_counts(point_data, by=[]):
+    if 'Player 1' in point_data.columns:
+        counted = point_data['Player 1'].notnull().values
+    else:
+        counted = np.ones(len(point_data), dtype=bool)
+    won = counted & point_data['Server Winner'].values.astype(bool)
+    grouped = pd.DataFrame({'Instances': counted, 'Wins': won}).groupby(
+        [point_data[x].values for x in by] + [point_data['State'].values])
+    counts = grouped.sum().astype(int)
+    counts.index.names = list(by) + ['State']
+    return counts[['Instances', 'Wins']]
+
+#--------------------------------------------------------------------------------------------
+# The same counts as one dense cube, built in a single pass over the points. The cube has an
+# axis for every column in by (its sorted distinct values, in levels), an axis for the
+# states that occur (in states) and a last axis with the instances and the server wins. The
+# counts split by any subset of the columns are sums over the other axes (see cube_counts),
+# so all of them come from one scan. Points with a missing value in by are left out.
+#--------------------------------------------------------------------------------------------
+
+StateCube = namedtuple('StateCube', ['names', 'levels', 'states', 'counts'])
+
+def cube_cells(point_data, by):
+    if 'Player 1' in point_data.columns:
+        counted = point_data['Player 1'].notnull().values
+    else:
+        counted = np.ones(len(point_data), dtype=bool)
+    coded = [pd.factorize(np.asarray(point_data[x]), sort=True) for x in list(by) + ['State']]
+    codes = [c for c, level in coded]
+    shape = tuple(len(level) for c, level in coded)
+
+    counted = counted & np.logical_and.reduce([c >= 0 for c in codes])
+    cells = np.ravel_multi_index([c[counted] for c in codes], shape)
+    won = point_data['Server Winner'].values[counted].astype(bool)
+    return [np.asarray(level) for c, level in coded], shape, cells, won, counted
+
+
+def state_count_cube(point_data, by=[]):
+    levels, shape, cells, won, counted = cube_cells(point_data, by)
+    outcomes = np.bincount(2 * cells + won, minlength=2 * int(np.prod(shape))).reshape(shape + (2,))
+    counts = np.stack([outcomes.sum(axis=-1), outcomes[..., 1]], axis=-1)
+    return StateCube(list(by), levels[:-1], levels[-1], counts)
+
+#--------------------------------------------------------------------------------------------
+# Counts per state split by the columns in by (a subset of the cube's columns), as returned
+# by state_counts. States that were never counted are left out.
+#--------------------------------------------------------------------------------------------
+
+def cube_counts(cube, by=[]):
+    summed = tuple(i for i, x in enumerate(cube.names) if x not in by)
+    counts = cube.counts.sum(axis=summed) if summed else cube.counts
+    names = [x for x in cube.names if x in by]
+    levels = [cube.levels[cube.names.index(x)] for x in names] + [cube.states]
+    cells = np.nonzero(counts[..., 0] > 0)
+    if names:
+        index = pd.MultiIndex(levels, list(cells), names=names + ['State'])
+    else:
+        index = pd.Index(cube.states[cells[0]], name='State')
+    return pd.DataFrame({'Instances': counts[..., 0][cells], 'Wins': counts[..., 1][cells]},
+                        index=index, columns=['Instances', 'Wins'])
+
+#--------------------------------------------------------------------------------------------
+# The cube of the points before any cutoff week, read off prefix sums instead of counting
+# the points again. Every point has a YYYYMMDD week, and for every cell of the cube that
+# occurs, the running counts are kept after every week in which the cell changed. As in
+# Tennis_Rankings, the rows are sorted by a key with the cell in the high 32 bits and the
+# week in the low 32 bits, so the counts of all cells before a cutoff are found with one
+# searchsorted, whatever the number of points.
+#--------------------------------------------------------------------------------------------
+
+WeeklyStateCube = namedtuple('WeeklyStateCube', ['names', 'levels', 'states', 'shape', 'cells',
+                                                 'keys', 'counts'])
+
+def weekly_state_cube(point_data, weeks, by=[]):
+    levels, shape, cells, won, counted = cube_cells(point_data, by)
+    keys, rows = np.unique(cells.astype(np.int64) * 2**32 + np.asarray(weeks, dtype=np.int64)[counted],
+                           return_inverse=True)
+    outcomes = np.bincount(2 * rows + won, minlength=2 * len(keys)).reshape(-1, 2)
+    running = np.cumsum(np.column_stack([outcomes.sum(axis=1), outcomes[:, 1]]), axis=0)
+
+    key_cells = keys // 2**32
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = key_cells[1:] != key_cells[:-1]
+    starts = np.maximum.accumulate(np.where(first, np.arange(len(keys)), 0))
+    before = np.where((starts > 0)[:, None], running[np.maximum(starts - 1, 0)], 0)
+    return WeeklyStateCube(list(by), levels[:-1], levels[-1], shape, key_cells[first], keys,
+                           running - before)
+
+
+def state_cube_before(weekly, cutoff):
+    rows = np.searchsorted(weekly.keys, weekly.cells * 2**32 + int(cutoff)) - 1
+    found = (rows >= 0) & (weekly.keys[np.maximum(rows, 0)] // 2**32 == weekly.cells)
+    counts = np.zeros((int(np.prod(weekly.shape)), 2), dtype=np.int64)
+    counts[weekly.cells[found]] = weekly.counts[rows[found]]
+    return StateCube(weekly.names, weekly.levels, weekly.states, counts.reshape(weekly.shape + (2,)))
+
+#--------------------------------------------------------------------------------------------
+# Labels of the results for every point state, in a regular game (0) or in a tiebreak (1,
+# at 6-6 or a match tiebreak): the point score from the server's and from the returner's
+# view and the (points elapsed, Y) coordinates. In a tiebreak the point score is marked with
+# who serves the next point, from the view of the player serving at the start of the game
+# ((S) or (R)).
+#--------------------------------------------------------------------------------------------
+
+def point_result_labels():
+    serving, returning = [], []
+    coordinates = np.zeros((n_point_states, 2, 2), dtype=np.int64)
+    known = np.zeros((n_point_states, 2), dtype=bool)
+    for code, game_state in enumerate(point_labels):
+        for tiebreak in [0, 1]:
+            if game_state in coordinate_states:
+                x, y = coordinate_states[game_state]
+            elif game_state.startswith('Server '):
+                g1, g2 = game_state[7:].split('-')
+                x, y = int(g1) + int(g2), int(g1) - int(g2)
+            else:
+                serving.append(game_state)
+                returning.append(game_state)
+                continue
+            coordinates[code, tiebreak] = x, y
+            known[code, tiebreak] = True
+
+            serve_score = game_state[7:] if 'Server' in game_state else game_state
+            if 'Start of Game' not in game_state:
+                score1, score2 = game_state[7:].split('-')
+                return_score = score2 + '-' + score1
+            else:
+                return_score = game_state
+            if tiebreak:
+                serve_score = game_state[7:] + (' (R)' if x % 4 == 1 or x % 4 == 2 else ' (S)')
+                return_score = return_score + (' (S)' if x % 4 == 1 or x % 4 == 2 else ' (R)')
+            serving.append(serve_score)
+            returning.append(return_score)
+
+    shape = (n_point_states, 2)
+    return np.array(serving, dtype=object).reshape(shape), np.array(returning, dtype=object).reshape(shape), \
+           coordinates, known
+
+#--------------------------------------------------------------------------------------------
+# Turns counts per state (see state_counts) into the match win % table: a 'Serving' row for
+# every state, each followed by the mirrored 'Returning' row (scores from the returner's
+# view, 1 - % win and -Y). States that were never won by the server have a % win of 0.
+#
+# If the counts are split by a group (the index level before 'State'), it comes first in
+# the table under group_name; with mirror_group, groups such as 'A vs. B' are mirrored to
+# 'B vs. A' on the returning rows.
+#--------------------------------------------------------------------------------------------
+
+result_columns = ['Set Score', 'Game Score', 'Serving at Start of Game?', 'Point Score', '% Win',
+                  'Number of Instances', 'Points Elapsed', 'Y']
+
+
+def mirror_matchups(matchups):
+    codes, uniques = pd.factorize(matchups)
+    mirrored = np.array([' vs. '.join(x.split(' vs. ')[::-1]) for x in uniques], dtype=object)
+    return mirrored[codes]
+
+
+def interleave(serve_values, return_values):
+    serve_values = np.asarray(serve_values)
+    values = np.empty(2 * len(serve_values), dtype=serve_values.dtype)
+    values[0::2] = serve_values
+    values[1::2] = return_values
+    return values
+
+
+def win_pct_data(counts, group_name=None, mirror_group=False):
+    counts = counts.assign(**{'State ID': counts.index.get_level_values('State')})
+    counts = expand_state_index(counts)
+    parts = state_parts(counts['State ID'].values)
+    set_code = parts['Set Score Server View']
+    game_code = parts['Game Score Server View']
+    point_code = parts['Game State New']
+    tiebreak = (point_code >= len(game_state_labels)).astype(np.int64)
+
+    serving, returning, coordinates, known = point_result_labels()
+    if not known[point_code, tiebreak].all():
+        raise ValueError('Game state without coordinates')
+    x = coordinates[point_code, tiebreak, 0]
+    y = coordinates[point_code, tiebreak, 1]
+
+    instances = counts['Instances'].values.astype(np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        win_pct = 1.0 * counts['Wins'].values.astype(np.float64) / instances.astype(np.float64)
+    win_pct[instances == 0] = 0.
+    set_mirror = (set_code % max_sets) * max_sets + set_code // max_sets
+    game_mirror = (game_code % max_games) * max_games + game_code // max_games
+
+    n = len(counts)
+    table = pd.DataFrame({
+        'Set Score': interleave(set_labels[set_code], set_labels[set_mirror]),
+        'Game Score': interleave(game_labels[game_code], game_labels[game_mirror]),
+        'Serving at Start of Game?': interleave(np.repeat('Serving', n).astype(object),
+                                                np.repeat('Returning', n).astype(object)),
+        'Point Score': interleave(serving[point_code, tiebreak], returning[point_code, tiebreak]),
+        '% Win': interleave(win_pct, 1.0 - win_pct),
+        'Number of Instances': interleave(instances, instances),
+        'Points Elapsed': interleave(x, x),
+        'Y': interleave(y, -1 * y)}, columns=result_columns)
+
+    if group_name is not None:
+        group = counts.index.get_level_values(0).values
+        mirrored = mirror_matchups(group) if mirror_group else group
+        table.insert(0, group_name, interleave(group.astype(object), mirrored.astype(object)))
+    return table
@@ -0,0 +1,272 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Slam_Points.py
+#
+# Description: This module reads Jeff Sackmann's Grand Slam point-by-point files
+# (tennis_slam_pointbypoint-master), which hold one row per point with the score after the
+# point, the server and point winner, and serve and rally data. The points files are read
+# in chunks with only the needed columns and compact types, joined to the matching
+# *-matches.csv file, and mapped onto the same point data columns that Tennis_PBP_Engine
+# produces from the pbp strings, so the slam matches can go through the same validation,
+# state coding and point store as the rest of the data.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import numpy as np
+import pandas as pd
+import os
+from Tennis_PBP_Engine import pts, resolve_formats, validate_matches
+
+slam_path = 'tennis_slam_pointbypoint-master/'
+slams = ['ausopen', 'frenchopen', 'wimbledon', 'usopen']
+
+#--------------------------------------------------------------------------------------------
+# Columns read from the points files, with the types they are read with. Columns that are
+# blank on some rows are read as float32 and converted once the blank rows are dropped.
+# slam_features are the optional per-point columns that can be carried over to the point
+# data, under the given names.
+#--------------------------------------------------------------------------------------------
+
+slam_point_dtypes = {'match_id': str,
+                     'SetWinner': np.int8,
+                     'GameWinner': np.int8,
+                     'P1GamesWon': np.float32,
+                     'P2GamesWon': np.float32,
+                     'PointWinner': np.float32,
+                     'PointServer': np.float32,
+                     'P1Score': str,
+                     'P2Score': str,
+                     'P1Ace': np.int8,
+                     'P2Ace': np.int8,
+                     'P1DoubleFault': np.int8,
+                     'P2DoubleFault': np.int8}
+
+slam_features = {'Speed_KMH': ('Serve Speed', np.float32),
+                 'Rally': ('Rally', np.float32),
+                 'ServeIndicator': ('Serve Number', np.float32)}
+
+slam_match_columns = ['match_id', 'year', 'slam', 'match_num', 'player1', 'player2']
+
+#--------------------------------------------------------------------------------------------
+# The tournament names used for the slam matches, as in the pbp files, by slam and by draw
+# (match numbers 1xxx are the men's singles and 2xxx the women's singles). The names decide
+# the match format (see tourney_formats in Tennis_PBP_Engine).
+#--------------------------------------------------------------------------------------------
+
+slam_tourneys = {('ausopen', 1): "Men'sAustralianOpen", ('ausopen', 2): "Women'sAustralianOpen",
+                 ('frenchopen', 1): "Men'sFrenchOpen", ('frenchopen', 2): "Women'sFrenchOpen",
+                 ('wimbledon', 1): "Gentlemen'sWimbledonSingles", ('wimbledon', 2): "Ladies'WimbledonSingles",
+                 ('usopen', 1): "Men'sUSOpen", ('usopen', 2): "Women'sUSOpen"}
+
+slam_tours = {1: 'atp', 2: 'wta'}
+
+score_values = {'0': 0, '15': 15, '30': 30, '40': 40, 'AD': 45}
+
+#--------------------------------------------------------------------------------------------
+# Lists the slam files that have both a points and a matches file, as '<year>-<slam>'
+# names, optionally restricted to some years and slams.
+#--------------------------------------------------------------------------------------------
+
+def slam_catalog(years=None, slam_names=None):
+    names = sorted(x[:-len('-points.csv')] for x in os.listdir(slam_path) if x.endswith('-points.csv'))
+    names = [x for x in names if os.path.exists(slam_path + x + '-matches.csv')]
+    return [x for x in names if (years is None or int(x.split('-')[0]) in years) and
+                                (slam_names is None or x.split('-')[1] in slam_names)]
+
+#--------------------------------------------------------------------------------------------
+# Reads the points file of one slam in chunks of chunk_size rows. Only whole matches are
+# yielded: the rows of the last match of a chunk are held back and put in front of the next
+# chunk, since the rows of a match are contiguous in the files.
+#--------------------------------------------------------------------------------------------
+
+def iter_slam_chunks(name, features=[], chunk_size=100000):
+    dtypes = dict(slam_point_dtypes)
+    dtypes.update((x, slam_features[x][1]) for x in features)
+    reader = pd.read_csv(slam_path + name + '-points.csv', usecols=list(dtypes), dtype=dtypes,
+                         chunksize=chunk_size)
+    pending = None
+    for chunk in reader:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], axis=0, ignore_index=True)
+        ids = chunk['match_id'].values
+        complete = ids != ids[-1]
+        pending = chunk[~complete]
+        if complete.any():
+            yield chunk[complete]
+    if pending is not None and len(pending) > 0:
+        yield pending
+
+#--------------------------------------------------------------------------------------------
+# Builds the score line of every match ('6-3 6-7(5) 7-5', from the winner's view) from the
+# game scores of the points that ended a set. The tiebreak points of the loser of a 7-6 set
+# are the loser's score before the last point.
+#--------------------------------------------------------------------------------------------
+
+def slam_scores(match, set_end, games1, games2, before1, before2, winner, n):
+    sets = [[] for x in range(n)]
+    for i in np.flatnonzero(set_end):
+        m = match[i]
+        won, lost = (games1[i], games2[i]) if winner[m] == 1 else (games2[i], games1[i])
+        text = str(won) + '-' + str(lost)
+        if max(won, lost) == 7 and min(won, lost) == 6:
+            text = text + '(' + str(min(before1[i], before2[i])) + ')'
+        sets[m].append(text)
+    return np.array([' '.join(x) for x in sets], dtype=object)
+
+#--------------------------------------------------------------------------------------------
+# Maps a chunk of whole matches onto the point data columns. A row of the points file holds
+# the score after its point, while a row of the point data holds the score the point was
+# played at, so every score is taken from the row before (0-0 for the first point, and 0-0
+# in games after a set was won). 'Server' is the server of the point and 'Result' is the
+# outcome of the point before, coded like the pbp strings ('S', 'A', 'R', 'D', or ';', '.'
+# and '/' when the point before ended a game, a set or a service turn in a tiebreak). Player 1
+# is player1 of the matches file, who does not always serve first.
+#
+# Returns the point data (with the requested features) and the per-match frame, which is
+# used to validate the matches.
+#--------------------------------------------------------------------------------------------
+
+def slam_point_frame(points, matches, features=[]):
+    # Rows without a server are the header rows of the 2011 files and blank trailing rows
+    points = points[points['PointServer'].fillna(0).values > 0]
+    ids = points['match_id'].values
+    first = np.concatenate(([True], ids[1:] != ids[:-1])) if len(ids) > 0 else np.zeros(0, dtype=bool)
+    match = np.cumsum(first) - 1
+    info = matches.set_index('match_id').loc[ids[first]].reset_index()
+    n = len(info)
+
+    prev = np.concatenate(([0], np.arange(len(ids) - 1)))
+    def before(values, reset):
+        values = np.asarray(values)
+        return np.where(first | reset, 0, values[prev])
+
+    set_won1 = (points['SetWinner'].values == 1).astype(np.int64)
+    set_won2 = (points['SetWinner'].values == 2).astype(np.int64)
+    set_end = points['SetWinner'].values != 0
+    game_end = points['GameWinner'].values != 0
+    starts = np.flatnonzero(first)
+    sets1, sets2 = np.cumsum(set_won1) - set_won1, np.cumsum(set_won2) - set_won2
+    sets1 = sets1 - np.repeat(sets1[starts], np.diff(np.append(starts, len(ids))))
+    sets2 = sets2 - np.repeat(sets2[starts], np.diff(np.append(starts, len(ids))))
+
+    games1 = np.nan_to_num(points['P1GamesWon'].values).astype(np.int64)
+    games2 = np.nan_to_num(points['P2GamesWon'].values).astype(np.int64)
+    score1 = pd.Series(points['P1Score'].values).map(score_values)
+    score2 = pd.Series(points['P2Score'].values).map(score_values)
+    score1 = np.where(score1.isnull(), pd.to_numeric(points['P1Score'].values, errors='coerce'), score1)
+    score2 = np.where(score2.isnull(), pd.to_numeric(points['P2Score'].values, errors='coerce'), score2)
+    score1, score2 = np.nan_to_num(score1).astype(np.int64), np.nan_to_num(score2).astype(np.int64)
+    server = points['PointServer'].values.astype(np.int64)
+    point_winner = np.nan_to_num(points['PointWinner'].values).astype(np.int64)
+
+    shifted_set_end = np.concatenate(([False], set_end[:-1]))
+    columns = {'Match': match,
+               'p1Set': sets1, 'p2Set': sets2,
+               'p1Game': before(games1, shifted_set_end), 'p2Game': before(games2, shifted_set_end),
+               'p1Score': before(score1, np.zeros(len(ids), dtype=bool)),
+               'p2Score': before(score2, np.zeros(len(ids), dtype=bool)),
+               'Server': server}
+
+    # The match winner is the player who won the sets needed for the match
+    best_of = np.where(info['match_num'].values // 1000 == 1, 5, 3)
+    total1 = np.bincount(match, weights=set_won1, minlength=n).astype(np.int64)
+    total2 = np.bincount(match, weights=set_won2, minlength=n).astype(np.int64)
+    winner = np.where(total1 > total2, 1, 2)
+    info['Winner'] = winner
+    info['Complete'] = np.maximum(total1, total2) == best_of // 2 + 1
+    info['Missing Points'] = np.bincount(match, weights=point_winner == 0, minlength=n) > 0
+    info['Score'] = slam_scores(match, set_end, games1, games2, columns['p1Score'], columns['p2Score'],
+                                winner, n)
+    draw = info['match_num'].values // 1000
+    info['Tourney'] = [slam_tourneys[(s, d)] for s, d in zip(info['slam'], draw)]
+    info['Tour'] = [slam_tours[d] for d in draw]
+
+    served = point_winner == server
+    ace = ((server == 1) & (points['P1Ace'].values == 1)) | ((server == 2) & (points['P2Ace'].values == 1))
+    double = ((server == 1) & (points['P1DoubleFault'].values == 1)) | \
+             ((server == 2) & (points['P2DoubleFault'].values == 1))
+    result = np.where(served, np.where(ace, 'A', 'S'), np.where(double, 'D', 'R')).astype(object)
+    result = np.where(set_end, '.', np.where(game_end, ';', result))
+    result = result[prev]
+    result[np.concatenate(([False], (server[1:] != server[:-1]) & ~game_end[:-1]))] = '/'
+    result[first] = ''
+
+    # Two-digit years, as the pbp engine takes them from the match date ('15')
+    years = np.array(['%02d' % (int(x) % 100) for x in info['year'].values], dtype=object)
+    point_data = pd.DataFrame({
+        'Player 1': info['player1'].values[match],
+        'Player 2': info['player2'].values[match],
+        'Winner': winner[match],
+        'p1Set': columns['p1Set'], 'p2Set': columns['p2Set'],
+        'p1Game': columns['p1Game'], 'p2Game': columns['p2Game'],
+        'p1Score': columns['p1Score'], 'p2Score': columns['p2Score'],
+        'Server': server,
+        'Points': [pts] * len(ids),
+        'Result': result,
+        'Score': info['Score'].values[match],
+        'Year': years[match],
+        'Tourney': info['Tourney'].values[match],
+        'MatchNum': info['match_num'].values[match]})
+    point_data = point_data[['Player 1', 'Player 2', 'Winner', 'p1Set', 'p2Set', 'p1Game', 'p2Game',
+                             'p1Score', 'p2Score', 'Server', 'Points', 'Result', 'Score',
+                             'Year', 'Tourney', 'MatchNum']]
+    for x in features:
+        point_data[slam_features[x][0]] = points[x].values
+    return point_data, columns, info
+
+#--------------------------------------------------------------------------------------------
+# Validates the matches of a chunk with the same checks as the pbp data (validate_matches in
+# Tennis_PBP_Engine, using the format of each slam and draw), and also flags matches that
+# were not finished (e.g. retirements) or that have points without a winner.
+#--------------------------------------------------------------------------------------------
+
+def validate_slam_matches(columns, info):
+    reasons = validate_matches(columns, len(info), resolve_formats(info['Tourney'].values))
+    for flagged, reason in [(~info['Complete'].values, 'Incomplete match'),
+                            (info['Missing Points'].values, 'Missing point winner')]:
+        bad = np.flatnonzero(flagged)
+        reasons[bad] = [x + '; ' + reason if x != '' else reason for x in reasons[bad]]
+    return reasons
+
+#--------------------------------------------------------------------------------------------
+# Streams the point data of the slam files in the catalog, one chunk of whole matches at a
+# time, like iter_point_data in Tennis_PBP_Project. Flagged matches are dropped and added to
+# the rejected list that is passed in. Every point is tagged with its file ('Source'), its
+# tour ('atp' or 'wta') and level ('atp_slam' or 'wta_slam'). best_of selects the men's
+# best-of-5 matches (5), the women's best-of-3 matches (3), or both (None).
+#--------------------------------------------------------------------------------------------
+
+def iter_slam_point_data(catalog=None, rejected=None, features=[], best_of=None, chunk_size=100000):
+    catalog = slam_catalog() if catalog is None else catalog
+    for name in catalog:
+        matches = pd.read_csv(slam_path + name + '-matches.csv', usecols=slam_match_columns,
+                              dtype={'match_id': str})
+        for points in iter_slam_chunks(name, features, chunk_size):
+            point_data, columns, info = slam_point_frame(points, matches, features)
+            reasons = validate_slam_matches(columns, info)
+            keep = reasons == ''
+            if best_of is not None:
+                keep = keep & (np.where(info['match_num'].values // 1000 == 1, 5, 3) == best_of)
+            if rejected is not None:
+                invalid = np.flatnonzero(reasons != '')
+                rejected.append(pd.DataFrame({'Source': name,
+                                              'MatchNum': info['match_num'].values[invalid],
+                                              'Tourney': info['Tourney'].values[invalid],
+                                              'Date': info['year'].astype(str).values[invalid],
+                                              'Player 1': info['player1'].values[invalid],
+                                              'Player 2': info['player2'].values[invalid],
+                                              'Reason': reasons[invalid]},
+                                             columns=['Source', 'MatchNum', 'Tourney', 'Date',
+                                                      'Player 1', 'Player 2', 'Reason']))
+            point_data = point_data[keep[columns['Match']]]
+            point_data['Level'] = info['Tour'].values[columns['Match']][keep[columns['Match']]] + '_slam'
+            point_data['Tour'] = info['Tour'].values[columns['Match']][keep[columns['Match']]]
+            point_data['Source'] = name
+            yield point_data
+
+
+def read_slam_point_data(catalog=None, features=[], best_of=None, chunk_size=100000):
+    rejected = []
+    point_data = pd.concat(list(iter_slam_point_data(catalog, rejected, features, best_of, chunk_size)),
+                           axis=0, ignore_index=True)
+    return point_data, pd.concat(rejected, axis=0, ignore_index=True)
@@ -0,0 +1,101 @@
+#--------------------------------------------------------------------------------------------
+# Project: Tennis_Stage_Report.py
+#
+# Description: This module runs the steps of a data pipeline as named stages and records,
+# for every stage, its wall time, its peak memory, the rows of the frames that go in and
+# come out, and the reasons rows were dropped. The records are written as a JSON report, so
+# that a refresh that suddenly runs slower or loses rows can be traced to the stage that
+# did it, and reports of two runs can be compared.
+#--------------------------------------------------------------------------------------------
+
+# Import Packages
+
+import pandas as pd
+import resource
+import json
+import time
+
+#--------------------------------------------------------------------------------------------
+# Peak memory. On Linux the peak resident memory of the process (VmHWM) is reset at the
+# start of every stage, so the peak of a stage is its own. Elsewhere only the peak of the
+# whole process (ru_maxrss) is known, and the report says so.
+#--------------------------------------------------------------------------------------------
+
+def reset_peak_memory():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def peak_memory_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+#--------------------------------------------------------------------------------------------
+# Rows of every frame among the named values. Values that are not frames are left out.
+#--------------------------------------------------------------------------------------------
+
+def frame_rows(names, values):
+    return dict((name, len(value)) for name, value in zip(names, values)
+                if isinstance(value, pd.DataFrame))
+
+#--------------------------------------------------------------------------------------------
+# Runs function on the values of inputs (a list of (name, value) pairs) as one stage and
+# appends its record to report. outputs names the values the function returns (a single
+# name if it returns one value). If drops is set, the function is given a dictionary as its
+# drops argument, in which it counts the rows it drops by reason. If details is set, it is
+# given a dictionary as its details argument for anything else it reports, which is kept
+# with the record. Returns what the function returns.
+#--------------------------------------------------------------------------------------------
+
+def run_stage(report, name, function, inputs, outputs, drops=False, details=False):
+    names, values = [x for x, v in inputs], [v for x, v in inputs]
+    rows_in = frame_rows(names, values)
+    reasons, notes = dict(), dict()
+    kwargs = dict()
+    if drops:
+        kwargs['drops'] = reasons
+    if details:
+        kwargs['details'] = notes
+    per_stage = reset_peak_memory()
+    start = time.time()
+    result = function(*values, **kwargs)
+    seconds = time.time() - start
+
+    if isinstance(outputs, str):
+        rows_out = frame_rows([outputs], [result])
+    else:
+        rows_out = frame_rows(outputs, result)
+    report.append({'stage': name,
+                   'seconds': round(seconds, 3),
+                   'peak_memory_mb': round(peak_memory_mb(), 1),
+                   'peak_memory_scope': 'stage' if per_stage else 'process',
+                   'rows_in': rows_in,
+                   'rows_out': rows_out,
+                   'rows_dropped': dict((x, rows_in[x] - rows_out[x]) for x in rows_in
+                                        if x in rows_out and rows_in[x] > rows_out[x]),
+                   'drop_reasons': dict((str(x), int(n)) for x, n in reasons.items() if n > 0)})
+    if details:
+        report[-1]['details'] = notes
+    return result
+
+#--------------------------------------------------------------------------------------------
+# Writes the report with the total time and the largest peak memory of its stages
+#--------------------------------------------------------------------------------------------
+
+def write_stage_report(report, path):
+    summary = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'seconds': round(sum(x['seconds'] for x in report), 3),
+               'peak_memory_mb': max([x['peak_memory_mb'] for x in report] + [0]),
+               'stages': report}
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=1, sort_keys=True)